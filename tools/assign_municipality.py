@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import math
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from city_facets import CITY_ALIASES, CityCanon
+from osm_table import COLUMNAR_SUFFIXES, OsmTable
+
+# Municipio offline para cada fila del export OSM (la mayoría no trae addr_city).
+#
+# Orden de asignación, vectorizado sobre todo el fichero:
+#   1. addr     su propio addr_city
+#   2. vecinos  voto mayoritario de las filas con addr_city en la celda y sus 8 vecinas,
+#               de la rejilla más fina a la más gruesa (NEIGHBOR_LEVELS_M). Hasta
+#               FINE_MAX_M solo cuenta si hay --min-votes y --min-share de acuerdo.
+#   3. place    centroide de núcleo más cercano (--places: export Overpass con name,
+#               place y lat/lon; solo cuentan place=city/town/village, un suburb no es
+#               municipio), hasta --place-max-km
+#   4. vecinos  niveles gruesos, por encima de FINE_MAX_M
+#
+# Las grafías se agrupan con CityCanon.split() de city_facets.py, como las facetas de la
+# app: alias (Valencia = València, Elx = Elche), "Alacant/Alicante" y "Borbotó
+# (Valencia)" van a su municipio, y se escribe la grafía más frecuente. Salida: el export con las columnas
+# municipality, municipality_source y municipality_share (acuerdo del voto, 1 = unánime).
+
+BASE_DIR = Path(__file__).resolve().parent
+
+NEIGHBOR_LEVELS_M = (150.0, 300.0, 600.0, 1200.0, 2400.0)
+FINE_MAX_M = 600.0
+MIN_VOTES = 3
+MIN_SHARE = 0.6
+PLACE_MAX_KM = 4.0
+# Valores de place= que son municipio (suburb, quarter, hamlet... no)
+PLACE_TYPES = {"city", "town", "village"}
+
+# Metros por grado de latitud (la longitud se escala por cos(lat media))
+M_PER_DEG = 111_320.0
+
+OUT_FIELDS = ["municipality", "municipality_source", "municipality_share"]
+
+
+@dataclass
+class Labels:
+    """Códigos de municipio: codes[i] = -1 si la fila no tiene addr_city."""
+
+    codes: np.ndarray
+    names: list[str]  # grafía a escribir por código
+    keys: list[str]  # clave canónica por código
+    canon: CityCanon
+
+    def code_for(self, name: str) -> int:
+        k = self.canon.split(name)[0]
+        try:
+            return self.keys.index(k)
+        except ValueError:
+            self.keys.append(k)
+            self.names.append(name)
+            return len(self.keys) - 1
+
+
+def build_labels(addr_city, place_names: Iterable[str] = ()) -> Labels:
+    """addr_city es una DictColumn: se canoniza por categoría, no por fila."""
+    # Municipios conocidos: los addr_city sin paréntesis (cada parte de "A/B") y los núcleos
+    standalone = [c for c in addr_city.categories if "(" not in c] + list(place_names)
+    canon = CityCanon(CITY_ALIASES, {p for c in standalone for p in re.split(r"\s*/\s*", c) if p.strip()})
+    keys: list[str] = []
+    spellings: list[Counter] = []
+    by_key: dict[str, int] = {}
+    cat_code = np.full(len(addr_city.categories), -1, dtype=np.int64)
+    cat_n = np.bincount(addr_city.codes, minlength=len(addr_city.categories))
+    for i, raw in enumerate(addr_city.categories):
+        if not raw.strip():
+            continue
+        k, text, _, _ = canon.split(raw)
+        if k not in by_key:
+            by_key[k] = len(keys)
+            keys.append(k)
+            spellings.append(Counter())
+        cat_code[i] = by_key[k]
+        spellings[by_key[k]][text] += int(cat_n[i])
+    names = [s.most_common(1)[0][0] for s in spellings]
+    return Labels(cat_code[addr_city.codes], names, keys, canon)
+
+
+def to_meters(lat: np.ndarray, lon: np.ndarray, lat0: float) -> tuple[np.ndarray, np.ndarray]:
+    return lon * M_PER_DEG * math.cos(math.radians(lat0)), lat * M_PER_DEG
+
+
+def cell_keys(x: np.ndarray, y: np.ndarray, size: float, dx: int = 0, dy: int = 0) -> np.ndarray:
+    cx = np.floor(x / size).astype(np.int64) + dx
+    cy = np.floor(y / size).astype(np.int64) + dy
+    return cx * (1 << 32) + (cy & 0xFFFFFFFF)
+
+
+def neighbor_vote(
+    x: np.ndarray, y: np.ndarray, codes: np.ndarray, size: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Para cada punto: (código ganador o -1, votos del ganador, votos totales) entre las
+    filas etiquetadas de su celda y las 8 vecinas. Cada etiquetada vota en las 9 celdas
+    que la tienen como vecina, así la consulta es un único searchsorted.
+    """
+    lab = np.flatnonzero(codes >= 0)
+    cells = np.concatenate(
+        [cell_keys(x[lab], y[lab], size, dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    )
+    lc = np.tile(codes[lab], 9)
+    order = np.lexsort((lc, cells))
+    cells, lc = cells[order], lc[order]
+
+    # Recuento por (celda, código)
+    new = np.ones(len(cells), dtype=bool)
+    new[1:] = (cells[1:] != cells[:-1]) | (lc[1:] != lc[:-1])
+    starts = np.flatnonzero(new)
+    g_cell, g_code = cells[starts], lc[starts]
+    g_n = np.diff(np.append(starts, len(cells)))
+
+    # Ganador por celda: mayor recuento (a igualdad, código menor: determinista)
+    order = np.lexsort((g_code, -g_n, g_cell))
+    g_cell, g_code, g_n = g_cell[order], g_code[order], g_n[order]
+    first = np.ones(len(g_cell), dtype=bool)
+    first[1:] = g_cell[1:] != g_cell[:-1]
+    u_cell = g_cell[first]
+    u_code = g_code[first]
+    u_n = g_n[first]
+    u_total = np.add.reduceat(g_n, np.flatnonzero(first)) if len(g_n) else g_n
+
+    q = cell_keys(x, y, size)
+    pos = np.searchsorted(u_cell, q)
+    pos = np.minimum(pos, max(len(u_cell) - 1, 0))
+    hit = (u_cell[pos] == q) if len(u_cell) else np.zeros(len(q), dtype=bool)
+    win = np.where(hit, u_code[pos] if len(u_cell) else -1, -1)
+    votes = np.where(hit, u_n[pos] if len(u_cell) else 0, 0)
+    total = np.where(hit, u_total[pos] if len(u_cell) else 0, 0)
+    return win, votes, total
+
+
+def read_places(path: Path) -> tuple[list[str], np.ndarray, np.ndarray]:
+    names, lat, lon = [], [], []
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        if "place" not in (reader.fieldnames or []):
+            raise ValueError(f"{path}: falta la columna place (cabecera: {reader.fieldnames})")
+        for row in reader:
+            if (row.get("place") or "").strip() not in PLACE_TYPES:
+                continue
+            name = (row.get("name") or "").strip()
+            try:
+                la = float(row.get("lat") or row.get("@lat") or "")
+                lo = float(row.get("lon") or row.get("@lon") or "")
+            except ValueError:
+                continue
+            if name:
+                names.append(name)
+                lat.append(la)
+                lon.append(lo)
+    return names, np.array(lat, dtype=np.float64), np.array(lon, dtype=np.float64)
+
+
+def nearest_place(
+    x: np.ndarray, y: np.ndarray, px: np.ndarray, py: np.ndarray, max_m: float, chunk: int = 20_000
+) -> np.ndarray:
+    """Índice del centroide más cercano (o -1 si pasa de max_m). Por bloques: n x places floats."""
+    out = np.full(len(x), -1, dtype=np.int64)
+    if not len(px):
+        return out
+    for a in range(0, len(x), chunk):
+        d2 = (x[a : a + chunk, None] - px[None, :]) ** 2 + (y[a : a + chunk, None] - py[None, :]) ** 2
+        j = np.argmin(d2, axis=1)
+        ok = d2[np.arange(len(j)), j] <= max_m * max_m
+        out[a : a + chunk] = np.where(ok, j, -1)
+    return out
+
+
+def assign(
+    table: OsmTable,
+    places: Optional[tuple[list[str], np.ndarray, np.ndarray]] = None,
+    min_votes: int = MIN_VOTES,
+    min_share: float = MIN_SHARE,
+    place_max_km: float = PLACE_MAX_KM,
+    max_km: float = NEIGHBOR_LEVELS_M[-1] / 1000,
+) -> tuple[Labels, np.ndarray, np.ndarray, np.ndarray]:
+    """(labels, código por fila, fuente por fila, acuerdo por fila). Fuente: 0 nada, 1 addr, 2 vecinos, 3 place."""
+    labels = build_labels(table.addr_city, places[0] if places is not None else ())
+    n = len(table)
+    code = labels.codes.copy()
+    source = np.where(code >= 0, 1, 0).astype(np.int8)
+    share = np.where(code >= 0, 1.0, 0.0)
+    if not n:
+        return labels, code, source, share
+
+    lat0 = float(np.median(table.lat))
+    x, y = to_meters(table.lat, table.lon, lat0)
+
+    def run_levels(levels, strict: bool) -> None:
+        for size in levels:
+            todo = np.flatnonzero(code < 0)
+            if not len(todo):
+                return
+            win, votes, total = neighbor_vote(x, y, labels.codes, size)
+            win, votes, total = win[todo], votes[todo], total[todo]
+            sh = np.divide(votes, total, out=np.zeros(len(todo)), where=total > 0)
+            ok = win >= 0
+            if strict:
+                ok &= (votes >= min_votes) & (sh >= min_share)
+            code[todo[ok]] = win[ok]
+            source[todo[ok]] = 2
+            share[todo[ok]] = sh[ok]
+
+    levels = [s for s in NEIGHBOR_LEVELS_M if s <= max_km * 1000]
+    run_levels([s for s in levels if s <= FINE_MAX_M], strict=True)
+
+    if places is not None and len(places[0]):
+        names, plat, plon = places
+        pcode = np.array([labels.code_for(nm) for nm in names], dtype=np.int64)
+        px, py = to_meters(plat, plon, lat0)
+        todo = np.flatnonzero(code < 0)
+        j = nearest_place(x[todo], y[todo], px, py, place_max_km * 1000)
+        ok = j >= 0
+        code[todo[ok]] = pcode[j[ok]]
+        source[todo[ok]] = 3
+        share[todo[ok]] = 1.0
+
+    run_levels([s for s in levels if s > FINE_MAX_M], strict=False)
+    return labels, code, source, share
+
+
+SOURCE_NAMES = ["", "addr", "neighbors", "place"]
+
+
+def write_output(table: OsmTable, labels: Labels, code: np.ndarray, source: np.ndarray, share: np.ndarray, dst: Path) -> None:
+    names = labels.names
+    if dst.suffix.lower() in COLUMNAR_SUFFIXES:
+        import pyarrow as pa
+
+        at = table.to_arrow()
+        cats = pa.array(names + [""], pa.string())
+        idx = np.where(code >= 0, code, len(names)).astype(np.int32)
+        at = at.append_column("municipality", pa.DictionaryArray.from_arrays(pa.array(idx), cats))
+        at = at.append_column("municipality_source", pa.DictionaryArray.from_arrays(pa.array(source.astype(np.int32)), pa.array(SOURCE_NAMES)))
+        at = at.append_column("municipality_share", pa.array(np.round(share, 3)))
+        tmp = dst.with_name(dst.name + ".tmp")
+        if dst.suffix.lower() in (".parquet", ".pq"):
+            import pyarrow.parquet as pq
+
+            pq.write_table(at, tmp, compression="zstd")
+        else:
+            with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, at.schema) as w:
+                w.write_table(at)
+        tmp.replace(dst)
+        return
+
+    from osm_table import CSV_FIELDS
+
+    tmp = dst.with_name(dst.name + ".tmp")
+    codes, srcs, shs = code.tolist(), source.tolist(), share.tolist()
+    with tmp.open("w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=CSV_FIELDS + OUT_FIELDS)
+        w.writeheader()
+        for i, row in enumerate(table.iter_rows()):
+            row["municipality"] = names[codes[i]] if codes[i] >= 0 else ""
+            row["municipality_source"] = SOURCE_NAMES[srcs[i]]
+            row["municipality_share"] = f"{shs[i]:.3f}" if srcs[i] else ""
+            w.writerow(row)
+    tmp.replace(dst)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Asigna municipio a las filas OSM sin addr_city (vecinos etiquetados + centroides)")
+    ap.add_argument("src", help="osm_venues_import.csv / .parquet / .arrow")
+    ap.add_argument("dst", help="Salida (formato por extensión) con municipality, municipality_source, municipality_share")
+    ap.add_argument("--places", default="", help="CSV de núcleos (name, place, lat/lon o @lat/@lon)")
+    ap.add_argument("--place-max-km", type=float, default=PLACE_MAX_KM)
+    ap.add_argument("--max-km", type=float, default=NEIGHBOR_LEVELS_M[-1] / 1000, help="Celda más gruesa de vecinos")
+    ap.add_argument("--min-votes", type=int, default=MIN_VOTES)
+    ap.add_argument("--min-share", type=float, default=MIN_SHARE)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    table = OsmTable.read(args.src)
+    places = read_places(Path(args.places)) if args.places else None
+    t1 = time.perf_counter()
+    labels, code, source, share = assign(
+        table, places, min_votes=args.min_votes, min_share=args.min_share, place_max_km=args.place_max_km, max_km=args.max_km
+    )
+    t2 = time.perf_counter()
+    write_output(table, labels, code, source, share, Path(args.dst))
+    t3 = time.perf_counter()
+
+    n = len(table)
+    counts = np.bincount(source, minlength=len(SOURCE_NAMES))
+    print(f"Filas: {n} | municipios: {len(labels.names)} (carga {t1 - t0:.2f}s, asignación {t2 - t1:.2f}s, escritura {t3 - t2:.2f}s)")
+    for i, name in enumerate(SOURCE_NAMES):
+        label = name or "sin asignar"
+        print(f"  {label}: {int(counts[i])} ({100 * counts[i] / max(n, 1):.1f}%)")
+    print(f"Generado: {args.dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+# Benchmark de las etapas offline sobre datos de synth_data.py.
+#
+# Cada etapa corre en su propio proceso para medir su pico de RSS (wait4) sin
+# arrastrar el de las anteriores. Se guarda tiempo, filas/s, RSS y un checksum de
+# sus salidas en --history; con la misma semilla el checksum debe repetirse, así
+# que un cambio de checksum es un cambio de comportamiento, no de rendimiento.
+#
+#   python bench_stages.py --osm-rows 1000000 --venue-rows 100000
+#
+# Sale con código 1 si alguna etapa falla o empeora más de --tolerance respecto
+# a la última ejecución comparable (misma etapa, tamaño y semilla).
+
+BASE_DIR = Path(__file__).resolve().parent
+WORK_DIR = BASE_DIR / "bench"
+HISTORY = "bench_history.csv"
+
+HISTORY_FIELDS = [
+    "ts", "stage", "rows", "seed", "wall_s", "rows_per_s", "peak_rss_mb", "checksum", "exit_code", "verdict",
+]
+
+
+@dataclass
+class Stage:
+    name: str
+    argv: list[str]
+    rows: int
+    outputs: list[str] = field(default_factory=list)
+    # Sin salidas deterministas (p.ej. solo imprime): checksum de stdout
+    checksum_stdout: bool = False
+
+
+@dataclass
+class StageResult:
+    stage: Stage
+    wall_s: float
+    peak_rss_mb: float
+    exit_code: int
+    checksum: str
+
+    @property
+    def rows_per_s(self) -> float:
+        return self.stage.rows / self.wall_s if self.wall_s > 0 else 0.0
+
+
+def _tool(script: str) -> list[str]:
+    return [sys.executable, str(BASE_DIR / script)]
+
+
+def build_stages(osm_rows: int, venue_rows: int, seed: int) -> list[Stage]:
+    ovp = f"synth_overpass_{osm_rows}_s{seed}.csv"
+    osm = f"synth_osm_import_{osm_rows}_s{seed}.csv"
+    ven = f"synth_venues_{venue_rows}_s{seed}.csv"
+    db = f"synth_coords_{venue_rows}_s{seed}.sqlite"
+    return [
+        Stage("gen_overpass", _tool("synth_data.py") + ["overpass", "--rows", str(osm_rows), "--seed", str(seed), "--out", ovp], osm_rows, [ovp]),
+        Stage(
+            "gen_venues",
+            _tool("synth_data.py") + ["venues", "--rows", str(venue_rows), "--seed", str(seed + 1), "--with-coords", "--out", ven],
+            venue_rows,
+            [ven],
+        ),
+        Stage("prep_overpass", _tool("prep_overpass_csv.py") + [ovp, osm], osm_rows, [osm]),
+        Stage("coords_qa", _tool("coords_qa.py") + [ven, "--out", "bench_qa_report.csv"], venue_rows, ["bench_qa_report.csv"]),
+        Stage(
+            "revalidate",
+            _tool("revalidate_coords.py")
+            + ["--input", ven, "--osm", osm, "--out", "bench_drift_report.csv", "--out-queue", "bench_drift_queue.csv"],
+            venue_rows,
+            ["bench_drift_report.csv", "bench_drift_queue.csv"],
+        ),
+        Stage("store_import", _tool("coord_store.py") + ["--db", db, "import", ven], venue_rows),
+        Stage("store_export", _tool("coord_store.py") + ["--db", db, "export", "--out", "bench_best.csv"], venue_rows, ["bench_best.csv"]),
+        Stage(
+            "plan_only",
+            _tool("geocode_by_address.py") + ["--input", ven, "--gazetteer", osm, "--plan-only"],
+            venue_rows,
+            checksum_stdout=True,
+        ),
+    ]
+
+
+def file_checksum(paths: list[Path]) -> str:
+    h = hashlib.sha256()
+    for p in paths:
+        if not p.exists():
+            h.update(b"<missing>")
+            continue
+        with p.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def run_stage(stage: Stage, work: Path) -> StageResult:
+    log = work / f"{stage.name}.log"
+    t0 = time.perf_counter()
+    with log.open("wb") as out:
+        proc = subprocess.Popen(stage.argv, cwd=work, stdout=out, stderr=subprocess.STDOUT)
+        # wait4 da el rusage de ese hijo en concreto (ru_maxrss en KB en Linux)
+        _, status, ru = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - t0
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    outputs = [log] if stage.checksum_stdout else [work / o for o in stage.outputs]
+    return StageResult(
+        stage=stage,
+        wall_s=wall,
+        peak_rss_mb=ru.ru_maxrss / 1024.0,
+        exit_code=proc.returncode,
+        checksum=file_checksum(outputs) if outputs else "",
+    )
+
+
+def load_history(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    with path.open("r", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def previous(history: list[dict], stage: str, rows: int, seed: int) -> Optional[dict]:
+    for h in reversed(history):
+        if h["stage"] == stage and h["rows"] == str(rows) and h["seed"] == str(seed) and h["exit_code"] == "0":
+            return h
+    return None
+
+
+def verdict(res: StageResult, prev: Optional[dict], tolerance: float) -> str:
+    if res.exit_code != 0:
+        return "FAILED"
+    if prev is None:
+        return "NEW"
+    flags = []
+    if res.rows_per_s < float(prev["rows_per_s"]) * (1 - tolerance):
+        flags.append("SLOWER")
+    if res.peak_rss_mb > float(prev["peak_rss_mb"]) * (1 + tolerance):
+        flags.append("MORE_RSS")
+    if prev["checksum"] and res.checksum != prev["checksum"]:
+        flags.append("CHANGED")
+    return "|".join(flags) or "OK"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de las etapas offline con datos sintéticos")
+    ap.add_argument("--osm-rows", type=int, default=200_000)
+    ap.add_argument("--venue-rows", type=int, default=20_000)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--stages", nargs="*", default=[], help="Subconjunto de etapas (por defecto todas)")
+    ap.add_argument("--workdir", default=str(WORK_DIR))
+    ap.add_argument("--history", default="", help=f"CSV acumulado de resultados (por defecto <workdir>/{HISTORY})")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento admitido en filas/s y RSS")
+    ap.add_argument("--keep-data", action="store_true", help="No regenera los CSV sintéticos si ya existen")
+    args = ap.parse_args()
+
+    work = Path(args.workdir)
+    work.mkdir(parents=True, exist_ok=True)
+    hist_path = Path(args.history) if args.history else work / HISTORY
+    history = load_history(hist_path)
+
+    stages = build_stages(args.osm_rows, args.venue_rows, args.seed)
+    if args.stages:
+        unknown = set(args.stages) - {s.name for s in stages}
+        if unknown:
+            ap.error(f"Etapas desconocidas: {', '.join(sorted(unknown))}")
+        stages = [s for s in stages if s.name in args.stages]
+
+    # El store se importa desde cero en cada ejecución
+    for s in stages:
+        if s.name == "store_import":
+            for p in work.glob(f"synth_coords_{args.venue_rows}_s{args.seed}.sqlite*"):
+                p.unlink()
+
+    ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+    bad = 0
+    rows_out = []
+    print(f"{'etapa':<14} {'filas':>10} {'s':>8} {'filas/s':>10} {'RSS MB':>8}  checksum          veredicto")
+    for s in stages:
+        if args.keep_data and s.name.startswith("gen_") and all((work / o).exists() for o in s.outputs):
+            continue
+        res = run_stage(s, work)
+        v = verdict(res, previous(history, s.name, s.rows, args.seed), args.tolerance)
+        if v not in ("OK", "NEW"):
+            bad += 1
+        print(
+            f"{s.name:<14} {s.rows:>10} {res.wall_s:>8.2f} {res.rows_per_s:>10.0f} {res.peak_rss_mb:>8.1f}  "
+            f"{res.checksum or '-':<16}  {v}"
+        )
+        if res.exit_code != 0:
+            print(f"  ver {work / (s.name + '.log')}")
+        rows_out.append(
+            {
+                "ts": ts,
+                "stage": s.name,
+                "rows": s.rows,
+                "seed": args.seed,
+                "wall_s": f"{res.wall_s:.3f}",
+                "rows_per_s": f"{res.rows_per_s:.1f}",
+                "peak_rss_mb": f"{res.peak_rss_mb:.1f}",
+                "checksum": res.checksum,
+                "exit_code": res.exit_code,
+                "verdict": v,
+            }
+        )
+
+    new_file = not hist_path.exists()
+    with hist_path.open("a", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=HISTORY_FIELDS)
+        if new_file:
+            w.writeheader()
+        w.writerows(rows_out)
+    print(f"Histórico: {hist_path}")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
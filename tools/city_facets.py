@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from textnorm import norm, split_city_parts
+from sinks import CsvSink, FanOut, JsonlSink, ReplaceSqlSink
+
+# Tabla de facetas de ciudad para los pickers de la app (Explore / Home), en lugar de
+# bajar miles de filas de venues.city y deduplicar en el cliente.
+#
+# Cada valor crudo de city se canoniza:
+#   "Valencia (Campanar)"   -> municipio València, zona Campanar
+#   "Borbotó (Valencia)"    -> municipio València, zona Borbotó
+#   "Alacant/Alicante"      -> municipio Alicante
+#   "Elx (Elche)"           -> municipio Elche, sin zona
+#   "Massanassa (Horta Sud)" -> municipio Massanassa (la comarca se descarta)
+# Dentro/fuera del paréntesis, el municipio es la parte que aparece sola como ciudad en
+# el export (o en la tabla de alias); si lo son las dos, la de fuera; si ninguna, manda
+# el paréntesis, como en base_city(). Cada parte se trocea con split_city_parts() y se
+# resuelve con los alias (CITY_ALIASES + --aliases) antes de comparar: alacant, elx...
+#
+# Salida: una fila por municipio (kind=municipality) y por zona (kind=locality) con el
+# recuento de venues y los valores crudos que agrupa ("variants"), para filtrar con
+# .in("city", variants). El recuento de un municipio incluye el de sus zonas.
+
+# norm(alias) -> norm(canónico). Las grafías con/sin acento ya las iguala norm().
+CITY_ALIASES = {
+    "alacant": "alicante",
+    "elx": "elche",
+    "castello": "castellon de la plana",
+    "castello de la plana": "castellon de la plana",
+    "castellon": "castellon de la plana",
+    "valencia ciudad": "valencia",
+    "sagunto": "sagunt",
+    "jativa": "xativa",
+    "villarreal": "vila-real",
+    "vilareal": "vila-real",
+}
+
+# Comarcas que aparecen entre paréntesis ("Massanassa (Horta Sud)"): ni municipio ni zona
+COMARCAS = {
+    "horta sud", "lhorta sud", "horta nord", "lhorta nord", "horta oest", "lhorta oest", "lhorta",
+    "camp de turia", "camp de morvedre", "ribera alta", "ribera baixa", "la ribera", "safor", "la safor",
+    "costera", "la costera", "vall dalbaida", "hoya de buñol", "foia de bunyol", "marina alta",
+    "marina baixa", "alacanti", "lalacanti", "baix vinalopo", "alt vinalopo", "vinalopo mitja",
+    "baix segura", "vega baja", "plana alta", "plana baixa", "baix maestrat", "alt maestrat",
+}
+
+FACET_FIELDS = ["facet_key", "kind", "label", "parent_key", "parent_label", "venue_count", "variants"]
+
+
+def city_key(s: str) -> str:
+    k = norm(s)
+    k = re.sub(r"[\"'`´’]", "", k)
+    return re.sub(r"\s+", " ", k).strip(" .,")
+
+
+@dataclass
+class Facet:
+    key: str
+    kind: str
+    parent_key: str = ""
+    count: int = 0
+    variants: Counter = field(default_factory=Counter)
+    # Grafías vistas del propio nombre (sin paréntesis) para elegir la etiqueta
+    spellings: Counter = field(default_factory=Counter)
+
+
+class CityCanon:
+    def __init__(self, aliases: dict[str, str], known: set[str]):
+        self.aliases = aliases
+        # Claves canónicas que cuentan como municipio por sí solas
+        self.known = {self.resolve(k) for k in known} | set(aliases.values())
+
+    def resolve(self, name: str) -> str:
+        k = city_key(name)
+        return self.aliases.get(k, k)
+
+    def split(self, raw: str) -> tuple[str, str, str, str]:
+        """(municipio_key, municipio_texto, zona_key, zona_texto); zona vacía si no hay."""
+        c = (raw or "").strip()
+        inners = [p.strip() for p in re.findall(r"\((.*?)\)", c) if p.strip()]
+        outer = re.sub(r"\s*\(.*?\)\s*", " ", c).strip()
+
+        if inners and outer:
+            o_key, o_text = self._pick(outer)
+            i_key, i_text = self._pick(inners[0])
+            if i_key == o_key or i_key in COMARCAS:
+                # "Elx (Elche)": la misma ciudad dos veces; "Massanassa (Horta Sud)": comarca
+                return o_key, o_text, "", ""
+            if o_key in self.known and i_key not in self.known:
+                return o_key, o_text, i_key, i_text
+            if o_key in self.known and i_key in self.known:
+                # "Godella (Valencia)": el paréntesis es el ancla provincial, no un barrio
+                return o_key, o_text, "", ""
+            return i_key, i_text, o_key, o_text
+        text = outer or (inners[0] if inners else "")
+        key, spelled = self._pick(text)
+        return key, spelled, "", ""
+
+    def _pick(self, text: str) -> tuple[str, str]:
+        """
+        (clave, grafía) de un trozo: el texto entero si es municipio conocido ("Vila-real"),
+        si no la primera alternativa conocida de split_city_parts ("Alacant/Alicante") y,
+        si ninguna lo es, el texto entero (o su primera alternativa si viene con "/").
+        """
+        parts = split_city_parts(text)
+        for p in [text] + parts:
+            k = self.resolve(p)
+            if k in self.known:
+                return k, p.strip()
+        p = parts[0] if "/" in text and parts else text
+        return self.resolve(p), p.strip()
+
+
+def load_aliases(path: Optional[Path]) -> dict[str, str]:
+    out = dict(CITY_ALIASES)
+    if path is None:
+        return out
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            a, c = city_key(row.get("alias") or ""), city_key(row.get("canonical") or "")
+            if a and c:
+                out[a] = c
+    return out
+
+
+def read_cities(path: Path, statuses: set[str]) -> Counter:
+    """valor crudo de city -> nº de venues (filtrando por status si la columna existe)."""
+    counts: Counter = Counter()
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            if statuses and "status" in row and (row.get("status") or "").strip() not in statuses:
+                continue
+            c = (row.get("city") or "").strip()
+            if c:
+                counts[c] += 1
+    return counts
+
+
+def build_facets(raw_counts: Counter, canon: CityCanon) -> dict[str, Facet]:
+    facets: dict[str, Facet] = {}
+    for raw, n in raw_counts.items():
+        m_key, m_text, z_key, z_text = canon.split(raw)
+        if not m_key:
+            continue
+        m = facets.setdefault(m_key, Facet(m_key, "municipality"))
+        m.count += n
+        m.variants[raw] += n
+        m.spellings[m_text] += n
+        if z_key and z_key != m_key:
+            zk = f"{m_key}/{z_key}"
+            z = facets.setdefault(zk, Facet(zk, "locality", parent_key=m_key))
+            z.count += n
+            z.variants[raw] += n
+            z.spellings[z_text] += n
+    return facets
+
+
+def label_of(f: Facet) -> str:
+    # La grafía más frecuente; a igualdad, la del nombre canónico (Elche > Elx) y luego
+    # la que lleva acentos (València > Valencia)
+    own = f.key.rsplit("/", 1)[-1]
+    return max(
+        f.spellings.items(),
+        key=lambda kv: (kv[1], city_key(kv[0]) == own, any(ord(ch) > 127 for ch in kv[0]), kv[0]),
+    )[0]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Genera la tabla de facetas de ciudad (canónica + recuentos)")
+    ap.add_argument("venues", help="Export de venues (city[, status])")
+    ap.add_argument("--aliases", default="", help="CSV alias,canonical que amplía CITY_ALIASES")
+    ap.add_argument("--status", nargs="*", default=["active"], help="Status que cuentan (vacío = todos)")
+    ap.add_argument("--min-count", type=int, default=1, help="Oculta zonas con menos venues (los municipios siempre salen)")
+    ap.add_argument("--out", default="city_facets.csv")
+    ap.add_argument("--jsonl", action="store_true", help="Genera también <out>.jsonl (para empaquetar en la app)")
+    ap.add_argument("--sql", action="store_true", help="Genera también <out>.sql (reemplazo completo de city_facets)")
+    args = ap.parse_args()
+
+    raw_counts = read_cities(Path(args.venues), set(args.status))
+    aliases = load_aliases(Path(args.aliases) if args.aliases else None)
+    standalone = {c for c in raw_counts if "(" not in c}
+    canon = CityCanon(aliases, {p for c in standalone for p in re.split(r"\s*/\s*", c)})
+    facets = build_facets(raw_counts, canon)
+
+    labels = {k: label_of(f) for k, f in facets.items()}
+    out = Path(args.out)
+    sinks = [CsvSink(out, FACET_FIELDS)]
+    if args.jsonl:
+        sinks.append(JsonlSink(out.with_suffix(".jsonl"), FACET_FIELDS))
+    if args.sql:
+        sinks.append(ReplaceSqlSink(out.with_suffix(".sql"), "city_facets", FACET_FIELDS, key="facet_key"))
+
+    # Municipios por recuento y, detrás de cada uno, sus zonas
+    munis = sorted((f for f in facets.values() if f.kind == "municipality"), key=lambda f: (-f.count, labels[f.key]))
+    zones: dict[str, list[Facet]] = {}
+    for f in facets.values():
+        if f.kind == "locality" and f.count >= args.min_count:
+            zones.setdefault(f.parent_key, []).append(f)
+
+    with FanOut(sinks) as fan:
+        for m in munis:
+            for f in [m] + sorted(zones.get(m.key, []), key=lambda z: (-z.count, labels[z.key])):
+                fan.write(
+                    {
+                        "facet_key": f.key,
+                        "kind": f.kind,
+                        "label": labels[f.key],
+                        "parent_key": f.parent_key,
+                        "parent_label": labels.get(f.parent_key, ""),
+                        "venue_count": f.count,
+                        "variants": json.dumps(sorted(f.variants), ensure_ascii=False),
+                    }
+                )
+
+    n_zones = sum(len(z) for z in zones.values())
+    print(f"Valores de city: {len(raw_counts)} ({sum(raw_counts.values())} venues) -> {len(munis)} municipios, {n_zones} zonas")
+    for m in munis[:10]:
+        print(f"  {labels[m.key]}: {m.count} ({len(m.variants)} variantes)")
+    for path, kept in fan.summary():
+        print(f"Generado: {path} ({kept})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+# -----------------------------
+# Config
+# -----------------------------
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_DB = BASE_DIR / "venue_coords.sqlite"
+
+# Estados que manejamos. MANUAL = corregido a mano (gana siempre).
+STATUS_MANUAL = "MANUAL"
+STATUS_OK = "OK"
+STATUS_SUSPECT = "SUSPECT"
+STATUS_REVIEW = "REVIEW"
+STATUS_MISS = "MISS"
+
+# Un venue "asentado" ya no hace falta volver a geocodificarlo.
+SETTLED_STATUSES = {STATUS_MANUAL, STATUS_OK}
+
+# Caducidad por defecto: un OK se reaprovecha medio año; un rechazo (MISS/SUSPECT/REVIEW)
+# se reintenta a la semana, que a veces OSM ya tiene el local dado de alta.
+DEFAULT_TTL_DAYS = 180.0
+DEFAULT_RETRY_DAYS = 7.0
+
+# Campos de la fila de entrada que determinan las queries (ver row_fingerprint)
+FINGERPRINT_FIELDS = ("name", "city", "address_text", "google_maps_url")
+
+# Política de conflictos: gana el rank más alto; a igualdad, el resultado más reciente.
+# Excepción: dentro de una misma herramienta (ámbito de la huella), un resultado con otra
+# huella sustituye al mejor aunque tenga menos rank: la entrada cambió (salvo MANUAL).
+STATUS_RANK = {
+    STATUS_MANUAL: 100,
+    STATUS_OK: 50,
+    STATUS_SUSPECT: 20,
+    STATUS_REVIEW: 20,
+    STATUS_MISS: 0,
+}
+PROVIDER_RANK = {
+    "manual": 9,
+    # Mismo teléfono/web/id OSM que un local del export (exact_join.py)
+    "osm_exact": 5,
+    "nominatim_struct": 4,
+    "nominatim": 3,
+    "photon": 2,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocode_results (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    venue_id    TEXT NOT NULL,
+    lat         REAL,
+    lon         REAL,
+    status      TEXT NOT NULL,
+    provider    TEXT NOT NULL DEFAULT '',
+    query_used  TEXT NOT NULL DEFAULT '',
+    label       TEXT NOT NULL DEFAULT '',
+    run_id      TEXT NOT NULL DEFAULT '',
+    fingerprint TEXT NOT NULL DEFAULT '',
+    created_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_results_venue ON geocode_results(venue_id);
+-- Evita duplicar historial si se importa el mismo CSV dos veces
+CREATE UNIQUE INDEX IF NOT EXISTS ux_results_dedup ON geocode_results(
+    venue_id, run_id, status, provider, query_used, IFNULL(lat, 999), IFNULL(lon, 999)
+);
+
+-- Última comprobación de cada venue por herramienta (ámbito de la huella), ganara o no
+-- su resultado: de aquí sale la caducidad de reusable()
+CREATE TABLE IF NOT EXISTS checks (
+    venue_id    TEXT NOT NULL,
+    scope       TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    checked_at  REAL NOT NULL,
+    PRIMARY KEY (venue_id, scope)
+);
+
+-- Mejor coordenada conocida por venue (lookup directo por clave primaria).
+-- created_at = última vez que se comprobó el venue (aunque el nuevo resultado perdiera).
+CREATE TABLE IF NOT EXISTS best_coords (
+    venue_id    TEXT PRIMARY KEY,
+    result_id   INTEGER NOT NULL REFERENCES geocode_results(id),
+    rank        INTEGER NOT NULL,
+    created_at  REAL NOT NULL
+);
+"""
+
+
+def result_rank(status: str, provider: str, has_coords: bool) -> int:
+    if not has_coords:
+        return STATUS_RANK[STATUS_MISS]
+    return STATUS_RANK.get(status, 0) + PROVIDER_RANK.get(provider, 0)
+
+
+def row_fingerprint(row: dict, query_version: str) -> str:
+    """
+    Huella de una fila de entrada: name, city, address_text y google_maps_url normalizados
+    + la versión de la lógica que construye las queries. Si cambia cualquiera, hay que
+    re-geocodificar; si no, el resultado guardado sigue valiendo.
+
+    query_version es "<herramienta>-v<n>"; la huella lleva delante la herramienta
+    ("by_address:3f2a...") para que cada geocoder compare solo contra las suyas.
+    """
+    parts = [query_version]
+    for k in FINGERPRINT_FIELDS:
+        v = " ".join(str(row.get(k) or "").split())
+        if v.lower() in ("null", "none", "nan"):
+            v = ""
+        parts.append(v)
+    scope = re.sub(r"-v\d+$", "", query_version)
+    return f"{scope}:" + hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def fingerprint_scope(fingerprint: str) -> str:
+    """Herramienta que generó la huella ("" en huellas antiguas o importadas)."""
+    scope, sep, _ = (fingerprint or "").partition(":")
+    return scope if sep else ""
+
+
+def _float_or_none(v) -> Optional[float]:
+    s = str(v if v is not None else "").strip()
+    if not s or s.lower() in ("null", "none", "nan"):
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+@dataclass
+class StoredCoord:
+    venue_id: str
+    lat: Optional[float]
+    lon: Optional[float]
+    status: str
+    provider: str
+    query_used: str
+    label: str
+    run_id: str
+    created_at: float
+    fingerprint: str = ""
+    checked_at: float = 0.0
+
+    @property
+    def settled(self) -> bool:
+        return self.status in SETTLED_STATUSES and self.lat is not None and self.lon is not None
+
+
+class CoordStore:
+    """
+    Almacén SQLite de resultados de geocoding indexado por venue_id.
+
+    - geocode_results: histórico completo con procedencia (provider, query, label, run).
+    - best_coords: puntero al mejor resultado según STATUS_RANK/PROVIDER_RANK,
+      mantenido en cada escritura para que "mejor coordenada" sea un lookup directo.
+    """
+
+    def __init__(self, path: Path | str = DEFAULT_DB):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self.conn.executescript(SCHEMA)
+
+    def _migrate(self) -> None:
+        # DBs creadas antes de guardar la huella de la fila de entrada
+        cols = {r[1] for r in self.conn.execute("PRAGMA table_info(geocode_results)")}
+        if cols and "fingerprint" not in cols:
+            self.conn.execute("ALTER TABLE geocode_results ADD COLUMN fingerprint TEXT NOT NULL DEFAULT ''")
+            self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self) -> "CoordStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # -----------------------------
+    # Escritura
+    # -----------------------------
+
+    def record(
+        self,
+        venue_id: str,
+        lat,
+        lon,
+        status: str,
+        provider: str = "",
+        query_used: str = "",
+        label: str = "",
+        run_id: str = "",
+        created_at: Optional[float] = None,
+        commit: bool = True,
+        fingerprint: str = "",
+    ) -> bool:
+        """
+        Guarda un resultado, apunta la comprobación de su herramienta (checks) y actualiza
+        best_coords si gana la política de conflictos. Un resultado con huella distinta a
+        la del mejor actual *de la misma herramienta* lo sustituye aunque tenga menos rank:
+        la entrada cambió y la coordenada vieja ya no vale (salvo MANUAL). Contra el mejor
+        de otra herramienta solo cuenta el rank.
+        Devuelve True si el resultado pasa a ser el mejor conocido.
+        """
+        venue_id = (venue_id or "").strip()
+        if not venue_id:
+            return False
+        lat_f = _float_or_none(lat)
+        lon_f = _float_or_none(lon)
+        ts = time.time() if created_at is None else created_at
+
+        cur = self.conn.execute(
+            """
+            INSERT OR IGNORE INTO geocode_results
+                (venue_id, lat, lon, status, provider, query_used, label, run_id, fingerprint, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (venue_id, lat_f, lon_f, status, provider or "", query_used or "", label or "", run_id or "", fingerprint, ts),
+        )
+        if cur.rowcount == 0:
+            return False
+        if fingerprint:
+            self.conn.execute(
+                """
+                INSERT INTO checks (venue_id, scope, fingerprint, checked_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(venue_id, scope) DO UPDATE SET
+                    fingerprint = excluded.fingerprint, checked_at = excluded.checked_at
+                WHERE excluded.checked_at >= checks.checked_at
+                """,
+                (venue_id, fingerprint_scope(fingerprint), fingerprint, ts),
+            )
+
+        rank = result_rank(status, provider or "", lat_f is not None and lon_f is not None)
+        prev = self.conn.execute(
+            """
+            SELECT b.rank, r.status, r.fingerprint, r.created_at
+            FROM best_coords b JOIN geocode_results r ON r.id = b.result_id
+            WHERE b.venue_id = ?
+            """,
+            (venue_id,),
+        ).fetchone()
+        won = (
+            prev is None
+            # A igualdad de rank, el más reciente (no el último en llegar: import_csv de históricos)
+            or (rank, ts) >= (prev[0], prev[3])
+            # Otra huella de la misma herramienta: la entrada cambió. Entre herramientas no
+            # (cada una tiene su QUERY_VERSION y un REVIEW de una no debe tapar el OK de otra)
+            or (
+                bool(fingerprint)
+                and fingerprint != prev[2]
+                and fingerprint_scope(fingerprint) == fingerprint_scope(prev[2])
+                and prev[1] != STATUS_MANUAL
+            )
+        )
+        if won:
+            self.conn.execute(
+                """
+                INSERT INTO best_coords (venue_id, result_id, rank, created_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(venue_id) DO UPDATE SET
+                    result_id = excluded.result_id, rank = excluded.rank, created_at = excluded.created_at
+                """,
+                (venue_id, cur.lastrowid, rank, ts),
+            )
+        elif fingerprint and fingerprint == prev[2]:
+            # Misma entrada, resultado peor: nos quedamos el anterior pero consta como comprobado
+            self.conn.execute("UPDATE best_coords SET created_at = MAX(created_at, ?) WHERE venue_id = ?", (ts, venue_id))
+        if commit:
+            self.conn.commit()
+        return won
+
+    def expire(self, venue_id: str, commit: bool = True) -> None:
+        """
+        Da por caducado lo guardado de un venue (p.ej. revalidate_coords.py detectó drift):
+        el próximo reusable() devuelve None en cualquier herramienta y se re-geocodifica.
+        El histórico no se toca; MANUAL sigue sin caducar.
+        """
+        venue_id = (venue_id or "").strip()
+        self.conn.execute("UPDATE checks SET checked_at = 0 WHERE venue_id = ?", (venue_id,))
+        self.conn.execute("UPDATE best_coords SET created_at = 0 WHERE venue_id = ?", (venue_id,))
+        if commit:
+            self.conn.commit()
+
+    def import_csv(self, path: Path | str, status: Optional[str] = None, run_id: Optional[str] = None) -> int:
+        """
+        Importa cualquiera de los CSV históricos de tools/ (OK, OK_fixed, OK_min con BOM,
+        REVIEW, premiados ALL/OK/REVIEW...). Detecta columnas por nombre.
+        """
+        path = Path(path)
+        rid = run_id or f"import:{path.name}"
+        ts = path.stat().st_mtime
+        n = 0
+        # utf-8-sig: algunos *_min.csv vienen con BOM
+        with path.open("r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                venue_id = (row.get("venue_id") or row.get("id") or "").strip()
+                if not venue_id:
+                    continue
+                lat = row.get("lat")
+                lon = row.get("lon")
+                has_coords = _float_or_none(lat) is not None and _float_or_none(lon) is not None
+                st = status or _infer_status(row, path.name, has_coords)
+                if st is None:
+                    continue
+                self.record(
+                    venue_id,
+                    lat,
+                    lon,
+                    status=st,
+                    provider=(row.get("provider") or row.get("service") or "").strip(),
+                    query_used=(row.get("query_used") or row.get("query") or "").strip(),
+                    label=(row.get("label") or row.get("display") or "").strip(),
+                    run_id=rid,
+                    created_at=ts,
+                    commit=False,
+                )
+                n += 1
+        self.conn.commit()
+        return n
+
+    # -----------------------------
+    # Lectura
+    # -----------------------------
+
+    _SELECT = """
+        SELECT r.venue_id, r.lat, r.lon, r.status, r.provider, r.query_used, r.label, r.run_id, r.created_at,
+               r.fingerprint, b.created_at
+        FROM best_coords b JOIN geocode_results r ON r.id = b.result_id
+    """
+
+    def best(self, venue_id: str) -> Optional[StoredCoord]:
+        row = self.conn.execute(self._SELECT + " WHERE b.venue_id = ?", ((venue_id or "").strip(),)).fetchone()
+        return StoredCoord(*row) if row else None
+
+    def iter_best(self) -> Iterable[StoredCoord]:
+        for row in self.conn.execute(self._SELECT + " ORDER BY b.venue_id"):
+            yield StoredCoord(*row)
+
+    def is_settled(self, venue_id: str) -> bool:
+        b = self.best(venue_id)
+        return b is not None and b.settled
+
+    def reusable(
+        self,
+        venue_id: str,
+        fingerprint: str,
+        ttl_days: float = DEFAULT_TTL_DAYS,
+        retry_days: float = DEFAULT_RETRY_DAYS,
+        now: Optional[float] = None,
+    ) -> Optional[StoredCoord]:
+        """
+        Devuelve el mejor resultado guardado si se puede reaprovechar para esta fila, o
+        None si toca re-geocodificar. Cuenta la última comprobación de la herramienta de
+        `fingerprint` (checks), no la del mejor resultado, que puede ser de otra:
+          - la huella cambió (nombre/ciudad/dirección/url o versión de queries);
+          - caducó: ttl_days si el mejor está asentado, retry_days si no (un venue editado
+            que sigue fallando se reintenta a los retry_days, no en cada ejecución).
+        Sin comprobación propia vale un mejor asentado de otra herramienta o importado sin
+        huella (dentro de ttl_days). MANUAL no caduca.
+        """
+        b = self.best(venue_id)
+        if b is None:
+            return None
+        if b.status == STATUS_MANUAL:
+            return b
+        now = time.time() if now is None else now
+        limit = ttl_days if b.settled else retry_days
+        scope = fingerprint_scope(fingerprint)
+        check = self.conn.execute(
+            "SELECT fingerprint, checked_at FROM checks WHERE venue_id = ? AND scope = ?", (b.venue_id, scope)
+        ).fetchone()
+        if check is not None:
+            if check[0] != fingerprint:
+                return None
+            return b if (now - check[1]) / 86400.0 <= limit else None
+        # Huella antigua sin herramienta o de esta misma herramienta sin check: otra entrada
+        if b.fingerprint and fingerprint_scope(b.fingerprint) in ("", scope):
+            return None
+        if not b.settled:
+            return None
+        return b if (now - b.checked_at) / 86400.0 <= limit else None
+
+    def history(self, venue_id: str) -> list[StoredCoord]:
+        rows = self.conn.execute(
+            """
+            SELECT venue_id, lat, lon, status, provider, query_used, label, run_id, created_at, fingerprint
+            FROM geocode_results WHERE venue_id = ? ORDER BY created_at, id
+            """,
+            ((venue_id or "").strip(),),
+        ).fetchall()
+        return [StoredCoord(*r) for r in rows]
+
+    def stats(self) -> dict[str, int]:
+        out: dict[str, int] = {}
+        q = "SELECT r.status, COUNT(*) FROM best_coords b JOIN geocode_results r ON r.id = b.result_id GROUP BY r.status"
+        for st, n in self.conn.execute(q):
+            out[st] = n
+        return out
+
+
+def _infer_status(row: dict, filename: str, has_coords: bool) -> Optional[str]:
+    st = (row.get("status") or "").strip().upper()
+    if st in STATUS_RANK:
+        return st
+    if (row.get("reason") or "").strip():
+        return STATUS_REVIEW if has_coords else STATUS_MISS
+    if not has_coords:
+        # p.ej. venue_enrichment_premiados_coords.csv: fila vacía, no aporta nada
+        return None
+    if "REVIEW" in filename.upper():
+        return STATUS_REVIEW
+    return STATUS_OK
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Almacén local de coordenadas por venue_id")
+    ap.add_argument("--db", default=str(DEFAULT_DB))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p_imp = sub.add_parser("import", help="Importa CSVs históricos de coordenadas")
+    p_imp.add_argument("files", nargs="+")
+    p_imp.add_argument("--status", choices=sorted(STATUS_RANK), help="Fuerza el status (p.ej. MANUAL para fixes a mano)")
+
+    p_best = sub.add_parser("best", help="Mejor coordenada conocida de uno o varios venues")
+    p_best.add_argument("venue_ids", nargs="+")
+
+    p_exp = sub.add_parser("export", help="Exporta la mejor coordenada de cada venue asentado")
+    p_exp.add_argument("--out", default="venue_coords_best_min.csv")
+
+    sub.add_parser("stats", help="Recuento por status de la mejor coordenada")
+
+    args = ap.parse_args()
+
+    with CoordStore(args.db) as store:
+        if args.cmd == "import":
+            for p in args.files:
+                n = store.import_csv(p, status=args.status)
+                print(f"Importado: {p} (rows={n})")
+            print(store.stats())
+
+        elif args.cmd == "best":
+            for vid in args.venue_ids:
+                b = store.best(vid)
+                if b is None:
+                    print(f"{vid}: (sin datos)")
+                else:
+                    print(f"{vid}: {b.lat},{b.lon} [{b.status} {b.provider}] run={b.run_id} | {b.label[:60]}")
+
+        elif args.cmd == "export":
+            kept = 0
+            with open(args.out, "w", encoding="utf-8", newline="") as g:
+                w = csv.DictWriter(g, fieldnames=["venue_id", "lat", "lon"])
+                w.writeheader()
+                for b in store.iter_best():
+                    if b.settled:
+                        w.writerow({"venue_id": b.venue_id, "lat": f"{b.lat:.7f}", "lon": f"{b.lon:.7f}"})
+                        kept += 1
+            print(f"Generado: {args.out} (rows={kept})")
+
+        elif args.cmd == "stats":
+            print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
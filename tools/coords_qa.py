@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from textnorm import base_city, norm
+from sinks import CsvSink, FanOut
+
+# -----------------------------
+# Config
+# -----------------------------
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Salidas de los geocoders que revisamos por defecto
+DEFAULT_INPUTS = [
+    "venue_coords_OK.csv",
+    "venue_coords_VA_OK.csv",
+    "venue_enrichment_premiados_coords_ALL.csv",
+]
+
+# Bbox de la Comunitat Valenciana (lat_min, lat_max, lon_min, lon_max)
+CV_BOUNDS = (37.84, 40.79, -1.53, 0.69)
+
+# Contorno aproximado de la Comunitat (lon, lat), con la costa desplazada ~2-3 km mar adentro
+# para no marcar restaurantes de primera línea. Suficiente para cazar puntos en el mar o en
+# provincias vecinas; no es una frontera administrativa.
+CV_OUTLINE = np.array(
+    [
+        (0.56, 40.53),  # desembocadura del Sénia
+        (0.27, 40.73),
+        (-0.19, 40.80),
+        (-0.60, 40.50),
+        (-0.85, 40.16),
+        (-1.30, 40.22),  # Rincón de Ademuz
+        (-1.54, 40.05),
+        (-1.17, 39.90),
+        (-1.53, 39.55),
+        (-1.27, 39.05),
+        (-1.02, 38.88),
+        (-0.93, 38.66),
+        (-1.12, 38.40),
+        (-1.06, 38.10),
+        (-0.97, 37.94),
+        (-0.74, 37.83),  # Pilar de la Horadada
+        (-0.62, 37.98),
+        (-0.50, 38.19),
+        (-0.43, 38.33),
+        (-0.34, 38.42),
+        (-0.09, 38.51),
+        (0.09, 38.62),
+        (0.27, 38.72),  # Cap de la Nau
+        (0.16, 38.85),
+        (-0.12, 38.99),
+        (-0.18, 39.16),
+        (-0.27, 39.44),
+        (-0.17, 39.66),
+        (0.04, 39.97),
+        (0.19, 40.10),
+        (0.45, 40.36),
+        (0.53, 40.47),
+    ],
+    dtype=np.float64,
+)
+
+# Umbrales
+CLUSTER_DECIMALS = 5  # ~1 m: puntos idénticos (centroide de pueblo, misma calle...)
+CLUSTER_MIN = 3
+MAX_CITY_KM = 15.0
+OUTLIER_SCORE = 5.0
+OUTLIER_MIN_GROUP = 3
+OUTLIER_MIN_SCALE_M = 1000.0
+
+EARTH_R_M = 6371008.8
+
+
+class Interner:
+    """str -> código entero estable; las columnas de texto viajan como int64."""
+
+    def __init__(self):
+        self.codes: dict[str, int] = {}
+        self.values: list[str] = []
+
+    def __call__(self, s: str) -> int:
+        c = self.codes.get(s)
+        if c is None:
+            c = self.codes[s] = len(self.values)
+            self.values.append(s)
+        return c
+
+
+@dataclass
+class CoordTable:
+    """
+    Columnas paralelas: un índice = una fila de alguna salida. Los textos van
+    codificados (venue_code -> venue_ids[...], etc.) para que el QA sea solo numérico.
+    """
+
+    venue_code: np.ndarray  # int64
+    source_code: np.ndarray  # int64
+    city_code: np.ndarray  # int64
+    lat: np.ndarray  # float64
+    lon: np.ndarray  # float64
+    venue_ids: list[str]
+    sources: list[str]
+    cities: list[str]
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+
+def load_coords(paths: list[Path], city_by_id: dict[str, str]) -> CoordTable:
+    vi, si, ci = Interner(), Interner(), Interner()
+    v_codes, s_codes, c_codes, lats, lons = [], [], [], [], []
+    for p in paths:
+        src = si(p.name)
+        with p.open("r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                try:
+                    lat = float(row.get("lat") or "")
+                    lon = float(row.get("lon") or "")
+                except ValueError:
+                    continue
+                vid = (row.get("venue_id") or "").strip()
+                v_codes.append(vi(vid))
+                s_codes.append(src)
+                c_codes.append(ci((row.get("city") or city_by_id.get(vid, "")).strip()))
+                lats.append(lat)
+                lons.append(lon)
+    return CoordTable(
+        venue_code=np.array(v_codes, dtype=np.int64),
+        source_code=np.array(s_codes, dtype=np.int64),
+        city_code=np.array(c_codes, dtype=np.int64),
+        lat=np.array(lats, dtype=np.float64),
+        lon=np.array(lons, dtype=np.float64),
+        venue_ids=vi.values,
+        sources=si.values,
+        cities=ci.values,
+    )
+
+
+def load_city_map(path: Path) -> dict[str, str]:
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        return {(r.get("venue_id") or "").strip(): (r.get("city") or "").strip() for r in csv.DictReader(f)}
+
+
+def load_centroids(path: Path) -> dict[str, tuple[float, float]]:
+    """CSV city,lat,lon con el centro de cada municipio."""
+    out: dict[str, tuple[float, float]] = {}
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for r in csv.DictReader(f):
+            out[norm(base_city(r.get("city") or ""))] = (float(r["lat"]), float(r["lon"]))
+    return out
+
+
+# -----------------------------
+# Kernels vectorizados
+# -----------------------------
+
+
+def approx_dist_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Distancia equirectangular: a escala de una comunidad autónoma el error frente
+    a haversine es despreciable y cuesta un coseno en vez de cinco trigonométricas.
+    """
+    k = np.pi / 180.0
+    x = (lon2 - lon1) * np.cos((lat1 + lat2) * (0.5 * k))
+    y = lat2 - lat1
+    return EARTH_R_M * k * np.sqrt(x * x + y * y)
+
+
+def points_in_polygon(lon: np.ndarray, lat: np.ndarray, poly: np.ndarray) -> np.ndarray:
+    """
+    Ray casting vectorizado. Se ordena por latitud una vez; cada arista solo toca el
+    tramo contiguo de puntos cuya latitud cruza (searchsorted), no el array entero.
+    """
+    order = np.argsort(lat)
+    lat_s, lon_s = lat[order], lon[order]
+    inside_s = np.zeros(len(lat), dtype=bool)
+    xs, ys = poly[:, 0], poly[:, 1]
+    for k in range(len(poly)):
+        x1, y1 = xs[k - 1], ys[k - 1]
+        x2, y2 = xs[k], ys[k]
+        if y1 == y2:
+            continue
+        # (y1 > lat) != (y2 > lat)  <=>  min(y1,y2) <= lat < max(y1,y2)
+        lo = np.searchsorted(lat_s, min(y1, y2), side="left")
+        hi = np.searchsorted(lat_s, max(y1, y2), side="left")
+        if lo >= hi:
+            continue
+        seg_lat = lat_s[lo:hi]
+        x_at = x1 + (seg_lat - y1) * (x2 - x1) / (y2 - y1)
+        inside_s[lo:hi] ^= lon_s[lo:hi] < x_at
+    inside = np.empty_like(inside_s)
+    inside[order] = inside_s
+    return inside
+
+
+def cluster_sizes(lat: np.ndarray, lon: np.ndarray, venue_codes: np.ndarray, decimals: int = CLUSTER_DECIMALS) -> np.ndarray:
+    """
+    Nº de venues distintos que comparten el mismo punto (redondeado) que cada fila.
+    Un mismo venue repetido en _ALL y _OK no cuenta dos veces.
+    """
+    n = len(lat)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    scale = 10.0**decimals
+    key = np.round(lat * scale).astype(np.int64) * 1_000_000_000 + np.round(lon * scale).astype(np.int64)
+    order = np.argsort(key)
+    ks = key[order]
+    new = np.empty(n, dtype=bool)
+    new[0] = True
+    new[1:] = ks[1:] != ks[:-1]
+    gid = np.cumsum(new) - 1
+    counts = np.bincount(gid)
+
+    # Solo los puntos compartidos necesitan contar venues distintos (suelen ser pocos)
+    distinct = np.ones(len(counts), dtype=np.int64)
+    multi = counts[gid] > 1
+    if multi.any():
+        base = int(venue_codes.max()) + 1
+        pairs = np.unique(gid[multi] * base + venue_codes[order[multi]])
+        distinct = np.maximum(distinct, np.bincount(pairs // base, minlength=len(counts)))
+
+    out = np.empty(n, dtype=np.int64)
+    out[order] = distinct[gid]
+    return out
+
+
+def group_medians(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Mediana (inferior) de values por grupo sin bucles Python. Una única ordenación
+    por la clave float grupo + valor reescalado a [0, 1).
+    """
+    out = np.full(n_groups, np.nan)
+    if len(values) == 0:
+        return out
+    vmin, vmax = float(values.min()), float(values.max())
+    span = (vmax - vmin) * 1.000001 or 1.0
+    order = np.argsort(codes + (values - vmin) / span)
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    mid = starts + np.maximum(counts - 1, 0) // 2
+    has = counts > 0
+    out[has] = values[order[mid[has]]]
+    return out
+
+
+def city_codes(t: CoordTable) -> tuple[np.ndarray, list[str]]:
+    """
+    Agrupa por ciudad normalizada; norm() solo se aplica a los valores distintos.
+    Sin ciudad, código -1: esas filas no forman un grupo propio.
+    """
+    canon = Interner()
+    keys = [norm(base_city(c)) for c in t.cities]
+    remap = np.array([canon(k) if k else -1 for k in keys], dtype=np.int64)
+    if len(remap) == 0:
+        return t.city_code, canon.values
+    return remap[t.city_code], canon.values
+
+
+def run_qa(t: CoordTable, centroids: dict[str, tuple[float, float]]) -> dict[str, np.ndarray]:
+    lat, lon = t.lat, t.lon
+    lat_min, lat_max, lon_min, lon_max = CV_BOUNDS
+
+    in_bbox = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+    swapped = ~in_bbox & (lon >= lat_min) & (lon <= lat_max) & (lat >= lon_min) & (lat <= lon_max)
+    in_outline = points_in_polygon(lon, lat, CV_OUTLINE)
+    # Dentro del bbox pero fuera del contorno: mar o provincia vecina
+    sea_or_outside = in_bbox & ~in_outline
+
+    csize = cluster_sizes(lat, lon, t.venue_code)
+
+    codes, keys = city_codes(t)
+    n_groups = len(keys)
+    # Outliers solo dentro de una ciudad conocida: las filas sin ciudad quedan a 0
+    sub = np.flatnonzero(codes >= 0)
+    c = codes[sub]
+    med_lat = group_medians(c, lat[sub], n_groups)
+    med_lon = group_medians(c, lon[sub], n_groups)
+    d_med = approx_dist_m(lat[sub], lon[sub], med_lat[c], med_lon[c])
+    med_d = group_medians(c, d_med, n_groups)
+    group_n = np.bincount(c, minlength=n_groups)[c]
+    scale = np.maximum(1.4826 * med_d[c], OUTLIER_MIN_SCALE_M)
+    outlier = np.zeros(len(t))
+    outlier[sub] = np.where(group_n >= OUTLIER_MIN_GROUP, d_med / scale, 0.0)
+
+    # Distancia al municipio declarado (si hay tabla de centroides); el último hueco,
+    # NaN, es el del código -1
+    c_lat = np.array([centroids.get(k, (np.nan, np.nan))[0] for k in keys] + [np.nan], dtype=np.float64)
+    c_lon = np.array([centroids.get(k, (np.nan, np.nan))[1] for k in keys] + [np.nan], dtype=np.float64)
+    dist_city = approx_dist_m(lat, lon, c_lat[codes], c_lon[codes])
+    known_city = ~np.isnan(dist_city)
+
+    return {
+        "outside_region": ~in_bbox & ~swapped,
+        "swapped_latlon": swapped,
+        "sea_or_outside": sea_or_outside,
+        "cluster": csize >= CLUSTER_MIN,
+        "far_from_city": known_city & (dist_city > MAX_CITY_KM * 1000.0),
+        "outlier": outlier >= OUTLIER_SCORE,
+        # métricas para el informe
+        "_cluster_size": csize,
+        "_dist_city_km": dist_city / 1000.0,
+        "_outlier_score": outlier,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="QA en bloque de las coordenadas geocodificadas")
+    ap.add_argument("inputs", nargs="*", help="CSVs con venue_id, lat, lon (y city si lo hay)")
+    ap.add_argument("--venues", default="", help="CSV venue_id,city para salidas sin columna city")
+    ap.add_argument("--centroids", default="", help="CSV city,lat,lon con el centro de cada municipio")
+    ap.add_argument("--out", default="coords_qa_report.csv")
+    args = ap.parse_args()
+
+    paths = [Path(p) for p in args.inputs] or [BASE_DIR / p for p in DEFAULT_INPUTS]
+    city_by_id = load_city_map(Path(args.venues)) if args.venues else {}
+    centroids = load_centroids(Path(args.centroids)) if args.centroids else {}
+
+    t0 = time.perf_counter()
+    table = load_coords(paths, city_by_id)
+    t1 = time.perf_counter()
+    res = run_qa(table, centroids)
+    t2 = time.perf_counter()
+
+    flags = [k for k in res if not k.startswith("_")]
+    any_flag = np.zeros(len(table), dtype=bool)
+    for k in flags:
+        any_flag |= res[k]
+
+    cols = ["venue_id", "source", "city", "lat", "lon", "flags", "cluster_size", "dist_city_km", "outlier_score"]
+    with FanOut([CsvSink(args.out, cols)]) as out:
+        for i in np.flatnonzero(any_flag):
+            dkm = res["_dist_city_km"][i]
+            out.write(
+                {
+                    "venue_id": table.venue_ids[table.venue_code[i]],
+                    "source": table.sources[table.source_code[i]],
+                    "city": table.cities[table.city_code[i]],
+                    "lat": f"{table.lat[i]:.7f}",
+                    "lon": f"{table.lon[i]:.7f}",
+                    "flags": "|".join(k for k in flags if res[k][i]),
+                    "cluster_size": int(res["_cluster_size"][i]),
+                    "dist_city_km": "" if np.isnan(dkm) else f"{dkm:.2f}",
+                    "outlier_score": f"{res['_outlier_score'][i]:.2f}",
+                }
+            )
+
+    print(f"Filas: {len(table)} (carga {t1 - t0:.2f}s, QA {t2 - t1:.3f}s)")
+    for k in flags:
+        print(f"  {k}: {int(res[k].sum())}")
+    print(f"Generado: {args.out} (rows={int(any_flag.sum())})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+# Índice lateral id -> byte offset para CSVs grandes (osm_venues_import, exports de venues).
+#
+# Se construye una vez por fichero y clave en <csv>.<clave>.idx y se abre por mmap. Guarda
+# el tamaño y el mtime del CSV: si no coinciden, el índice está caducado y se regenera.
+# Una búsqueda es un bisect sobre las claves ordenadas del índice y decodifica solo esa
+# fila del CSV (también mapeado), sin recorrer el fichero con DictReader.
+#
+#   with CsvIndex.open("osm_venues_import.csv", key=("osm_type", "osm_id")) as ix:
+#       ix.get("node/123456")
+#
+# Formato (little-endian):
+#   "CSVX" u32 versión, u64 tamaño CSV, u64 mtime_ns CSV, u32 n filas, u32 bytes de clave
+#   clave ("osm_type,osm_id") con padding a 8
+#   rec_off  u64[n]    offset de la fila en el CSV, en orden de clave
+#   rec_len  u32[n]    bytes de la fila
+#   key_off  u64[n+1]  offsets en el blob de claves
+#   keys     blob      claves UTF-8 concatenadas (ordenadas por bytes)
+
+MAGIC = b"CSVX"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sIQQII")
+
+# Columnas compuestas se unen así: ("osm_type", "osm_id") -> "node/123"
+KEY_SEP = "/"
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def iter_records(f) -> Iterator[tuple[int, bytes]]:
+    """
+    (offset, bytes) de cada registro CSV de un fichero binario. Un registro puede ocupar
+    varias líneas si lleva saltos dentro de comillas: termina cuando las comillas cuadran.
+    """
+    pos = f.tell()
+    start, buf, quotes = pos, [], 0
+    for line in iter(f.readline, b""):
+        if not buf:
+            start = pos
+        buf.append(line)
+        quotes += line.count(b'"')
+        pos += len(line)
+        if quotes % 2 == 0:
+            yield start, b"".join(buf)
+            buf, quotes = [], 0
+    if buf:
+        yield start, b"".join(buf)
+
+
+def sidecar_path(path: Path, key: tuple[str, ...]) -> Path:
+    return path.with_name(f"{path.name}.{'+'.join(key)}.idx")
+
+
+def _parse(rec: bytes) -> list[str]:
+    return next(csv.reader(io.StringIO(rec.decode("utf-8-sig"))), [])
+
+
+def build_index(path: Path, key: tuple[str, ...], out: Optional[Path] = None) -> Path:
+    path = Path(path)
+    out = out or sidecar_path(path, key)
+    st = path.stat()
+    entries: list[tuple[bytes, int, int]] = []
+    with path.open("rb") as f:
+        records = iter_records(f)
+        _, head = next(records, (0, b""))
+        header = _parse(head)
+        missing = [k for k in key if k not in header]
+        if missing:
+            raise ValueError(f"{path}: faltan columnas de clave {missing} (cabecera: {header})")
+        cols = [header.index(k) for k in key]
+        for off, rec in records:
+            row = _parse(rec)
+            if not row:
+                continue
+            k = KEY_SEP.join(row[c].strip() if c < len(row) else "" for c in cols)
+            # Sin el fin de línea: la fila se decodifica igual y el registro ocupa menos
+            entries.append((k.encode("utf-8"), off, len(rec.rstrip(b"\r\n"))))
+    entries.sort()
+
+    n = len(entries)
+    key_spec = ",".join(key).encode("utf-8")
+    rec_off = np.fromiter((e[1] for e in entries), dtype="<u8", count=n)
+    rec_len = np.fromiter((e[2] for e in entries), dtype="<u4", count=n)
+    key_off = np.zeros(n + 1, dtype="<u8")
+    np.cumsum([len(e[0]) for e in entries], out=key_off[1:])
+
+    tmp = out.with_name(out.name + ".tmp")
+    with tmp.open("wb") as g:
+        g.write(HEADER.pack(MAGIC, FORMAT_VERSION, st.st_size, st.st_mtime_ns, n, len(key_spec)))
+        g.write(key_spec.ljust(_pad8(len(key_spec)), b"\0"))
+        g.write(rec_off.tobytes())
+        g.write(rec_len.tobytes())
+        g.write(b"\0" * (_pad8(rec_len.nbytes) - rec_len.nbytes))
+        g.write(key_off.tobytes())
+        g.write(b"".join(e[0] for e in entries))
+    os.replace(tmp, out)
+    return out
+
+
+class StaleIndex(Exception):
+    pass
+
+
+class CsvIndex:
+    def __init__(self, path: Path, idx_path: Path, key: tuple[str, ...]):
+        self.path = path
+        self.idx_path = idx_path
+        self.key = key
+        self._fi = idx_path.open("rb")
+        self._mi = mmap.mmap(self._fi.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, size, mtime_ns, n, klen = HEADER.unpack_from(self._mi, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise StaleIndex(f"{idx_path}: formato no reconocido")
+            st = path.stat()
+            if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+                raise StaleIndex(f"{idx_path}: el CSV ha cambiado (tamaño/mtime)")
+            pos = HEADER.size
+            spec = tuple(bytes(self._mi[pos : pos + klen]).decode("utf-8").split(","))
+            if spec != key:
+                raise StaleIndex(f"{idx_path}: índice de {spec}, no de {key}")
+            pos += _pad8(klen)
+            self.n = n
+            self.rec_off = np.frombuffer(self._mi, dtype="<u8", count=n, offset=pos)
+            pos += 8 * n
+            self.rec_len = np.frombuffer(self._mi, dtype="<u4", count=n, offset=pos)
+            pos += _pad8(4 * n)
+            self.key_off = np.frombuffer(self._mi, dtype="<u8", count=n + 1, offset=pos)
+            self._keys_at = pos + 8 * (n + 1)
+        except Exception:
+            self.close()
+            raise
+
+        self._fc = path.open("rb")
+        # mmap no admite ficheros vacíos; un CSV vacío no tiene filas que buscar
+        self._mc = mmap.mmap(self._fc.fileno(), 0, access=mmap.ACCESS_READ) if path.stat().st_size else b""
+        with path.open("rb") as f:
+            _, head = next(iter_records(f), (0, b""))
+        self.header = _parse(head)
+
+    @classmethod
+    def open(cls, path: Path | str, key: Iterable[str] = ("venue_id",), rebuild: bool = True) -> "CsvIndex":
+        """Abre el índice de `path`; si falta o está caducado lo regenera (o lanza StaleIndex)."""
+        path = Path(path)
+        key = tuple(key)
+        idx = sidecar_path(path, key)
+        if idx.exists():
+            try:
+                return cls(path, idx, key)
+            except StaleIndex:
+                if not rebuild:
+                    raise
+        elif not rebuild:
+            raise StaleIndex(f"No existe {idx}")
+        build_index(path, key, idx)
+        return cls(path, idx, key)
+
+    def close(self) -> None:
+        for attr in ("rec_off", "rec_len", "key_off"):
+            # Las vistas numpy retienen el mmap: hay que soltarlas antes de cerrarlo
+            self.__dict__.pop(attr, None)
+        for m in (getattr(self, "_mi", None), getattr(self, "_mc", None)):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in (getattr(self, "_fi", None), getattr(self, "_fc", None)):
+            if f is not None:
+                f.close()
+
+    def __enter__(self) -> "CsvIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _key(self, i: int) -> bytes:
+        a, b = int(self.key_off[i]), int(self.key_off[i + 1])
+        return self._mi[self._keys_at + a : self._keys_at + b]
+
+    def _lower(self, k: bytes) -> int:
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < k:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _row(self, i: int) -> dict:
+        off, ln = int(self.rec_off[i]), int(self.rec_len[i])
+        return dict(zip(self.header, _parse(self._mc[off : off + ln])))
+
+    def get_all(self, key: str) -> list[dict]:
+        k = key.encode("utf-8")
+        i = self._lower(k)
+        out = []
+        while i < self.n and self._key(i) == k:
+            out.append(self._row(i))
+            i += 1
+        return out
+
+    def get(self, key: str) -> Optional[dict]:
+        k = key.encode("utf-8")
+        i = self._lower(k)
+        return self._row(i) if i < self.n and self._key(i) == k else None
+
+    def __contains__(self, key: str) -> bool:
+        k = key.encode("utf-8")
+        i = self._lower(k)
+        return i < self.n and self._key(i) == k
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, dict]:
+        """Join pequeño: primera fila de cada clave encontrada. Lee el CSV en orden de offset."""
+        hits = []
+        for key in set(keys):
+            k = key.encode("utf-8")
+            i = self._lower(k)
+            if i < self.n and self._key(i) == k:
+                hits.append((int(self.rec_off[i]), key, i))
+        hits.sort()
+        return {key: self._row(i) for _, key, i in hits}
+
+    def iter_keys(self) -> Iterator[str]:
+        for i in range(self.n):
+            yield self._key(i).decode("utf-8")
+
+
+def parse_key(s: str) -> tuple[str, ...]:
+    return tuple(k.strip() for k in s.split(",") if k.strip())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Índice lateral id -> offset para búsquedas puntuales en CSVs grandes")
+    ap.add_argument("csv")
+    ap.add_argument("--key", type=parse_key, default=("venue_id",), help="Columna(s) clave, p.ej. venue_id u osm_type,osm_id")
+    ap.add_argument("--rebuild", action="store_true", help="Regenera aunque el índice esté al día")
+    ap.add_argument("ids", nargs="*", help="Claves a buscar (compuestas con '/': node/123)")
+    args = ap.parse_intermixed_args()
+
+    path = Path(args.csv)
+    t0 = time.perf_counter()
+    if args.rebuild:
+        build_index(path, args.key)
+    with CsvIndex.open(path, args.key) as ix:
+        t1 = time.perf_counter()
+        print(f"Índice: {ix.idx_path} ({len(ix)} filas, {ix.idx_path.stat().st_size / 1e6:.1f} MB, {t1 - t0:.2f}s)")
+        for k in args.ids:
+            t = time.perf_counter()
+            rows = ix.get_all(k)
+            dt = (time.perf_counter() - t) * 1e6
+            if not rows:
+                print(f"{k}: no encontrado ({dt:.0f} µs)")
+            for r in rows:
+                print(f"{k}: {r} ({dt:.0f} µs)")
+
+
+if __name__ == "__main__":
+    main()
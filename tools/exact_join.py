@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import re
+import time
+import urllib.parse
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+
+from coord_store import STATUS_OK, CoordStore, row_fingerprint
+from geocode_budget import write_remaining
+from osm_index import haversine_m, name_similarity
+from osm_table import COLUMNAR_SUFFIXES, OsmTable
+from prep_overpass_csv import TAG_KEYS
+from sinks import CsvSink, FanOut
+
+# Pre-pasada de claves exactas antes del matching difuso y de los geocoders.
+#
+# Teléfono (E.164 español), host canónico de la web e id OSM se normalizan en los dos
+# lados y se cruzan con un hash join: una pasada para indexar el export OSM (el de
+# prep_overpass_csv.py o el overpass_cv.csv crudo, que trae phone y contact:phone por
+# separado) y otra para los venues. Lo que queda asentado aquí no pasa por name+city
+# ni sale a la red:
+#
+#   python exact_join.py venues.csv --osm overpass_cv.csv --store venue_coords.sqlite
+#   python geocode_by_address.py --input venues_unmatched.csv ...
+#
+# Solo cuentan las claves que apuntan a un único local OSM (el teléfono central de una
+# cadena no discrimina). Si las claves útiles coinciden en un local, es EXACT; si
+# apuntan a locales distintos o el nombre no se parece nada, va a REVIEW.
+
+# Columnas de la lista de venues para cada clave (exports de Supabase, CSVs de tools/)
+VENUE_KEYS = {
+    "phone": ("phone", "telefono", "contact_phone", "contact:phone"),
+    "website": ("website", "web", "url", "contact_website", "contact:website"),
+    "osm": ("osm_ref", "osm_id", "query_used", "google_maps_url"),
+}
+
+# Huella de las filas guardadas en el store (ver coord_store.row_fingerprint)
+QUERY_VERSION = "exact_join-v1"
+
+# Hosts compartidos: la web del local es plataforma + primer tramo de la ruta
+# (es-es.facebook.com/x y facebook.com/x son la misma clave)
+PLATFORM_HOSTS = {
+    "facebook.com", "instagram.com", "twitter.com", "x.com", "tiktok.com", "linktr.ee",
+    "sites.google.com", "tripadvisor.es", "tripadvisor.com", "thefork.es", "eltenedor.es",
+    "just-eat.es", "glovoapp.com", "ubereats.com", "wixsite.com",
+}
+# Plataformas donde el subdominio es la cuenta (casapepe.wixsite.com): ahí sí cuenta el host
+ACCOUNT_SUBDOMAIN_HOSTS = {"wixsite.com"}
+# Hosts que no identifican un local (buscadores, mapas, acortadores, correo)
+IGNORED_HOSTS = {
+    "google.com", "google.es", "goo.gl", "maps.app.goo.gl", "bit.ly", "wa.me", "localhost",
+    "gmail.com", "googlemail.com", "hotmail.com", "hotmail.es", "outlook.com", "outlook.es", "live.com",
+    "yahoo.com", "yahoo.es", "icloud.com", "telefonica.net", "ono.com",
+}
+GENERIC_PATHS = {"", "pages", "pg", "people", "profile.php", "p", "es", "en", "restaurant", "restaurante", "view"}
+
+# Dos objetos OSM a menos de esto con la misma clave son el mismo local (nodo + edificio)
+SAME_PLACE_M = 60.0
+# Por debajo, una coincidencia de teléfono/web no basta (número o dominio reciclado)
+MIN_NAME_SIM = 0.3
+
+PHONE_SPLIT_RE = re.compile(r"[;,/|]|\s+(?:o|y|or)\s+")
+NON_DIGIT_RE = re.compile(r"\D")
+HOST_PREFIX_RE = re.compile(r"^(www\d*|m|es|web)\.")
+
+MATCH_FIELDS = ["venue_id", "lat", "lon", "provider", "label", "query_used", "name", "osm_name", "match_keys", "name_sim"]
+REVIEW_FIELDS = ["venue_id", "name", "city", "match_keys", "osm_refs", "lat", "lon", "label", "name_sim", "reason"]
+
+
+def phone_keys(raw: str) -> list[str]:
+    """
+    "96 312 34 56 / +34 600-11-22-33" -> ["+34963123456", "+34600112233"].
+    Nacionales de 9 cifras (6-9...) con o sin 34/0034; los extranjeros tal cual con +.
+    """
+    if not raw:
+        return []
+    out = []
+    for part in PHONE_SPLIT_RE.split(raw):
+        p = part.strip()
+        digits = NON_DIGIT_RE.sub("", p)
+        intl = p.startswith("+")
+        if digits.startswith("00"):
+            intl, digits = True, digits[2:]
+        if intl and not digits.startswith("34"):
+            if 8 <= len(digits) <= 15:
+                out.append("+" + digits)
+            continue
+        if (intl or len(digits) == 11) and digits.startswith("34"):
+            digits = digits[2:]
+        if len(digits) == 9 and digits[0] in "6789":
+            out.append("+34" + digits)
+    return list(dict.fromkeys(out))
+
+
+def website_key(raw: str) -> str:
+    """
+    "https://www.CasaPepe.es/carta" -> "casapepe.es";
+    "http://es-es.facebook.com/casapepe.valencia/" -> "facebook.com/casapepe.valencia".
+    Un correo ("info@casapepe.es", "mailto:...") no es una web: "".
+    """
+    s = (raw or "").strip()
+    if not s:
+        return ""
+    s = s.split(";")[0].split()[0]
+    if s.lower().startswith("mailto:"):
+        return ""
+    if "://" not in s:
+        s = "http://" + s
+    try:
+        u = urllib.parse.urlsplit(s.lower())
+        host = (u.hostname or "").rstrip(".")
+    except ValueError:
+        return ""
+    if u.username is not None:
+        return ""
+    host = HOST_PREFIX_RE.sub("", host)
+    if "." not in host or host in IGNORED_HOSTS:
+        return ""
+    platform = next((p for p in PLATFORM_HOSTS if host == p or host.endswith("." + p)), "")
+    if not platform:
+        return host
+    segs = [x for x in urllib.parse.unquote(u.path).split("/") if x.lower() not in GENERIC_PATHS]
+    site = host if platform in ACCOUNT_SUBDOMAIN_HOSTS else platform
+    return f"{site}/{segs[0]}" if segs else ""
+
+
+OSM_REF_RE = re.compile(r"\b(node|way|relation)[/:](\d+)\b", re.IGNORECASE)
+
+
+def osm_key(raw: str) -> str:
+    """"OSM:node/123", "https://www.openstreetmap.org/way/45", "relation:9" -> "node/123"..."""
+    m = OSM_REF_RE.search(raw or "")
+    return f"{m.group(1).lower()}/{m.group(2)}" if m else ""
+
+
+@dataclass
+class Place:
+    ref: str
+    name: str
+    label: str
+    lat: float
+    lon: float
+    refs: set[str] = field(default_factory=set)
+
+
+def _get(row: dict, keys: tuple[str, ...]) -> str:
+    for k in keys:
+        v = row.get(k)
+        if v:
+            return str(v).strip()
+    return ""
+
+
+def iter_osm_rows(path: Path) -> Iterator[dict]:
+    if path.suffix.lower() in COLUMNAR_SUFFIXES:
+        yield from OsmTable.read(path).iter_rows()
+        return
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+class ExactIndex:
+    """
+    (clave, valor) -> locales OSM. Los objetos con la misma clave a menos de
+    SAME_PLACE_M se funden en un Place (el nodo del local y el edificio, p.ej.).
+    """
+
+    def __init__(self):
+        self.by_key: dict[tuple[str, str], list[Place]] = {}
+        self.rows = 0
+
+    def add(self, row: dict) -> None:
+        try:
+            lat = float(_get(row, TAG_KEYS["@lat"]))
+            lon = float(_get(row, TAG_KEYS["@lon"]))
+        except ValueError:
+            return
+        otype = _get(row, ("osm_type",) + TAG_KEYS["@type"])
+        oid = _get(row, ("osm_id",) + TAG_KEYS["@id"])
+        if not otype or not oid:
+            return
+        self.rows += 1
+        name = _get(row, ("name",))
+        street = " ".join(p for p in (_get(row, TAG_KEYS["addr:street"]), _get(row, TAG_KEYS["addr:housenumber"])) if p)
+        label = ", ".join(p for p in (name, street, _get(row, TAG_KEYS["addr:city"])) if p)
+        ref = f"{otype}/{oid}"
+        keys = {("osm", ref)}
+        # phone y contact:phone pueden traer números distintos: cuentan todos
+        for k in TAG_KEYS["phone"]:
+            keys.update(("phone", p) for p in phone_keys(row.get(k) or ""))
+        for k in TAG_KEYS["website"]:
+            w = website_key(row.get(k) or "")
+            if w:
+                keys.add(("website", w))
+        for key in keys:
+            places = self.by_key.setdefault(key, [])
+            for pl in places:
+                if haversine_m(pl.lat, pl.lon, lat, lon) < SAME_PLACE_M:
+                    pl.refs.add(ref)
+                    break
+            else:
+                places.append(Place(ref, name, label, lat, lon, {ref}))
+
+    @classmethod
+    def from_path(cls, path: Path) -> "ExactIndex":
+        ix = cls()
+        for row in iter_osm_rows(path):
+            ix.add(row)
+        return ix
+
+    def match(self, row: dict) -> tuple[Optional[Place], list[str], str, list[Place]]:
+        """
+        (local, claves que lo fijan, motivo de REVIEW, locales vistos). Sin claves o sin
+        coincidencias: (None, [], "", []).
+        """
+        keys = [("phone", p) for p in phone_keys(_get(row, VENUE_KEYS["phone"]))]
+        w = website_key(_get(row, VENUE_KEYS["website"]))
+        if w:
+            keys.append(("website", w))
+        o = next((osm_key(row.get(k) or "") for k in VENUE_KEYS["osm"] if osm_key(row.get(k) or "")), "")
+        if o:
+            keys.append(("osm", o))
+
+        seen: dict[str, Place] = {}
+        pinned: dict[str, list[str]] = {}
+        for kind, value in keys:
+            places = self.by_key.get((kind, value)) or []
+            for pl in places:
+                seen.setdefault(pl.ref, pl)
+            if len(places) == 1:
+                pinned.setdefault(places[0].ref, []).append(kind)
+        if not seen:
+            return None, [], "", []
+        if not pinned:
+            return None, [], "ambiguous_key", list(seen.values())
+        groups = _same_place_groups([seen[r] for r in pinned])
+        if len(groups) > 1:
+            return None, [], "conflicting_keys", [seen[r] for r in pinned]
+        # Cada clave puede fijar un objeto distinto del mismo local (teléfono en el nodo,
+        # web en el edificio): manda el que más claves fija y, a igualdad, el nodo
+        place = max(groups[0], key=lambda pl: (len(pinned[pl.ref]), pl.ref.startswith("node/")))
+        kinds = list(dict.fromkeys(k for pl in groups[0] for k in pinned[pl.ref]))
+        if "osm" not in kinds and name_similarity(_get(row, ("name",)), place.name) < MIN_NAME_SIM:
+            return None, kinds, "name_mismatch", [place]
+        return place, kinds, "", [place]
+
+
+def _same_place_groups(places: list[Place]) -> list[list[Place]]:
+    """Agrupa los locales que están a menos de SAME_PLACE_M de alguno del grupo."""
+    groups: list[list[Place]] = []
+    for pl in places:
+        near = [g for g in groups if any(haversine_m(p.lat, p.lon, pl.lat, pl.lon) < SAME_PLACE_M for p in g)]
+        merged = [pl] + [p for g in near for p in g]
+        groups = [g for g in groups if g not in near] + [merged]
+    return groups
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Cruce exacto venues <-> OSM por teléfono, web e id OSM")
+    ap.add_argument("venues", help="CSV de venues (venue_id, name, city y phone/website/osm_ref/query_used si los hay)")
+    ap.add_argument("--osm", default="osm_venues_import.csv", help="Export OSM: prep_overpass_csv (CSV/Parquet/Arrow) u overpass_cv.csv")
+    ap.add_argument("--out", default="exact_join_OK.csv", help="Matches seguros (mismas columnas que venue_coords_OK)")
+    ap.add_argument("--out-review", default="exact_join_REVIEW.csv")
+    ap.add_argument("--out-unmatched", default="", help="Venues sin match seguro (por defecto <venues>_unmatched.csv)")
+    ap.add_argument("--store", default="", help="SQLite de coordenadas: guarda los matches como OK (provider osm_exact)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    ix = ExactIndex.from_path(Path(args.osm))
+    t1 = time.perf_counter()
+
+    in_path = Path(args.venues)
+    with in_path.open("r", encoding="utf-8-sig", newline="") as f:
+        r = csv.DictReader(f)
+        in_fields = list(r.fieldnames or [])
+        venues = list(r)
+
+    store = CoordStore(args.store) if args.store else None
+    run_id = time.strftime("exact_join:%Y%m%dT%H%M%S")
+    by_kind: Counter = Counter()
+    reasons: Counter = Counter()
+    unmatched: list[dict] = []
+
+    ok_sink = CsvSink(args.out, MATCH_FIELDS, where=lambda row: not row["reason"])
+    rev_sink = CsvSink(args.out_review, REVIEW_FIELDS, where=lambda row: bool(row["reason"]))
+    with FanOut([ok_sink, rev_sink]) as out:
+        for row in venues:
+            venue_id = (row.get("venue_id") or row.get("id") or "").strip()
+            name = (row.get("name") or "").strip()
+            place, kinds, reason, seen = ix.match(row)
+            if place is None:
+                unmatched.append(row)
+                if reason:
+                    reasons[reason] += 1
+                    out.write(
+                        {
+                            "venue_id": venue_id,
+                            "name": name,
+                            "city": (row.get("city") or "").strip(),
+                            "match_keys": "+".join(kinds),
+                            "osm_refs": " ".join(sorted(pl.ref for pl in seen)[:10]),
+                            "lat": seen[0].lat if len(seen) == 1 else "",
+                            "lon": seen[0].lon if len(seen) == 1 else "",
+                            "label": seen[0].label if len(seen) == 1 else "",
+                            "name_sim": f"{name_similarity(name, seen[0].name):.2f}" if len(seen) == 1 else "",
+                            "reason": reason,
+                        }
+                    )
+                continue
+
+            by_kind["+".join(kinds)] += 1
+            query_used = f"OSM:{place.ref}"
+            if store is not None:
+                store.record(
+                    venue_id, place.lat, place.lon, STATUS_OK, "osm_exact", query_used, place.label, run_id,
+                    fingerprint=row_fingerprint(row, QUERY_VERSION), commit=False,
+                )
+            out.write(
+                {
+                    "venue_id": venue_id,
+                    "lat": f"{place.lat:.7f}",
+                    "lon": f"{place.lon:.7f}",
+                    "provider": "osm_exact",
+                    "label": place.label,
+                    "query_used": query_used,
+                    "name": name,
+                    "osm_name": place.name,
+                    "match_keys": "+".join(kinds),
+                    "name_sim": f"{name_similarity(name, place.name):.2f}",
+                    "reason": "",
+                }
+            )
+
+    rest_path = Path(args.out_unmatched) if args.out_unmatched else in_path.with_name(f"{in_path.stem}_unmatched.csv")
+    write_remaining(rest_path, in_fields, unmatched)
+    t2 = time.perf_counter()
+
+    print(f"OSM: {ix.rows} objetos, {len(ix.by_key)} claves ({t1 - t0:.2f}s)")
+    print(f"Venues: {len(venues)} | exactos {ok_sink.kept} | review {rev_sink.kept} ({t2 - t1:.2f}s)")
+    for kinds, n in by_kind.most_common():
+        print(f"  por {kinds}: {n}")
+    for why, n in reasons.most_common():
+        print(f"  review {why}: {n}")
+    print(f"OK: {ok_sink.path}\nREVIEW: {rev_sink.path}\nSIN MATCH: {len(unmatched)} -> {rest_path}")
+    if store is not None:
+        print(f"STORE: {store.path} {store.stats()}")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import argparse
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from sinks import CsvSink, FanOut
+
+
+class BudgetExhausted(RuntimeError):
+    """Se ha agotado el presupuesto de llamadas de un provider (o el total)."""
+
+
+def parse_provider_budgets(values: list[str]) -> dict[str, int]:
+    """
+    "nominatim=500" -> {"nominatim": 500}. Acepta la opción repetida o separada por comas.
+    """
+    out: dict[str, int] = {}
+    for v in values or []:
+        for item in v.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if "=" not in item:
+                raise argparse.ArgumentTypeError(f"Formato provider=N esperado: {item!r}")
+            k, n = item.split("=", 1)
+            out[k.strip()] = int(n)
+    return out
+
+
+@dataclass
+class Budget:
+    """
+    Presupuesto de una ejecución: llamadas totales, minutos y llamadas por provider.
+    0 = sin límite. Las llamadas se cuentan en charge(), justo antes de salir a la red.
+
+    La idea: antes de empezar un venue se pregunta can_start() con su peor caso de
+    llamadas/segundos; si no cabe, no se empieza. Un venue empezado siempre se termina.
+    """
+
+    max_calls: int = 0
+    max_minutes: float = 0.0
+    per_provider: dict[str, int] = field(default_factory=dict)
+    calls: Counter = field(default_factory=Counter)
+    started: float = field(default_factory=time.monotonic)
+    # Veces que charge() ha rechazado una llamada (el venue en curso quedó a medias)
+    refused: int = 0
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.max_calls or self.max_minutes or self.per_provider)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def elapsed_s(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining_calls(self, provider: Optional[str] = None) -> Optional[int]:
+        rem: Optional[int] = None
+        if self.max_calls:
+            rem = self.max_calls - self.total_calls
+        if provider and provider in self.per_provider:
+            p_rem = self.per_provider[provider] - self.calls[provider]
+            rem = p_rem if rem is None else min(rem, p_rem)
+        return rem
+
+    def remaining_s(self) -> Optional[float]:
+        if not self.max_minutes:
+            return None
+        return self.max_minutes * 60.0 - self.elapsed_s()
+
+    def charge(self, provider: str) -> None:
+        rem = self.remaining_calls(provider)
+        if rem is not None and rem <= 0:
+            self.refused += 1
+            raise BudgetExhausted(f"Presupuesto agotado para {provider}")
+        self.calls[provider] += 1
+
+    def can_start(self, worst_calls: int, worst_s: float, providers: tuple[str, ...] = ()) -> bool:
+        """
+        ¿Cabe un venue más con este peor caso de llamadas y segundos?
+        providers: los que usa la cascada; si están todos agotados no tiene sentido seguir.
+        """
+        rem = self.remaining_calls()
+        if rem is not None and rem < worst_calls:
+            return False
+        if providers and all(self._exhausted(p) for p in providers):
+            return False
+        rem_s = self.remaining_s()
+        if rem_s is not None and rem_s < worst_s:
+            return False
+        return True
+
+    def _exhausted(self, provider: str) -> bool:
+        rem = self.remaining_calls(provider)
+        return rem is not None and rem <= 0
+
+    def report(self) -> str:
+        parts = [f"calls={self.total_calls}" + (f"/{self.max_calls}" if self.max_calls else "")]
+        for p in sorted(set(self.calls) | set(self.per_provider)):
+            lim = self.per_provider.get(p)
+            parts.append(f"{p}={self.calls[p]}" + (f"/{lim}" if lim else ""))
+        mins = self.elapsed_s() / 60.0
+        parts.append(f"min={mins:.1f}" + (f"/{self.max_minutes:g}" if self.max_minutes else ""))
+        return " ".join(parts)
+
+
+class RateLimiter:
+    """
+    Intervalo mínimo entre llamadas a cada provider, compartido entre hilos.
+    Cada llamada reserva su hueco bajo el lock y duerme fuera de él, así varios
+    hilos pueden esperar a la vez sin saltarse el ritmo (Nominatim: 1 req/s).
+    """
+
+    def __init__(self, min_interval_s: Optional[dict[str, float]] = None):
+        self.min_interval_s = dict(min_interval_s or {})
+        self._next: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, provider: str) -> None:
+        iv = self.min_interval_s.get(provider, 0.0)
+        if iv <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(provider, 0.0))
+            self._next[provider] = slot + iv
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def add_budget_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--max-calls", type=int, default=0, help="Máximo de llamadas a providers (0 = sin límite)")
+    ap.add_argument("--max-minutes", type=float, default=0.0, help="Ventana máxima en minutos (0 = sin límite)")
+    ap.add_argument(
+        "--provider-budget",
+        action="append",
+        default=[],
+        help="Llamadas máximas por provider, p.ej. nominatim=500 (repetible)",
+    )
+    ap.add_argument("--out_remaining", default="", help="CSV con los venues pendientes para la siguiente ventana")
+
+
+def budget_from_args(args: argparse.Namespace) -> Budget:
+    return Budget(
+        max_calls=args.max_calls,
+        max_minutes=args.max_minutes,
+        per_provider=parse_provider_budgets(args.provider_budget),
+    )
+
+
+def remaining_path(args: argparse.Namespace, in_path: Path) -> Path:
+    if args.out_remaining:
+        return Path(args.out_remaining)
+    return in_path.with_name(f"{in_path.stem}_remaining.csv")
+
+
+def write_remaining(path: Path, fieldnames: list[str], rows: list[dict]) -> None:
+    """Mismas columnas que la entrada: el CSV sirve tal cual como --input de la siguiente ventana."""
+    with FanOut([CsvSink(path, fieldnames)]) as out:
+        for r in rows:
+            out.write(r)
+
+
+# Latencia típica de una llamada (sin contar el sleep de cortesía), para estimar tiempos
+EST_LATENCY_S = {"nominatim": 0.6, "photon": 0.4}
+
+
+@dataclass
+class QueryPlan:
+    """
+    Estimación de coste de una ejecución sin tocar la red (--plan-only).
+    min = cada venue se resuelve con la primera llamada; max = cascada completa.
+    """
+
+    rows: int = 0
+    from_store: int = 0
+    from_gazetteer: int = 0
+    first_strategy: Counter = field(default_factory=Counter)
+    strategies: Counter = field(default_factory=Counter)
+    calls_min: Counter = field(default_factory=Counter)
+    calls_max: Counter = field(default_factory=Counter)
+    sleep_min_s: float = 0.0
+    sleep_max_s: float = 0.0
+
+    def add_network(
+        self,
+        strategies: list[str],
+        calls_min: dict[str, int],
+        calls_max: dict[str, int],
+        sleep_min_s: float,
+        sleep_max_s: float,
+    ) -> None:
+        if strategies:
+            self.first_strategy[strategies[0]] += 1
+        self.strategies.update(strategies)
+        self.calls_min.update(calls_min)
+        self.calls_max.update(calls_max)
+        self.sleep_min_s += sleep_min_s
+        self.sleep_max_s += sleep_max_s
+
+    def _wall_s(self, calls: Counter, sleep_s: float) -> float:
+        return sleep_s + sum(n * EST_LATENCY_S.get(p, 0.5) for p, n in calls.items())
+
+    def report(self, budget: Optional[Budget] = None) -> str:
+        net = self.rows - self.from_store - self.from_gazetteer
+        lines = [
+            f"Filas: {self.rows}",
+            f"  reaprovechadas de --store: {self.from_store}",
+            f"  resueltas con gazetteer local: {self.from_gazetteer}",
+            f"  a geocodificar por red: {net}",
+            "Primera estrategia de la cascada (filas):",
+        ]
+        for k, n in self.first_strategy.most_common():
+            lines.append(f"  {k}: {n}")
+        lines.append("Queries planificadas por estrategia (peor caso):")
+        for k, n in self.strategies.most_common():
+            lines.append(f"  {k}: {n}")
+        lines.append("Llamadas por provider (min - max):")
+        for p in sorted(set(self.calls_min) | set(self.calls_max)):
+            lines.append(f"  {p}: {self.calls_min[p]} - {self.calls_max[p]}")
+        t_min = self._wall_s(self.calls_min, self.sleep_min_s) / 60.0
+        t_max = self._wall_s(self.calls_max, self.sleep_max_s) / 60.0
+        lines.append(f"Tiempo estimado: {t_min:.1f} - {t_max:.1f} min")
+        if budget is not None and budget.max_calls:
+            total_max = sum(self.calls_max.values())
+            lines.append(f"Presupuesto --max-calls={budget.max_calls} (peor caso {total_max})")
+        if budget is not None and budget.max_minutes:
+            lines.append(f"Presupuesto --max-minutes={budget.max_minutes:g} (peor caso {t_max:.1f})")
+        return "\n".join(lines)
@@ -5,12 +5,35 @@ import csv
 import re
 import time
 import urllib.parse
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional
 
 import requests
 
+from coord_store import (
+    DEFAULT_RETRY_DAYS,
+    DEFAULT_TTL_DAYS,
+    STATUS_MISS,
+    STATUS_OK,
+    STATUS_REVIEW,
+    CoordStore,
+    row_fingerprint,
+)
+from geocode_budget import Budget, QueryPlan, RateLimiter, add_budget_args, budget_from_args, remaining_path, write_remaining
+from sinks import CsvSink, FanOut
+from textnorm import (
+    CITY_BOUNDS,
+    base_city,
+    in_city_bounds,
+    looks_plausible,
+    norm,
+    province_hint,
+    split_city_parts,
+    split_street_number,
+)
+from venue_priority import VenueQueue, add_priority_args, signals_from_args
+
 # -----------------------------
 # Config
 # -----------------------------
@@ -23,6 +46,10 @@ HEADERS = {
     "Accept-Language": "es",
 }
 
+# Versión de la lógica de queries (build_query, split_street_number, cascada en main).
+# Súbela si cambias cómo se construyen: invalida las huellas guardadas en --store.
+QUERY_VERSION = "by_address-v2"
+
 # Viewbox (left,top,right,bottom). Sirve para "encapsular" el geocoding y que no se vaya a otra provincia.
 VIEWBOX = {
     # Valencia ciudad (aprox)
@@ -31,96 +58,41 @@ VIEWBOX = {
     "alicante": "-0.563,38.407,-0.435,38.332",
 }
 
-# Bounds para sanity-check (lat_min, lat_max, lon_min, lon_max)
-CITY_BOUNDS = {
-    "valencia": (39.405, 39.563, -0.431, -0.260),
-    "alicante": (38.332, 38.407, -0.563, -0.435),
-}
+# Columnas de salida. osm_score/osm_match: plausibilidad OSM del hit (con --osm-index)
+OK_FIELDS = ["venue_id", "lat", "lon", "provider", "label", "query_used", "osm_score", "osm_match"]
+REVIEW_FIELDS = [
+    "venue_id",
+    "name",
+    "city",
+    "address_text",
+    "google_maps_url",
+    "query_used",
+    "provider",
+    "lat",
+    "lon",
+    "label",
+    "reason",
+    "osm_score",
+    "osm_match",
+    "candidates",
+]
+
+# Resultados por llamada: decide el primero (como con limit=1) y el resto, que no cuesta
+# otra llamada, queda como candidato alternativo de las filas REVIEW (review_candidates.py)
+RESULT_LIMIT = 5
+
+# Presupuesto de llamadas de la ejecución (main lo sustituye si hay --max-calls/--max-minutes/...)
+BUDGET = Budget()
+
+# Ritmo mínimo por provider, común a todos los hilos (lo usa geocode_service.py con varios workers;
+# en la CLI secuencial el sleep de después de cada llamada ya lo cubre)
+RATE = RateLimiter({"nominatim": 1.0})
 
 # -----------------------------
 # Helpers
 # -----------------------------
 
 
-def norm(s: str) -> str:
-    s = (s or "").strip().lower()
-    s = s.replace("à", "a").replace("á", "a").replace("ä", "a")
-    s = s.replace("è", "e").replace("é", "e").replace("ë", "e")
-    s = s.replace("ì", "i").replace("í", "i").replace("ï", "i")
-    s = s.replace("ò", "o").replace("ó", "o").replace("ö", "o")
-    s = s.replace("ù", "u").replace("ú", "u").replace("ü", "u")
-    s = s.replace("ç", "c")
-    return re.sub(r"\s+", " ", s)
-
-
-def split_city_parts(city: str) -> list[str]:
-    """
-    Admite cosas como:
-      - "Valencia"
-      - "Borbotó (Valencia)"
-      - "Alacant/Alicante" (si alguna vez apareciera)
-    Devuelve una lista de tokens plausibles para "match" contra labels.
-    """
-    c = (city or "").strip()
-    parts: list[str] = []
-    if not c:
-        return parts
-
-    # Lo de dentro de paréntesis ayuda a validar labels (p.ej. "Borbotó (Valencia)")
-    m = re.findall(r"\((.*?)\)", c)
-    if m:
-        parts.extend([p.strip() for p in m if p.strip()])
-
-    # Y el "city base" sin paréntesis
-    base = re.sub(r"\s*\(.*?\)\s*", " ", c).strip()
-    if base:
-        parts.append(base)
-
-    # Split por separadores comunes
-    out: list[str] = []
-    for p in parts:
-        out.extend([x.strip() for x in re.split(r"[/,-]", p) if x.strip()])
-
-    # Quita duplicados manteniendo orden
-    seen = set()
-    final = []
-    for p in out:
-        n = norm(p)
-        if n and n not in seen:
-            seen.add(n)
-            final.append(p)
-    return final
-
-
-def base_city(city: str) -> str:
-    """
-    Para construir query: si viene "Borbotó (Valencia)" devolvemos "Borbotó, Valencia"
-    para ayudar al geocoding sin perder el ancla provincial.
-    """
-    c = (city or "").strip()
-    if not c:
-        return ""
-    inners = re.findall(r"\((.*?)\)", c)
-    outer = re.sub(r"\s*\(.*?\)\s*", " ", c).strip()
-    if inners and outer:
-        # "outer, inner"
-        inner = inners[0].strip()
-        if inner and inner.lower() not in outer.lower():
-            return f"{outer}, {inner}"
-    return outer or c
-
-
-def province_hint(city: str) -> str:
-    c = norm(city)
-    if "valencia" in c or "valencia" in " ".join(split_city_parts(city)).lower():
-        return "Valencia"
-    if "alicante" in c or "alacant" in c or "alicante" in " ".join(split_city_parts(city)).lower():
-        return "Alicante"
-    if "castellon" in c or "castello" in c:
-        return "Castellón"
-    return ""
-
-
 def clean_address(addr: str) -> str:
     s = (addr or "").strip()
     s = re.sub(r"\s+", " ", s)
@@ -157,26 +129,40 @@ def apply_city_viewbox(params: dict, city: str) -> None:
         params["bounded"] = 1
 
 
-def in_city_bounds(city: str, lat: float, lon: float) -> bool:
-    c = norm(city)
-    if c not in CITY_BOUNDS:
-        return True  # no restringimos otras ciudades
-    lat_min, lat_max, lon_min, lon_max = CITY_BOUNDS[c]
-    return (lat_min <= lat <= lat_max) and (lon_min <= lon <= lon_max)
-
-
 @dataclass
 class Hit:
     lat: float
     lon: float
     label: str
     provider: str
+    # "node/123" si el proveedor identifica el objeto OSM
+    osm_ref: str = ""
+
+
+# Photon abrevia el tipo de objeto OSM
+PHOTON_OSM_TYPES = {"N": "node", "W": "way", "R": "relation"}
+
+
+def _nominatim_hits(data: list, provider: str) -> list[Hit]:
+    out = []
+    for it in data:
+        ref = f"{it['osm_type']}/{it['osm_id']}" if it.get("osm_type") and it.get("osm_id") else ""
+        out.append(Hit(float(it["lat"]), float(it["lon"]), it.get("display_name", ""), provider, ref))
+    return out
+
+
+def _first(hits: list[Hit], seen: Optional[list[Hit]]) -> Optional[Hit]:
+    if seen is not None:
+        seen.extend(hits)
+    return hits[0] if hits else None
 
 
 def _nominatim_get(params: dict, sleep_s: float) -> list:
     """
     Llamada a Nominatim con gestión básica de rate-limit.
     """
+    RATE.wait("nominatim")
+    BUDGET.charge("nominatim")
     r = requests.get(NOMINATIM_URL, params=params, headers=HEADERS, timeout=25)
 
     if r.status_code in (429, 403):
@@ -188,24 +174,22 @@ def _nominatim_get(params: dict, sleep_s: float) -> list:
     return data if isinstance(data, list) else []
 
 
-def query_nominatim_freeform(q: str, city: str, sleep_s: float) -> Optional[Hit]:
+def query_nominatim_freeform(q: str, city: str, sleep_s: float, seen: Optional[list[Hit]] = None) -> Optional[Hit]:
     params = {
         "q": q,
         "format": "json",
-        "limit": 1,
+        "limit": RESULT_LIMIT,
         "addressdetails": 1,
         "countrycodes": "es",
         "email": "pablo_penichet@yahoo.es",
     }
     apply_city_viewbox(params, city)
-    data = _nominatim_get(params, sleep_s)
-    if not data:
-        return None
-    it = data[0]
-    return Hit(lat=float(it["lat"]), lon=float(it["lon"]), label=it.get("display_name", ""), provider="nominatim")
+    return _first(_nominatim_hits(_nominatim_get(params, sleep_s), "nominatim"), seen)
 
 
-def query_nominatim_structured(street: str, housenumber: str, city: str, sleep_s: float) -> Optional[Hit]:
+def query_nominatim_structured(
+    street: str, housenumber: str, city: str, sleep_s: float, seen: Optional[list[Hit]] = None
+) -> Optional[Hit]:
     if not street or not housenumber or not city:
         return None
     params = {
@@ -213,34 +197,33 @@ def query_nominatim_structured(street: str, housenumber: str, city: str, sleep_s
         "city": city,
         "country": "Spain",
         "format": "json",
-        "limit": 1,
+        "limit": RESULT_LIMIT,
         "addressdetails": 1,
         "countrycodes": "es",
         "email": "pablo_penichet@yahoo.es",
     }
     apply_city_viewbox(params, city)
-    data = _nominatim_get(params, sleep_s)
-    if not data:
-        return None
-    it = data[0]
-    return Hit(lat=float(it["lat"]), lon=float(it["lon"]), label=it.get("display_name", ""), provider="nominatim_struct")
+    return _first(_nominatim_hits(_nominatim_get(params, sleep_s), "nominatim_struct"), seen)
 
 
-def query_photon(q: str) -> Optional[Hit]:
-    params = {"q": q, "limit": 1, "lang": "es"}
+def query_photon(q: str, seen: Optional[list[Hit]] = None) -> Optional[Hit]:
+    params = {"q": q, "limit": RESULT_LIMIT, "lang": "es"}
+    RATE.wait("photon")
+    BUDGET.charge("photon")
     r = requests.get(PHOTON_URL, params=params, headers=HEADERS, timeout=25)
     r.raise_for_status()
     data = r.json()
-    feats = data.get("features") or []
-    if not feats:
-        return None
-    f = feats[0]
-    coords = f["geometry"]["coordinates"]
-    props = f.get("properties") or {}
-    label = " | ".join(
-        [str(props.get(k)) for k in ("name", "street", "housenumber", "city", "state", "country") if props.get(k)]
-    )
-    return Hit(lat=float(coords[1]), lon=float(coords[0]), label=label, provider="photon")
+    hits = []
+    for f in data.get("features") or []:
+        coords = f["geometry"]["coordinates"]
+        props = f.get("properties") or {}
+        label = " | ".join(
+            [str(props.get(k)) for k in ("name", "street", "housenumber", "city", "state", "country") if props.get(k)]
+        )
+        osm_type = PHOTON_OSM_TYPES.get(props.get("osm_type") or "", "")
+        ref = f"{osm_type}/{props['osm_id']}" if osm_type and props.get("osm_id") else ""
+        hits.append(Hit(lat=float(coords[1]), lon=float(coords[0]), label=label, provider="photon", osm_ref=ref))
+    return _first(hits, seen)
 
 
 def build_query(name: str, address: str, city: str) -> str:
@@ -258,175 +241,410 @@ def build_query(name: str, address: str, city: str) -> str:
     return ", ".join([p for p in parts if p])
 
 
-def looks_plausible(city: str, label: str) -> bool:
-    """
-    Heurística suave: si Nominatim te da algo en ES pero sin ciudad clara,
-    no lo tiramos automáticamente. Solo usamos esto como filtro de "alarmas".
-    """
-    if not label:
-        return True
-
-    label_n = norm(label)
-
-    # Si el label menciona España/València/Alicante, mejor.
-    # Y si el city tiene paréntesis, aceptamos cualquiera de sus partes.
-    city_parts = split_city_parts(city)
-    if not city_parts:
-        return True
-
-    for p in city_parts:
-        pn = norm(p)
-        if pn and pn in label_n:
-            return True
-
-    # fallback: provincia
-    prov = province_hint(city)
-    if prov and norm(prov) in label_n:
-        return True
-
-    return False
-
-
-def try_geocode_freeform(q: str, city: str, sleep_s: float) -> Optional[Hit]:
+def try_geocode_freeform(q: str, city: str, sleep_s: float, seen: Optional[list[Hit]] = None) -> Optional[Hit]:
     # Nominatim -> Photon
     try:
-        h = query_nominatim_freeform(q, city, sleep_s)
+        h = query_nominatim_freeform(q, city, sleep_s, seen)
     except Exception:
         h = None
     if h is not None:
         return h
     try:
-        return query_photon(q)
+        return query_photon(q, seen)
     except Exception:
         return None
 
 
-def split_street_number(address: str) -> tuple[str, str]:
+@dataclass
+class Resolution:
+    """Resultado de la cascada para un venue. reason vacío + hit = OK."""
+
+    hit: Optional[Hit] = None
+    query_used: str = ""
+    provider: str = ""
+    label: str = ""
+    reason: str = ""
+    # Plausibilidad OSM del hit (con osm_ix) y si fue ella la que levantó un label_mismatch_city
+    osm_check: Optional[object] = None
+    osm_accepted: bool = False
+    # Todos los resultados de proveedor de la cascada, con su query (candidatos de REVIEW)
+    seen: list[tuple[Hit, str]] = field(default_factory=list)
+
+    @property
+    def status(self) -> str:
+        if self.hit is None:
+            return STATUS_MISS
+        return STATUS_REVIEW if self.reason else STATUS_OK
+
+
+def resolve_venue(
+    name: str,
+    city: str,
+    queries: list[tuple[str, str]],
+    sleep_s: float,
+    local=None,
+    osm_ix=None,
+) -> Resolution:
+    """
+    Cascada completa + validaciones para un venue. `queries` sale de plan_queries();
+    `local` es un match del gazetteer OSM (si lo hay, no se sale a la red).
+    La usan main() y geocode_worker.py.
+    """
+    base_c = base_city(city)
+    res = Resolution()
+
+    if local is not None:
+        res.hit = Hit(lat=local.lat, lon=local.lon, label=local.label, provider="osm_local")
+        res.query_used = f"OSM:{local.osm_type}/{local.osm_id}"
+        queries = []
+
+    for qq, why in queries:
+        found: list[Hit] = []
+        if qq.startswith("STRUCT::"):
+            # Structured via Nominatim
+            _, street, num = qq.split("::", 2)
+            used = f"{street} {num}, {base_c or city}"
+            try:
+                h = query_nominatim_structured(street, num, city=base_c or city, sleep_s=sleep_s, seen=found)
+            except Exception:
+                h = None
+            res.seen.extend((f, used) for f in found)
+            if h is not None:
+                res.hit = h
+                res.query_used = used
+                break
+            continue
+
+        h = try_geocode_freeform(qq, city=base_c or city, sleep_s=sleep_s, seen=found)
+        res.seen.extend((f, qq) for f in found)
+        if h is not None:
+            res.hit = h
+            res.query_used = qq
+            break
+
+    hit = res.hit
+    if hit is None:
+        return res
+    res.provider = hit.provider
+    res.label = hit.label
+
+    # Validaciones
+    plausible = looks_plausible(city, res.label)
+    bounds_ok = in_city_bounds(norm(base_c or city), hit.lat, hit.lon)
+
+    if not plausible:
+        res.reason = "label_mismatch_city"
+    elif not bounds_ok and norm(base_c or city) in CITY_BOUNDS:
+        res.reason = "bbox_outside_city"
+
+    if osm_ix is not None:
+        res.osm_check = osm_ix.plausibility(name, hit.lat, hit.lon)
+        # El label no nombra la ciudad, pero si hay un local OSM con el mismo nombre
+        # a pocos metros del punto, el hit es bueno: lo aceptamos sin otra pasada.
+        if res.reason == "label_mismatch_city" and res.osm_check.accepted:
+            res.reason = ""
+            res.osm_accepted = True
+    return res
+
+
+def osm_columns(pl) -> dict:
+    """osm_score/osm_match de las salidas a partir de un Plausibility (vacías sin --osm-index)."""
+    if pl is None:
+        return {"osm_score": "", "osm_match": ""}
+    m = pl.match
+    return {"osm_score": f"{pl.score:.2f}", "osm_match": f"{m.osm_type}/{m.osm_id}" if m is not None else ""}
+
+
+def plan_queries(name: str, city: str, addr: str, gmaps_q: str) -> list[tuple[str, str]]:
     """
-    Intenta separar "Calle X 12" en ("Calle X", "12").
-    Suficiente para un structured search básico.
+    Cascada de queries (query, estrategia) en orden de preferencia para una fila.
     """
-    if not address:
-        return "", ""
-    m = re.search(r"^(.*?)[, ]+(\d+[A-Za-z]?)\b", address.strip())
-    if not m:
-        return "", ""
-    street = m.group(1).strip()
-    num = m.group(2).strip()
-    return street, num
+    prov = province_hint(city)
+    base_c = base_city(city)
+
+    queries: list[tuple[str, str]] = []
+
+    # 1) Address-first (muy potente en capitales)
+    if addr:
+        q_addr = ", ".join([p for p in [addr, base_c, prov if prov and prov.lower() not in base_c.lower() else "", "España"] if p])
+        queries.append((q_addr, "addr_first"))
+
+        # Structured attempt si podemos separar calle + número
+        street, num = split_street_number(addr)
+        if street and num:
+            queries.append((f"STRUCT::{street}::{num}", "nominatim_struct"))
+
+    # 2) Si hay query en google maps: úsala
+    if gmaps_q:
+        queries.append((gmaps_q, "gmaps_query"))
+
+    # 3) Por nombre + ciudad (fallback)
+    queries.append((build_query(name, "", city), "name_city"))
+    return queries
+
+
+def is_ok(row: dict) -> bool:
+    return not row["reason"]
+
+
+def is_review(row: dict) -> bool:
+    return bool(row["reason"])
+
+
+def worst_case_calls(queries: list[tuple[str, str]]) -> int:
+    # Structured: solo Nominatim. Freeform: Nominatim y, si falla, Photon.
+    return sum(1 if qq.startswith("STRUCT::") else 2 for qq, _ in queries)
+
+
+def network_cost(queries: list[tuple[str, str]], sleep_s: float) -> tuple[dict, dict, float, float]:
+    """(llamadas min, llamadas max, sleep min, sleep max) de una cascada, para --plan-only."""
+    if not queries:
+        return {}, {}, 0.0, 0.0
+    n_nom = len(queries)
+    n_photon = sum(1 for qq, _ in queries if not qq.startswith("STRUCT::"))
+    return {"nominatim": 1}, {"nominatim": n_nom, "photon": n_photon}, sleep_s, n_nom * sleep_s
+
+
+def print_plan(queue: VenueQueue, args, store: Optional[CoordStore], gazetteer) -> None:
+    """
+    --plan-only: construye la cascada de cada fila y la contrasta con --store y el
+    gazetteer local, sin ninguna llamada de red.
+    """
+    plan = QueryPlan()
+    for _, row in queue:
+        plan.rows += 1
+        venue_id = (row.get("venue_id") or row.get("id") or "").strip()
+        name = (row.get("name") or "").strip()
+        city = (row.get("city") or "").strip()
+        if store is not None and not args.refresh:
+            fp = row_fingerprint(row, QUERY_VERSION)
+            if store.reusable(venue_id, fp, ttl_days=args.ttl_days, retry_days=args.retry_days) is not None:
+                plan.from_store += 1
+                continue
+        if gazetteer is not None and gazetteer.lookup(name, city) is not None:
+            plan.from_gazetteer += 1
+            continue
+        addr = clean_address((row.get("address_text") or "").strip())
+        gmaps_q = parse_gmaps_query((row.get("google_maps_url") or "").strip())
+        queries = plan_queries(name, city, addr, gmaps_q)
+        plan.add_network([why for _, why in queries], *network_cost(queries, args.sleep))
+    print(plan.report(BUDGET))
 
 
 def main():
+    global BUDGET
+
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", default="venues_need_coords.csv")
     ap.add_argument("--out_ok", default="venue_coords_OK.csv")
     ap.add_argument("--out_review", default="venue_coords_REVIEW.csv")
+    ap.add_argument("--out_candidates", default="", help="Candidatos de las filas REVIEW (por defecto <out_review>_candidates.csv)")
+    ap.add_argument("--top-k", type=int, default=5, help="Candidatos por fila REVIEW (0 = no los genera)")
     ap.add_argument("--sleep", type=float, default=1.1, help="Sleep entre calls a Nominatim (>=1 recomendable)")
+    ap.add_argument("--store", default="", help="SQLite de coordenadas (coord_store.py); salta venues ya asentados")
+    ap.add_argument("--run-id", default="", help="Identificador de la ejecución para la procedencia en --store")
+    ap.add_argument("--refresh", action="store_true", help="Con --store: re-geocodifica también los ya asentados")
+    ap.add_argument("--ttl-days", type=float, default=DEFAULT_TTL_DAYS, help="Con --store: caducidad de un OK guardado")
+    ap.add_argument("--retry-days", type=float, default=DEFAULT_RETRY_DAYS, help="Con --store: reintento de MISS/REVIEW")
+    ap.add_argument("--gazetteer", default="", help="Export OSM (osm_venues_import.csv) como gazetteer local")
+    ap.add_argument("--osm-index", default="", help="Export OSM para validar hits por cercanía (sin red)")
+    ap.add_argument("--plan-only", action="store_true", help="Solo estima llamadas y tiempo; no sale a la red")
+    add_priority_args(ap)
+    add_budget_args(ap)
     args = ap.parse_args()
 
+    BUDGET = budget_from_args(args)
+
+    gazetteer = None
+    if args.gazetteer:
+        from osm_index import OsmGazetteer  # import diferido: solo hace falta con --gazetteer
+
+        gazetteer = OsmGazetteer.from_csv(args.gazetteer)
+
+    osm_ix = None
+    if args.osm_index:
+        from osm_index import OsmSpatialIndex
+
+        osm_ix = OsmSpatialIndex.from_csv(args.osm_index)
+
+    store = CoordStore(args.store) if args.store else None
+    run_id = args.run_id or time.strftime("by_address:%Y%m%dT%H%M%S")
+
     in_path = Path(args.input)
     rows: list[dict] = []
     with in_path.open("r", encoding="utf-8", newline="") as f:
         r = csv.DictReader(f)
+        in_fields = list(r.fieldnames or [])
         for row in r:
             rows.append(row)
 
-    ok_rows: list[dict] = []
-    review_rows: list[dict] = []
     total = len(rows)
-
-    for i, row in enumerate(rows, start=1):
-        venue_id = (row.get("venue_id") or row.get("id") or "").strip()
-        name = (row.get("name") or "").strip()
-        city = (row.get("city") or "").strip()
-        addr_raw = (row.get("address_text") or "").strip()
-        addr = clean_address(addr_raw)
-        gmaps_url = (row.get("google_maps_url") or "").strip()
-        gmaps_q = parse_gmaps_query(gmaps_url)
-
-        prov = province_hint(city)
-        base_c = base_city(city)
-
-        queries: list[tuple[str, str]] = []
-
-        # 1) Address-first (muy potente en capitales)
-        if addr:
-            q_addr = ", ".join([p for p in [addr, base_c, prov if prov and prov.lower() not in base_c.lower() else "", "España"] if p])
-            queries.append((q_addr, "addr_first"))
-
-            # Structured attempt si podemos separar calle + número
-            street, num = split_street_number(addr)
-            if street and num:
-                queries.append((f"STRUCT::{street}::{num}", "nominatim_struct"))
-
-        # 2) Si hay query en google maps: úsala
-        if gmaps_q:
-            queries.append((gmaps_q, "gmaps_query"))
-
-        # 3) Por nombre + ciudad (fallback)
-        queries.append((build_query(name, "", city), "name_city"))
-
-        hit: Optional[Hit] = None
-        used = ""
-        provider = ""
-        label = ""
-        reason = ""
-
-        for qq, why in queries:
-            if qq.startswith("STRUCT::"):
-                # Structured via Nominatim
-                _, street, num = qq.split("::", 2)
-                try:
-                    h = query_nominatim_structured(street, num, city=base_c or city, sleep_s=args.sleep)
-                except Exception:
-                    h = None
-                if h is not None:
-                    hit = h
-                    used = f"{street} {num}, {base_c or city}"
-                    provider = h.provider
-                    label = h.label
-                    break
+    reused = 0
+    remaining: list[dict] = []
+
+    # Los venues más valiosos primero: si la ejecución se corta, ya están resueltos y escritos
+    queue = VenueQueue(rows, signals_from_args(args))
+
+    if args.plan_only:
+        print_plan(queue, args, store, gazetteer)
+        if store is not None:
+            store.close()
+        return
+
+    # Un único stream de resultados -> OK (import) y REVIEW, con escritura atómica
+    ok_sink = CsvSink(args.out_ok, OK_FIELDS, where=is_ok)
+    rev_sink = CsvSink(args.out_review, REVIEW_FIELDS, where=is_review)
+
+    # Candidatos alternativos de REVIEW/MISS: resultados ya pagados + locales OSM, sin red
+    cand_sinks = []
+    if args.top_k > 0:
+        from review_candidates import CANDIDATE_FIELDS, Candidate, candidate_rows, rank_candidates
+
+        rev_path = Path(args.out_review)
+        cand_path = args.out_candidates or rev_path.with_name(f"{rev_path.stem}_candidates{rev_path.suffix}")
+        cand_sinks.append(CsvSink(cand_path, CANDIDATE_FIELDS))
+
+    def candidates(venue_id: str, name: str, city: str, seen: list[tuple[Hit, str]], hit) -> int:
+        if not cand_sinks:
+            return 0
+        pool = [Candidate(h.lat, h.lon, h.label, h.provider, q, h.osm_ref) for h, q in seen]
+        ranked = rank_candidates(name, city, pool, hit, gazetteer=gazetteer, osm_ix=osm_ix, k=args.top_k)
+        for r in candidate_rows(venue_id, ranked):
+            cand_out.write(r)
+        return len(ranked)
+
+    with FanOut([ok_sink, rev_sink]) as out, FanOut(cand_sinks) as cand_out:
+        for i, (prio, row) in enumerate(queue, start=1):
+            venue_id = (row.get("venue_id") or row.get("id") or "").strip()
+            name = (row.get("name") or "").strip()
+            city = (row.get("city") or "").strip()
+            addr_raw = (row.get("address_text") or "").strip()
+            addr = clean_address(addr_raw)
+            gmaps_url = (row.get("google_maps_url") or "").strip()
+            gmaps_q = parse_gmaps_query(gmaps_url)
+
+            fp = row_fingerprint(row, QUERY_VERSION)
+            known = None
+            if store is not None and not args.refresh:
+                known = store.reusable(venue_id, fp, ttl_days=args.ttl_days, retry_days=args.retry_days)
+            if known is not None:
+                reused += 1
+                if known.settled:
+                    print(f"[{i}/{total}] SKIP    {name} ({city}) -> {known.lat:.6f},{known.lon:.6f} [{known.provider}] (store)")
+                    out.write(
+                        {
+                            "venue_id": venue_id,
+                            "name": name,
+                            "city": city,
+                            "address_text": addr,
+                            "google_maps_url": gmaps_url,
+                            "query_used": known.query_used,
+                            "provider": known.provider,
+                            "lat": known.lat,
+                            "lon": known.lon,
+                            "label": known.label,
+                            "reason": "",
+                        }
+                    )
+                else:
+                    print(f"[{i}/{total}] SKIP    {name} ({city}) -> {known.status} (store)")
+                    # Sin respuestas guardadas: solo los candidatos OSM alrededor del punto del store
+                    stored_hit = None if known.lat is None else (known.lat, known.lon)
+                    out.write(
+                        {
+                            "venue_id": venue_id,
+                            "name": name,
+                            "city": city,
+                            "address_text": addr,
+                            "google_maps_url": gmaps_url,
+                            "query_used": known.query_used,
+                            "provider": known.provider,
+                            "lat": "" if known.lat is None else known.lat,
+                            "lon": "" if known.lon is None else known.lon,
+                            "label": known.label,
+                            "reason": f"stored_{known.status.lower()}",
+                            "candidates": candidates(venue_id, name, city, [], stored_hit),
+                        }
+                    )
                 continue
 
-            h = try_geocode_freeform(qq, city=base_c or city, sleep_s=args.sleep)
-            if h is not None:
-                hit = h
-                used = qq
-                provider = h.provider
-                label = h.label
+            queries = plan_queries(name, city, addr, gmaps_q)
+
+            # Gazetteer local (OSM): con un match inequívoco no salimos a la red
+            local = gazetteer.lookup(name, city) if gazetteer is not None else None
+            if local is not None:
+                queries = []
+
+            # Presupuesto: si el peor caso de este venue no cabe, no lo empezamos
+            worst = worst_case_calls(queries)
+            if worst and not BUDGET.can_start(worst, worst * max(args.sleep, 1.0), providers=("nominatim", "photon")):
+                remaining.append(row)
+                remaining.extend(queue.drain())
+                print(f"[{i}/{total}] STOP    presupuesto casi agotado ({BUDGET.report()})")
                 break
+            refused_before = BUDGET.refused
 
-        if hit is None:
-            print(f"[{i}/{total}] MISS    {name} ({city}) -> sin resultado")
-            review_rows.append(
-                {
-                    "venue_id": venue_id,
-                    "name": name,
-                    "city": city,
-                    "address_text": addr,
-                    "google_maps_url": gmaps_url,
-                    "query_used": used,
-                    "provider": "",
-                    "lat": "",
-                    "lon": "",
-                    "label": "",
-                    "reason": "no_result",
-                }
-            )
-            continue
+            res = resolve_venue(name, city, queries, args.sleep, local=local, osm_ix=osm_ix)
+            hit, used, provider, label, reason = res.hit, res.query_used, res.provider, res.label, res.reason
+
+            if hit is None and BUDGET.refused > refused_before:
+                # Cascada cortada por presupuesto: no es un MISS real, queda para la siguiente ventana
+                print(f"[{i}/{total}] PEND    {name} ({city}) -> sin presupuesto para completar la cascada")
+                remaining.append(row)
+                continue
 
-        # Validaciones
-        plausible = looks_plausible(city, label)
-        bounds_ok = in_city_bounds(norm(base_c or city), hit.lat, hit.lon)
+            if hit is None:
+                print(f"[{i}/{total}] MISS    {name} ({city}) -> sin resultado")
+                if store is not None:
+                    store.record(venue_id, None, None, STATUS_MISS, query_used=used, run_id=run_id, fingerprint=fp)
+                out.write(
+                    {
+                        "venue_id": venue_id,
+                        "name": name,
+                        "city": city,
+                        "address_text": addr,
+                        "google_maps_url": gmaps_url,
+                        "query_used": used,
+                        "provider": "",
+                        "lat": "",
+                        "lon": "",
+                        "label": "",
+                        "reason": "no_result",
+                        "candidates": candidates(venue_id, name, city, res.seen, None),
+                    }
+                )
+                continue
 
-        if not plausible:
-            reason = "label_mismatch_city"
-        elif not bounds_ok and norm(base_c or city) in CITY_BOUNDS:
-            reason = "bbox_outside_city"
+            if res.osm_accepted:
+                print(f"[{i}/{total}] ACCEPT  {name} ({city}) -> {res.osm_check.describe()}")
+
+            if reason:
+                print(f"[{i}/{total}] REVIEW  {name} ({city}) -> {hit.lat:.6f},{hit.lon:.6f} [{provider}] ({reason})")
+                if store is not None:
+                    store.record(venue_id, hit.lat, hit.lon, STATUS_REVIEW, provider, used, label, run_id, fingerprint=fp)
+                out.write(
+                    {
+                        "venue_id": venue_id,
+                        "name": name,
+                        "city": city,
+                        "address_text": addr,
+                        "google_maps_url": gmaps_url,
+                        "query_used": used,
+                        "provider": provider,
+                        "lat": hit.lat,
+                        "lon": hit.lon,
+                        "label": label,
+                        "reason": reason,
+                        **osm_columns(res.osm_check),
+                        "candidates": candidates(venue_id, name, city, res.seen, (hit.lat, hit.lon)),
+                    }
+                )
+                continue
 
-        if reason:
-            print(f"[{i}/{total}] REVIEW  {name} ({city}) -> {hit.lat:.6f},{hit.lon:.6f} [{provider}] ({reason})")
-            review_rows.append(
+            print(f"[{i}/{total}] OK      {name} ({city}) -> {hit.lat:.6f},{hit.lon:.6f} [{provider}]")
+            if store is not None:
+                store.record(venue_id, hit.lat, hit.lon, STATUS_OK, provider, used, label, run_id, fingerprint=fp)
+            out.write(
                 {
                     "venue_id": venue_id,
                     "name": name,
@@ -438,60 +656,23 @@ def main():
                     "lat": hit.lat,
                     "lon": hit.lon,
                     "label": label,
-                    "reason": reason,
+                    "reason": "",
+                    **osm_columns(res.osm_check),
                 }
             )
-            continue
-
-        print(f"[{i}/{total}] OK      {name} ({city}) -> {hit.lat:.6f},{hit.lon:.6f} [{provider}]")
-        ok_rows.append(
-            {
-                "venue_id": venue_id,
-                "name": name,
-                "city": city,
-                "address_text": addr,
-                "google_maps_url": gmaps_url,
-                "query_used": used,
-                "provider": provider,
-                "lat": hit.lat,
-                "lon": hit.lon,
-                "label": label,
-                "reason": "",
-            }
-        )
 
-    # Write outputs
-    ok_path = Path(args.out_ok)
-    rev_path = Path(args.out_review)
-
-    ok_fields = ["venue_id", "lat", "lon", "provider", "label", "query_used"]
-    with ok_path.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=ok_fields)
-        w.writeheader()
-        for r in ok_rows:
-            w.writerow({k: r.get(k, "") for k in ok_fields})
-
-    rev_fields = [
-        "venue_id",
-        "name",
-        "city",
-        "address_text",
-        "google_maps_url",
-        "query_used",
-        "provider",
-        "lat",
-        "lon",
-        "label",
-        "reason",
-    ]
-    with rev_path.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=rev_fields)
-        w.writeheader()
-        for r in review_rows:
-            w.writerow({k: r.get(k, "") for k in rev_fields})
-
-    print(f"\nOK: {len(ok_rows)} -> {ok_path}")
-    print(f"REVIEW: {len(review_rows)} -> {rev_path}")
+    print(f"\nOK: {ok_sink.kept} -> {ok_sink.path}")
+    print(f"REVIEW: {rev_sink.kept} -> {rev_sink.path}")
+    for path, kept in cand_out.summary():
+        print(f"CANDIDATOS: {kept} -> {path}")
+    if BUDGET.limited:
+        rem_path = remaining_path(args, in_path)
+        write_remaining(rem_path, in_fields, remaining)
+        print(f"PENDIENTES: {len(remaining)} -> {rem_path}")
+        print(f"PRESUPUESTO: {BUDGET.report()}")
+    if store is not None:
+        print(f"STORE: {store.path} reaprovechados={reused}/{total} {store.stats()}")
+        store.close()
 
 
 if __name__ == "__main__":
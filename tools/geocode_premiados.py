@@ -1,3 +1,4 @@
+import argparse
 import csv
 import time
 import urllib.parse
@@ -7,6 +8,13 @@ from typing import Optional, Tuple, Dict, Any
 
 import requests
 
+from coord_store import DEFAULT_RETRY_DAYS, DEFAULT_TTL_DAYS, CoordStore, row_fingerprint
+from geocode_budget import Budget, QueryPlan, add_budget_args, budget_from_args, remaining_path, write_remaining
+from geocode_by_address import PHOTON_OSM_TYPES, osm_columns
+from review_candidates import CANDIDATE_FIELDS, TOP_K, Candidate, candidate_rows, rank_candidates
+from sinks import CsvSink, FanOut, JsonlSink, SqlSink, has_coords
+from venue_priority import VenueQueue, add_priority_args, signals_from_args
+
 # --- Rutas robustas ---
 BASE_DIR = Path(__file__).resolve().parent
 INPUT = str(BASE_DIR / "premiados_sin_coords.csv")
@@ -14,6 +22,26 @@ INPUT = str(BASE_DIR / "premiados_sin_coords.csv")
 OUT_ALL = str(BASE_DIR / "venue_enrichment_premiados_coords_ALL.csv")
 OUT_OK = str(BASE_DIR / "venue_enrichment_premiados_coords_OK.csv")
 OUT_REVIEW = str(BASE_DIR / "venue_enrichment_premiados_coords_REVIEW.csv")
+OUT_OK_MIN = str(BASE_DIR / "venue_enrichment_premiados_coords_OK_min.csv")
+OUT_CANDIDATES = str(BASE_DIR / "venue_enrichment_premiados_coords_REVIEW_candidates.csv")
+
+FIELDNAMES = [
+    "venue_id",
+    "name",
+    "city",
+    "status",
+    "lat",
+    "lon",
+    "service",
+    "query_used",
+    "display",
+    "address_text",
+    "google_maps_url",
+    "hero_image_url",
+    "cover_photo_path",
+]
+# Plausibilidad OSM del hit (con --osm-index): en ALL y REVIEW; el OK es el del import
+OSM_FIELDS = ["osm_score", "osm_match"]
 
 # --- Geocoders sin API key ---
 NOMINATIM_URLS = [
@@ -31,6 +59,15 @@ HEADERS = {
 
 RATE_LIMIT_SECONDS = 1.2  # Conservador para no molestar
 
+# Resultados por llamada: decide el primero y el resto queda como candidato de REVIEW
+RESULT_LIMIT = 5
+
+# Presupuesto de llamadas de la ejecución (main lo sustituye si hay --max-calls/--max-minutes/...)
+BUDGET = Budget()
+
+# Versión de build_queries/geocode_with_fallback. Súbela si cambian: invalida huellas en --store.
+QUERY_VERSION = "premiados-v2"
+
 
 def strip_accents(s: str) -> str:
     if not s:
@@ -82,9 +119,9 @@ def extract_query_from_google_maps_url(url: str) -> str:
         return ""
 
 
-def build_queries(name: str, city: str, address: str, q_maps: str) -> list[str]:
+def build_queries_tagged(name: str, city: str, address: str, q_maps: str) -> list[tuple[str, str]]:
     """
-    Devuelve lista de queries en orden de preferencia.
+    Devuelve lista de (query, estrategia) en orden de preferencia.
     Probamos varias variantes para maximizar aciertos.
     """
     name = (name or "").strip()
@@ -95,41 +132,46 @@ def build_queries(name: str, city: str, address: str, q_maps: str) -> list[str]:
 
     qs = []
     if address:
-        qs.append(f"{name}, {address}, {city_simple}, {base_tail}")
-        qs.append(f"{name}, {address}, {city_simple}")
+        qs.append((f"{name}, {address}, {city_simple}, {base_tail}", "name_addr_tail"))
+        qs.append((f"{name}, {address}, {city_simple}", "name_addr"))
     if q_maps:
-        qs.append(q_maps)
+        qs.append((q_maps, "gmaps_query"))
 
     # Variantes con prefijos típicos (OSM a veces lo tiene como "Bar X" o "Restaurante X")
-    qs.append(f"{name}, {city_simple}, {base_tail}")
-    qs.append(f"Restaurante {name}, {city_simple}, {base_tail}")
-    qs.append(f"Bar {name}, {city_simple}, {base_tail}")
+    qs.append((f"{name}, {city_simple}, {base_tail}", "name_city_tail"))
+    qs.append((f"Restaurante {name}, {city_simple}, {base_tail}", "prefix_restaurante"))
+    qs.append((f"Bar {name}, {city_simple}, {base_tail}", "prefix_bar"))
 
     # Sin cola geográfica (a veces ayuda si ya está en q_maps)
-    qs.append(f"{name}, {city_simple}")
+    qs.append((f"{name}, {city_simple}", "name_city"))
 
     # Dedup manteniendo orden
     seen = set()
     out = []
-    for q in qs:
+    for q, why in qs:
         qq = " ".join(q.split()).strip()
         if qq and qq not in seen:
             seen.add(qq)
-            out.append(qq)
+            out.append((qq, why))
     return out
 
 
-def nominatim_search(query: str) -> Tuple[Optional[float], Optional[float], str, str]:
+def build_queries(name: str, city: str, address: str, q_maps: str) -> list[str]:
+    return [q for q, _ in build_queries_tagged(name, city, address, q_maps)]
+
+
+def nominatim_search(query: str, seen: Optional[list] = None) -> Tuple[Optional[float], Optional[float], str, str]:
     params = {
         "q": query,
         "format": "json",
-        "limit": 1,
+        "limit": RESULT_LIMIT,
         "addressdetails": 1,
     }
 
     last_err = None
     for base in NOMINATIM_URLS:
         try:
+            BUDGET.charge("nominatim")
             r = requests.get(base, params=params, headers=HEADERS, timeout=25)
             if r.status_code == 403:
                 last_err = f"403 Forbidden on {base}"
@@ -138,6 +180,12 @@ def nominatim_search(query: str) -> Tuple[Optional[float], Optional[float], str,
             data = r.json()
             if not data:
                 return None, None, "", "nominatim"
+            if seen is not None:
+                for it in data:
+                    ref = f"{it['osm_type']}/{it['osm_id']}" if it.get("osm_type") and it.get("osm_id") else ""
+                    seen.append(
+                        Candidate(float(it["lat"]), float(it["lon"]), it.get("display_name", ""), "nominatim", query, ref)
+                    )
             lat = float(data[0]["lat"])
             lon = float(data[0]["lon"])
             disp = data[0].get("display_name", "")
@@ -152,19 +200,29 @@ def nominatim_search(query: str) -> Tuple[Optional[float], Optional[float], str,
     return None, None, "", "nominatim"
 
 
-def photon_search(query: str) -> Tuple[Optional[float], Optional[float], str, str]:
+def photon_search(query: str, seen: Optional[list] = None) -> Tuple[Optional[float], Optional[float], str, str]:
     params = {
         "q": query,
-        "limit": 1,
+        "limit": RESULT_LIMIT,
         # "lang": "es",  # photon no siempre respeta, pero no hace daño
     }
 
+    BUDGET.charge("photon")
     r = requests.get(PHOTON_URL, params=params, headers=HEADERS, timeout=25)
     r.raise_for_status()
     data = r.json()
     feats = data.get("features") or []
     if not feats:
         return None, None, "", "photon"
+    if seen is not None:
+        for f in feats:
+            c = (f.get("geometry") or {}).get("coordinates") or []
+            p = f.get("properties") or {}
+            if len(c) == 2:
+                disp = f"{p.get('name','')}, {p.get('street','')}, {p.get('city','')}".strip(", ").strip()
+                osm_type = PHOTON_OSM_TYPES.get(p.get("osm_type") or "", "")
+                ref = f"{osm_type}/{p['osm_id']}" if osm_type and p.get("osm_id") else ""
+                seen.append(Candidate(float(c[1]), float(c[0]), disp, "photon", query, ref))
 
     geom = feats[0].get("geometry", {})
     coords = geom.get("coordinates") or []
@@ -207,15 +265,16 @@ def is_plausible_match(venue_name: str, display: str) -> bool:
     return hits >= 2
 
 
-def geocode_with_fallback(venue_name: str, queries: list[str]) -> Dict[str, Any]:
+def geocode_with_fallback(venue_name: str, queries: list[str], seen: Optional[list] = None) -> Dict[str, Any]:
     """
     Prueba nominatim y photon en varias queries.
     Devuelve dict con resultado y status: OK / SUSPECT / MISS
+    `seen` recoge todos los resultados vistos (candidatos para REVIEW).
     """
     for q in queries:
         # 1) Nominatim
         try:
-            lat, lon, disp, svc = nominatim_search(q)
+            lat, lon, disp, svc = nominatim_search(q, seen)
             if lat is not None and lon is not None:
                 plausible = is_plausible_match(venue_name, disp)
                 return {
@@ -232,7 +291,7 @@ def geocode_with_fallback(venue_name: str, queries: list[str]) -> Dict[str, Any]
 
         # 2) Photon
         try:
-            lat, lon, disp, svc = photon_search(q)
+            lat, lon, disp, svc = photon_search(q, seen)
             if lat is not None and lon is not None:
                 plausible = is_plausible_match(venue_name, disp)
                 return {
@@ -258,104 +317,278 @@ def geocode_with_fallback(venue_name: str, queries: list[str]) -> Dict[str, Any]
     }
 
 
+def worst_case_calls(queries: list[str]) -> int:
+    # Cada query: todos los mirrors de Nominatim y después Photon
+    return len(queries) * (len(NOMINATIM_URLS) + 1)
+
+
+def is_ok(row: dict) -> bool:
+    return row["status"] == "OK"
+
+
+def is_review(row: dict) -> bool:
+    return row["status"] != "OK"
+
+
+def is_importable(row: dict) -> bool:
+    return is_ok(row) and has_coords(row)
+
+
+def network_cost(queries: list[str]) -> tuple[dict, dict, float, float]:
+    """(llamadas min, llamadas max, sleep min, sleep max) de una cascada, para --plan-only."""
+    n = len(queries)
+    calls_max = {"nominatim": n * len(NOMINATIM_URLS), "photon": n}
+    # Sleep tras cada query fallida y tras cada venue
+    return {"nominatim": 1}, calls_max, RATE_LIMIT_SECONDS, (n + 1) * RATE_LIMIT_SECONDS
+
+
+def local_result(gazetteer, name: str, city: str) -> Optional[Dict[str, Any]]:
+    g = gazetteer.lookup(name, city) if gazetteer is not None else None
+    if g is None:
+        return None
+    return {
+        "status": "OK" if is_plausible_match(name, g.label) else "SUSPECT",
+        "lat": g.lat,
+        "lon": g.lon,
+        "display": g.label,
+        "service": "osm_local",
+        "query_used": f"OSM:{g.osm_type}/{g.osm_id}",
+    }
+
+
 def main():
-    in_path = Path(INPUT)
+    global BUDGET
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--input", default=INPUT, help="CSV de entrada (p.ej. la cola de revalidate_coords.py)")
+    ap.add_argument("--store", default="", help="SQLite de coordenadas (coord_store.py); salta venues ya asentados")
+    ap.add_argument("--run-id", default="", help="Identificador de la ejecución para la procedencia en --store")
+    ap.add_argument("--refresh", action="store_true", help="Con --store: re-geocodifica también los ya asentados")
+    ap.add_argument("--ttl-days", type=float, default=DEFAULT_TTL_DAYS, help="Con --store: caducidad de un OK guardado")
+    ap.add_argument("--retry-days", type=float, default=DEFAULT_RETRY_DAYS, help="Con --store: reintento de MISS/SUSPECT")
+    ap.add_argument("--gazetteer", default="", help="Export OSM (osm_venues_import.csv) como gazetteer local")
+    ap.add_argument("--osm-index", default="", help="Export OSM para validar hits por cercanía (sin red)")
+    ap.add_argument("--out-jsonl", default="", help="Además, todos los resultados en JSONL")
+    ap.add_argument("--out-sql", default="", help="Además, UPSERTs de lat/lon de los OK en un .sql")
+    ap.add_argument("--sql-table", default="public.venue_enrichment", help="Tabla destino de --out-sql")
+    ap.add_argument("--top-k", type=int, default=TOP_K, help="Candidatos por fila de REVIEW (0 = no los genera)")
+    ap.add_argument("--plan-only", action="store_true", help="Solo estima llamadas y tiempo; no sale a la red")
+    add_priority_args(ap)
+    add_budget_args(ap)
+    args = ap.parse_args()
+
+    BUDGET = budget_from_args(args)
+
+    gazetteer = None
+    if args.gazetteer:
+        from osm_index import OsmGazetteer
+
+        gazetteer = OsmGazetteer.from_csv(args.gazetteer)
+
+    osm_ix = None
+    if args.osm_index:
+        from osm_index import OsmSpatialIndex
+
+        osm_ix = OsmSpatialIndex.from_csv(args.osm_index)
+
+    store = CoordStore(args.store) if args.store else None
+    run_id = args.run_id or time.strftime("premiados:%Y%m%dT%H%M%S")
+
+    in_path = Path(args.input)
     if not in_path.exists():
-        raise FileNotFoundError(f"No encuentro el CSV de entrada en: {INPUT}")
+        raise FileNotFoundError(f"No encuentro el CSV de entrada en: {in_path}")
 
     rows = []
     with open(in_path, newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
+        in_fields = list(reader.fieldnames or [])
         for row in reader:
             rows.append(row)
 
     total = len(rows)
-    out_all = []
-    out_ok = []
-    out_review = []
-
-    for i, row in enumerate(rows, start=1):
-        venue_id = (row.get("venue_id") or "").strip()
-        name = (row.get("name") or "").strip()
-        city = (row.get("city") or "").strip()
-        address = row.get("address_text") or ""
-        maps_url = (row.get("google_maps_url") or "").strip()
-        q_maps = extract_query_from_google_maps_url(maps_url)
-
-        queries = build_queries(name=name, city=city, address=address, q_maps=q_maps)
-        res = geocode_with_fallback(name, queries)
-
-        status = res["status"]
-        lat = res["lat"]
-        lon = res["lon"]
-        disp = res["display"]
-        svc = res["service"]
-        q_used = res["query_used"]
-
-        if status == "OK":
-            print(f"[{i}/{total}] OK   {name} ({city}) -> {lat:.7f}, {lon:.7f} [{svc}]")
-        elif status == "SUSPECT":
-            print(f"[{i}/{total}] SUSPECT {name} ({city}) -> {lat:.7f}, {lon:.7f} [{svc}] | {disp[:60]}")
-        else:
-            print(f"[{i}/{total}] MISS {name} ({city}) -> (sin resultado)")
-
-        row_out = {
-            "venue_id": venue_id,
-            "name": name,
-            "city": city,
-            "status": status,
-            "lat": "" if lat is None else f"{lat:.7f}",
-            "lon": "" if lon is None else f"{lon:.7f}",
-            "service": svc,
-            "query_used": q_used,
-            "display": disp,
-            # staging fields (solo los mínimos para update):
-            "address_text": "",
-            "google_maps_url": "",
-            "hero_image_url": "",
-            "cover_photo_path": "",
-        }
-
-        out_all.append(row_out)
-        if status == "OK":
-            out_ok.append(row_out)
-        else:
-            out_review.append(row_out)
-
-        time.sleep(RATE_LIMIT_SECONDS)
-
-    # CSVs
-    fieldnames = [
-        "venue_id",
-        "name",
-        "city",
-        "status",
-        "lat",
-        "lon",
-        "service",
-        "query_used",
-        "display",
-        "address_text",
-        "google_maps_url",
-        "hero_image_url",
-        "cover_photo_path",
+    remaining = []
+
+    # Todos son premiados; el orden lo deciden destacados, valoraciones o --priority-col
+    queue = VenueQueue(rows, signals_from_args(args))
+
+    if args.plan_only:
+        # Sin red: cascada de cada fila contrastada con --store y el gazetteer
+        plan = QueryPlan()
+        for _, row in queue:
+            plan.rows += 1
+            fp = row_fingerprint(row, QUERY_VERSION)
+            vid = (row.get("venue_id") or "").strip()
+            if store is not None and not args.refresh and store.reusable(vid, fp, args.ttl_days, args.retry_days):
+                plan.from_store += 1
+                continue
+            name = (row.get("name") or "").strip()
+            city = (row.get("city") or "").strip()
+            if local_result(gazetteer, name, city) is not None:
+                plan.from_gazetteer += 1
+                continue
+            q_maps = extract_query_from_google_maps_url((row.get("google_maps_url") or "").strip())
+            tagged = build_queries_tagged(name=name, city=city, address=row.get("address_text") or "", q_maps=q_maps)
+            plan.add_network([why for _, why in tagged], *network_cost([q for q, _ in tagged]))
+        print(plan.report(BUDGET))
+        if store is not None:
+            store.close()
+        return
+
+    # Una sola pasada: cada resultado va a todas las proyecciones (ALL, OK, REVIEW, OK_min...)
+    sinks = [
+        CsvSink(OUT_ALL, FIELDNAMES + OSM_FIELDS),
+        CsvSink(OUT_OK, FIELDNAMES, where=is_ok),
+        CsvSink(OUT_REVIEW, FIELDNAMES + OSM_FIELDS + ["candidates"], where=is_review),
+        CsvSink(OUT_OK_MIN, ["venue_id", "lat", "lon"], where=is_importable),
     ]
-
-    def write_csv(path: str, data: list[dict]):
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=fieldnames)
-            w.writeheader()
-            for r in data:
-                w.writerow(r)
-
-    write_csv(OUT_ALL, out_all)
-    write_csv(OUT_OK, out_ok)
-    write_csv(OUT_REVIEW, out_review)
-
+    if args.out_jsonl:
+        sinks.append(JsonlSink(args.out_jsonl, FIELDNAMES + OSM_FIELDS))
+    if args.out_sql:
+        sinks.append(SqlSink(args.out_sql, args.sql_table, ["venue_id", "lat", "lon"], where=is_importable))
+
+    # Candidatos de SUSPECT/MISS (resultados ya pagados + locales OSM): otro stream, otras columnas
+    cand_sinks = [CsvSink(OUT_CANDIDATES, CANDIDATE_FIELDS)] if args.top_k > 0 else []
+
+    with FanOut(sinks) as out, FanOut(cand_sinks) as cand_out:
+        for i, (prio, row) in enumerate(queue, start=1):
+            venue_id = (row.get("venue_id") or "").strip()
+            name = (row.get("name") or "").strip()
+            city = (row.get("city") or "").strip()
+            address = row.get("address_text") or ""
+            maps_url = (row.get("google_maps_url") or "").strip()
+            q_maps = extract_query_from_google_maps_url(maps_url)
+
+            fp = row_fingerprint(row, QUERY_VERSION)
+            known = None
+            pl = None
+            seen: list[Candidate] = []
+            if store is not None and not args.refresh:
+                known = store.reusable(venue_id, fp, ttl_days=args.ttl_days, retry_days=args.retry_days)
+            if known is not None:
+                res = {
+                    "status": "OK" if known.settled else known.status,
+                    "lat": known.lat,
+                    "lon": known.lon,
+                    "display": known.label,
+                    "service": known.provider,
+                    "query_used": known.query_used,
+                }
+            elif (local := local_result(gazetteer, name, city)) is not None:
+                res = local
+                if osm_ix is not None:
+                    pl = osm_ix.plausibility(name, res["lat"], res["lon"])
+                if store is not None:
+                    store.record(
+                        venue_id,
+                        res["lat"],
+                        res["lon"],
+                        res["status"],
+                        res["service"],
+                        res["query_used"],
+                        res["display"],
+                        run_id,
+                        fingerprint=fp,
+                    )
+            else:
+                queries = build_queries(name=name, city=city, address=address, q_maps=q_maps)
+
+                # Presupuesto: si el peor caso de este venue no cabe, no lo empezamos
+                worst = worst_case_calls(queries)
+                if not BUDGET.can_start(worst, len(queries) * RATE_LIMIT_SECONDS * 2, providers=("nominatim", "photon")):
+                    remaining.append(row)
+                    remaining.extend(queue.drain())
+                    print(f"[{i}/{total}] STOP presupuesto casi agotado ({BUDGET.report()})")
+                    break
+                refused_before = BUDGET.refused
+
+                res = geocode_with_fallback(name, queries, seen)
+                if res["status"] == "MISS" and BUDGET.refused > refused_before:
+                    # Cascada cortada por presupuesto: no es un MISS real, queda para la siguiente ventana
+                    print(f"[{i}/{total}] PEND {name} ({city}) -> sin presupuesto para completar la cascada")
+                    remaining.append(row)
+                    continue
+                if res["lat"] is not None and osm_ix is not None:
+                    pl = osm_ix.plausibility(name, res["lat"], res["lon"])
+                    # El display no contiene el nombre, pero puede haber un local OSM homónimo a pocos metros
+                    if res["status"] == "SUSPECT" and pl.accepted:
+                        res["status"] = "OK"
+                        print(f"[{i}/{total}] ACCEPT {name} ({city}) -> {pl.describe()}")
+                if store is not None:
+                    store.record(
+                        venue_id,
+                        res["lat"],
+                        res["lon"],
+                        res["status"],
+                        res["service"],
+                        res["query_used"],
+                        res["display"],
+                        run_id,
+                        fingerprint=fp,
+                    )
+
+            status = res["status"]
+            lat = res["lat"]
+            lon = res["lon"]
+            disp = res["display"]
+            svc = res["service"]
+            q_used = res["query_used"]
+
+            if known is not None:
+                print(f"[{i}/{total}] SKIP {name} ({city}) -> {status} [{svc}] (store)")
+            elif status == "OK":
+                print(f"[{i}/{total}] OK   {name} ({city}) -> {lat:.7f}, {lon:.7f} [{svc}]")
+            elif status == "SUSPECT":
+                print(f"[{i}/{total}] SUSPECT {name} ({city}) -> {lat:.7f}, {lon:.7f} [{svc}] | {disp[:60]}")
+            else:
+                print(f"[{i}/{total}] MISS {name} ({city}) -> (sin resultado)")
+
+            row_out = {
+                "venue_id": venue_id,
+                "name": name,
+                "city": city,
+                "status": status,
+                "lat": "" if lat is None else f"{lat:.7f}",
+                "lon": "" if lon is None else f"{lon:.7f}",
+                "service": svc,
+                "query_used": q_used,
+                "display": disp,
+                # staging fields (solo los mínimos para update):
+                "address_text": "",
+                "google_maps_url": "",
+                "hero_image_url": "",
+                "cover_photo_path": "",
+                **osm_columns(pl),
+            }
+            if cand_sinks and is_review(row_out):
+                hit = None if lat is None else (lat, lon)
+                ranked = rank_candidates(name, city, seen, hit, gazetteer=gazetteer, osm_ix=osm_ix, k=args.top_k)
+                for r in candidate_rows(venue_id, ranked):
+                    cand_out.write(r)
+                row_out["candidates"] = len(ranked)
+
+            out.write(row_out)
+
+            if known is None and res["service"] != "osm_local":
+                time.sleep(RATE_LIMIT_SECONDS)
+
+    if BUDGET.limited:
+        rem_path = remaining_path(args, in_path)
+        write_remaining(rem_path, in_fields, remaining)
+    if store is not None:
+        store.close()
+
+    notes = {
+        OUT_OK: "(IMPORTA ESTE a venue_enrichment)",
+        OUT_REVIEW: "(para revisión manual o segunda pasada)",
+        OUT_OK_MIN: "(venue_id, lat, lon para el import)",
+        OUT_CANDIDATES: "(alternativas de cada fila de REVIEW; las elegidas, a coord_store import --status MANUAL)",
+    }
     print("\nGenerados:")
-    print(" -", OUT_ALL)
-    print(" -", OUT_OK, "(IMPORTA ESTE a venue_enrichment)")
-    print(" -", OUT_REVIEW, "(para revisión manual o segunda pasada)")
+    for path, kept in out.summary() + cand_out.summary():
+        print(" -", path, f"(rows={kept})", notes.get(str(path), ""))
+    if BUDGET.limited:
+        print(" -", rem_path, f"({len(remaining)} pendientes para la siguiente ventana)")
+        print("\nPresupuesto:", BUDGET.report())
     print("\nSiguiente paso: importa el *_OK.csv en public.venue_enrichment y ejecuta el UPDATE de 02_staging_enrichment.sql")
 
 
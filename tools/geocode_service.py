@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from aiohttp import web
+
+import geocode_by_address as gba
+from coord_store import DEFAULT_RETRY_DAYS, DEFAULT_TTL_DAYS, CoordStore, row_fingerprint
+from geocode_budget import RateLimiter
+
+# Servicio HTTP local con la cascada de geocode_by_address.py, para pedir una
+# sugerencia de coordenadas desde las pantallas de admin (propuestas, sugerencias).
+#
+#   POST /geocode        {"name", "city", "address_text"?, "google_maps_url"?, "venue_id"?}
+#   POST /geocode/batch  {"venues": [ ... ]}
+#   GET  /health
+#
+# Orden de resolución: caché en memoria -> --store (si viene venue_id) -> gazetteer OSM
+# -> red. Peticiones idénticas simultáneas comparten una única cascada, y todos los
+# hilos respetan el mismo ritmo por provider (gba.RATE). Cada venue_id coalescido se
+# guarda en --store con su propio id. Sin --cors-origin no hay cabeceras CORS.
+
+HOT_CACHE_SIZE = 5000
+HOT_CACHE_TTL_S = 6 * 3600
+MAX_BATCH = 100
+ROW_FIELDS = ("venue_id", "name", "city", "address_text", "google_maps_url")
+
+
+class HotCache:
+    """LRU con caducidad, por huella de la fila (nombre/ciudad/dirección/url + versión)."""
+
+    def __init__(self, size: int = HOT_CACHE_SIZE, ttl_s: float = HOT_CACHE_TTL_S):
+        self.size = size
+        self.ttl_s = ttl_s
+        self._d: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        it = self._d.get(key)
+        if it is None:
+            return None
+        expires, value = it
+        if expires < time.monotonic():
+            del self._d[key]
+            return None
+        self._d.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: dict) -> None:
+        self._d[key] = (time.monotonic() + self.ttl_s, value)
+        self._d.move_to_end(key)
+        while len(self._d) > self.size:
+            self._d.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+
+class GeocodeService:
+    def __init__(
+        self,
+        store: Optional[CoordStore] = None,
+        gazetteer=None,
+        osm_ix=None,
+        workers: int = 4,
+        hot: Optional[HotCache] = None,
+        ttl_days: float = DEFAULT_TTL_DAYS,
+        retry_days: float = DEFAULT_RETRY_DAYS,
+    ):
+        self.store = store
+        self.gazetteer = gazetteer
+        self.osm_ix = osm_ix
+        self.hot = hot or HotCache()
+        self.ttl_days = ttl_days
+        self.retry_days = retry_days
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geocode")
+        self.inflight: dict[str, asyncio.Future] = {}
+        self.stats: Counter = Counter()
+        self.run_id = time.strftime("service:%Y%m%dT%H%M%S")
+
+    async def geocode(self, row: dict) -> dict:
+        fp = row_fingerprint(row, gba.QUERY_VERSION)
+        venue_id = row.get("venue_id", "")
+
+        cached = self.hot.get(fp)
+        if cached is not None:
+            self.stats["hot"] += 1
+            return {**cached, "source": "hot"}
+
+        if self.store is not None and venue_id:
+            known = self.store.reusable(venue_id, fp, ttl_days=self.ttl_days, retry_days=self.retry_days)
+            if known is not None:
+                self.stats["store"] += 1
+                out = {
+                    "status": known.status,
+                    "lat": known.lat,
+                    "lon": known.lon,
+                    "provider": known.provider,
+                    "label": known.label,
+                    "query_used": known.query_used,
+                    "reason": "",
+                    "fingerprint": fp,
+                }
+                self.hot.put(fp, out)
+                return {**out, "source": "store"}
+
+        fut = self.inflight.get(fp)
+        if fut is not None:
+            self.stats["coalesced"] += 1
+            out = await asyncio.shield(fut)
+            # El líder lo guarda con su venue_id; cada coalescido, con el suyo
+            self._record(venue_id, out, fp)
+            return {**out, "source": "coalesced"}
+
+        fut = asyncio.get_running_loop().create_future()
+        self.inflight[fp] = fut
+        try:
+            out = await asyncio.get_running_loop().run_in_executor(self.pool, self._resolve, row, fp)
+            fut.set_result(out)
+        except Exception as e:
+            fut.set_exception(e)
+            # Que los coalescidos no dejen el error sin recoger si no había ninguno esperando
+            fut.exception()
+            raise
+        finally:
+            del self.inflight[fp]
+            if not fut.done():
+                # El líder se canceló (CancelledError no es Exception): los coalescidos no
+                # pueden quedarse esperando un resultado que ya no llegará
+                fut.set_exception(RuntimeError(f"Resolución cancelada: {fp}"))
+                fut.exception()
+
+        self.hot.put(fp, out)
+        self._record(venue_id, out, fp)
+        return {**out, "source": "gazetteer" if out["provider"] == "osm_local" else "network"}
+
+    def _record(self, venue_id: str, out: dict, fp: str) -> None:
+        if self.store is None or not venue_id:
+            return
+        self.store.record(
+            venue_id, out["lat"], out["lon"], out["status"], out["provider"], out["query_used"], out["label"],
+            self.run_id, fingerprint=fp,
+        )
+
+    def _resolve(self, row: dict, fp: str) -> dict:
+        # En un hilo del pool: la red la ordena gba.RATE, sin sleep propio
+        name, city = row["name"], row["city"]
+        addr = gba.clean_address(row.get("address_text", ""))
+        local = self.gazetteer.lookup(name, city) if self.gazetteer is not None else None
+        if local is None:
+            self.stats["upstream"] += 1
+        queries = gba.plan_queries(name, city, addr, gba.parse_gmaps_query(row.get("google_maps_url", "")))
+        res = gba.resolve_venue(name, city, queries, 0.0, local=local, osm_ix=self.osm_ix)
+        return {
+            "status": res.status,
+            "lat": res.hit.lat if res.hit is not None else None,
+            "lon": res.hit.lon if res.hit is not None else None,
+            "provider": res.provider,
+            "label": res.label,
+            "query_used": res.query_used,
+            "reason": res.reason,
+            "fingerprint": fp,
+        }
+
+
+def parse_row(data) -> dict:
+    if not isinstance(data, dict):
+        raise web.HTTPBadRequest(text="Se esperaba un objeto JSON")
+    row = {k: str(data.get(k) or "").strip() for k in ROW_FIELDS}
+    if not row["name"]:
+        raise web.HTTPBadRequest(text="Falta name")
+    return row
+
+
+async def _json_body(request: web.Request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="JSON inválido")
+
+
+async def handle_geocode(request: web.Request) -> web.Response:
+    svc: GeocodeService = request.app["service"]
+    row = parse_row(await _json_body(request))
+    return web.json_response(await svc.geocode(row))
+
+
+async def handle_batch(request: web.Request) -> web.Response:
+    svc: GeocodeService = request.app["service"]
+    data = await _json_body(request)
+    items = data.get("venues") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        raise web.HTTPBadRequest(text="Se esperaba {\"venues\": [...]}")
+    if len(items) > request.app["max_batch"]:
+        raise web.HTTPBadRequest(text=f"Máximo {request.app['max_batch']} venues por petición")
+    rows = [parse_row(it) for it in items]
+    results = await asyncio.gather(*(svc.geocode(r) for r in rows), return_exceptions=True)
+    out = []
+    for row, res in zip(rows, results):
+        if isinstance(res, Exception):
+            out.append({"venue_id": row["venue_id"], "status": "ERROR", "reason": f"{type(res).__name__}: {res}"})
+        else:
+            out.append({"venue_id": row["venue_id"], **res})
+    return web.json_response({"results": out})
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    svc: GeocodeService = request.app["service"]
+    return web.json_response(
+        {
+            "ok": True,
+            "hot_cache": len(svc.hot),
+            "inflight": len(svc.inflight),
+            "stats": dict(svc.stats),
+            "budget": gba.BUDGET.report(),
+        }
+    )
+
+
+def cors_middleware(origin: str):
+    """
+    CORS solo para el origen configurado (las pantallas de admin en Expo web): con "*"
+    cualquier web abierta en el navegador podría gastar la cuota de Nominatim/Photon.
+    """
+
+    @web.middleware
+    async def cors(request: web.Request, handler):
+        if request.method == "OPTIONS":
+            resp = web.Response()
+        else:
+            resp = await handler(request)
+        if request.headers.get("Origin") == origin:
+            resp.headers["Access-Control-Allow-Origin"] = origin
+            resp.headers["Access-Control-Allow-Headers"] = "Content-Type"
+            resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        resp.headers["Vary"] = "Origin"
+        return resp
+
+    return cors
+
+
+def make_app(service: GeocodeService, max_batch: int = MAX_BATCH, cors_origin: str = "") -> web.Application:
+    app = web.Application(middlewares=[cors_middleware(cors_origin)] if cors_origin else [])
+    app["service"] = service
+    app["max_batch"] = max_batch
+    app.router.add_post("/geocode", handle_geocode)
+    app.router.add_post("/geocode/batch", handle_batch)
+    app.router.add_get("/health", handle_health)
+
+    async def _close(app: web.Application) -> None:
+        service.pool.shutdown(wait=False, cancel_futures=True)
+        if service.store is not None:
+            service.store.close()
+
+    app.on_cleanup.append(_close)
+    return app
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Servicio HTTP local de geocoding (cascada de geocode_by_address)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8787)
+    ap.add_argument("--store", default="", help="SQLite de coord_store.py (caché persistente por venue_id)")
+    ap.add_argument("--ttl-days", type=float, default=DEFAULT_TTL_DAYS)
+    ap.add_argument("--retry-days", type=float, default=DEFAULT_RETRY_DAYS)
+    ap.add_argument("--gazetteer", default="", help="Export OSM como gazetteer local")
+    ap.add_argument("--osm-index", default="", help="Export OSM para validar hits por cercanía")
+    ap.add_argument("--workers", type=int, default=4, help="Cascadas en paralelo (la red sigue el ritmo por provider)")
+    ap.add_argument("--nominatim-interval", type=float, default=1.0, help="Segundos mínimos entre llamadas a Nominatim")
+    ap.add_argument("--photon-interval", type=float, default=0.0, help="Segundos mínimos entre llamadas a Photon")
+    ap.add_argument("--hot-size", type=int, default=HOT_CACHE_SIZE)
+    ap.add_argument("--hot-ttl-s", type=float, default=HOT_CACHE_TTL_S)
+    ap.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    ap.add_argument(
+        "--cors-origin", default="", help="Origen web con acceso CORS (p.ej. http://localhost:8081); sin él, sin CORS"
+    )
+    args = ap.parse_args()
+
+    gba.RATE = RateLimiter({"nominatim": args.nominatim_interval, "photon": args.photon_interval})
+
+    gazetteer = osm_ix = None
+    if args.gazetteer:
+        from osm_index import OsmGazetteer
+
+        gazetteer = OsmGazetteer.from_csv(args.gazetteer)
+    if args.osm_index:
+        from osm_index import OsmSpatialIndex
+
+        osm_ix = OsmSpatialIndex.from_csv(args.osm_index)
+
+    service = GeocodeService(
+        store=CoordStore(args.store) if args.store else None,
+        gazetteer=gazetteer,
+        osm_ix=osm_ix,
+        workers=args.workers,
+        hot=HotCache(args.hot_size, args.hot_ttl_s),
+        ttl_days=args.ttl_days,
+        retry_days=args.retry_days,
+    )
+    web.run_app(make_app(service, args.max_batch, args.cors_origin), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import psycopg
+
+import geocode_by_address as gba
+from coord_store import DEFAULT_DB, DEFAULT_RETRY_DAYS, DEFAULT_TTL_DAYS, STATUS_OK, CoordStore, row_fingerprint
+
+# Worker de larga duración: geocodifica venues y propuestas sin coordenadas según llegan.
+#
+# Cada ciclo lee de Postgres (Supabase o un Postgres local con las mismas tablas) las
+# filas sin coordenadas, descarta con --store las que ya se intentaron con los mismos
+# datos (la huella cambia si se edita nombre/ciudad/dirección/url) y pasa el resto por
+# la cascada de geocode_by_address.py. Los resultados se escriben en lotes pequeños:
+#   - venues: lat/lon solo si el resultado es OK y la fila sigue sin coordenadas;
+#   - venue_proposals: payload.geocode con el resultado (OK/REVIEW/MISS) para el admin.
+#
+# Con --listen se despierta en cuanto llega un NOTIFY (ver --print-sql para el trigger);
+# sin él, sondea cada --poll-s segundos.
+#
+# Cada tabla se recorre por páginas de --limit con una marca (created_at, id): las filas
+# ya intentadas que siguen sin coordenadas no tapan a las nuevas. Al llegar al final la
+# marca vuelve al principio, y así se recogen ediciones y reintentos caducados.
+#
+# Si se cae la conexión (reinicio de Postgres, corte de red) el worker no muere: cierra,
+# reconecta con espera exponencial (RECONNECT_MIN_S..RECONNECT_MAX_S), vuelve a hacer
+# LISTEN y sigue; el lote sin escribir se conserva para el siguiente flush.
+
+CHANNEL = "venue_geocode"
+
+SOURCES = {
+    "venues": """
+        SELECT id::text, name, city, address_text, google_maps_url, NULL, created_at
+        FROM venues
+        WHERE (lat IS NULL OR lon IS NULL) AND (created_at, id) > (%s, %s::uuid)
+        ORDER BY created_at, id
+        LIMIT %s
+    """,
+    "venue_proposals": """
+        SELECT id::text, name, city, address_text, google_maps_url, payload->'geocode'->>'fingerprint', created_at
+        FROM venue_proposals
+        WHERE status = 'pending' AND (created_at, id) > (%s, %s::uuid)
+        ORDER BY created_at, id
+        LIMIT %s
+    """,
+}
+
+# Marca inicial de cada barrido completo: antes de cualquier fila
+SCAN_START = ("-infinity", "00000000-0000-0000-0000-000000000000")
+
+# Espera entre intentos de reconexión: se dobla en cada fallo hasta el máximo
+RECONNECT_MIN_S = 1.0
+RECONNECT_MAX_S = 300.0
+
+UPDATE_VENUE = "UPDATE venues SET lat = %s, lon = %s WHERE id = %s::uuid AND (lat IS NULL OR lon IS NULL)"
+UPDATE_PROPOSAL = """
+    UPDATE venue_proposals
+    SET payload = COALESCE(payload, '{}'::jsonb) || jsonb_build_object('geocode', %s::jsonb)
+    WHERE id = %s::uuid
+"""
+
+TRIGGER_SQL = f"""
+-- Avisa al worker cuando entra o se edita algo geocodificable
+create or replace function notify_venue_geocode() returns trigger language plpgsql as $$
+begin
+  perform pg_notify('{CHANNEL}', TG_TABLE_NAME || ':' || NEW.id::text);
+  return NEW;
+end $$;
+
+drop trigger if exists trg_venues_geocode on venues;
+create trigger trg_venues_geocode
+  after insert or update of name, city, address_text, google_maps_url on venues
+  for each row when (NEW.lat is null or NEW.lon is null)
+  execute function notify_venue_geocode();
+
+drop trigger if exists trg_venue_proposals_geocode on venue_proposals;
+create trigger trg_venue_proposals_geocode
+  after insert or update of name, city, address_text, google_maps_url on venue_proposals
+  for each row when (NEW.status = 'pending')
+  execute function notify_venue_geocode();
+"""
+
+
+@dataclass
+class Pending:
+    table: str
+    row_id: str
+    store_id: str
+    fingerprint: str
+    lat: Optional[float]
+    lon: Optional[float]
+    status: str
+    provider: str = ""
+    query_used: str = ""
+    label: str = ""
+    reason: str = ""
+
+
+class GeocodeWorker:
+    def __init__(self, conn, store: CoordStore, args: argparse.Namespace, gazetteer=None, osm_ix=None):
+        self.conn = conn
+        self.store = store
+        self.args = args
+        self.gazetteer = gazetteer
+        self.osm_ix = osm_ix
+        self.run_id = args.run_id or time.strftime("worker:%Y%m%dT%H%M%S")
+        self.batch: list[Pending] = []
+        self.last_flush = time.monotonic()
+        self.written = 0
+        # Marca (created_at, id) de la última fila leída por tabla
+        self.after = {t: SCAN_START for t in args.tables}
+
+    @property
+    def scan_complete(self) -> bool:
+        """Todas las tablas han llegado al final de su recorrido en el último barrido."""
+        return all(a == SCAN_START for a in self.after.values())
+
+    def _candidates(self) -> list[tuple[str, dict, Optional[str]]]:
+        out = []
+        with self.conn.cursor() as cur:
+            for table in self.args.tables:
+                cur.execute(SOURCES[table], (*self.after[table], self.args.limit))
+                rows = cur.fetchall()
+                # Página incompleta = fin de la tabla: el siguiente barrido empieza de nuevo
+                self.after[table] = (rows[-1][6], rows[-1][0]) if len(rows) >= self.args.limit else SCAN_START
+                for vid, name, city, addr, gmaps, done_fp, _ in rows:
+                    row = {
+                        "venue_id": vid,
+                        "name": name or "",
+                        "city": city or "",
+                        "address_text": addr or "",
+                        "google_maps_url": gmaps or "",
+                    }
+                    out.append((table, row, done_fp))
+        self.conn.rollback()  # solo lectura: no dejamos la transacción abierta mientras geocodificamos
+        return out
+
+    def cycle(self) -> int:
+        """Un barrido. Devuelve cuántas filas han salido a la red."""
+        geocoded = 0
+        for table, row, done_fp in self._candidates():
+            # Las propuestas comparten espacio de ids con venues en --store: prefijo
+            store_id = row["venue_id"] if table == "venues" else f"proposal:{row['venue_id']}"
+            fp = row_fingerprint(row, gba.QUERY_VERSION)
+            if done_fp == fp:
+                continue
+
+            known = self.store.reusable(store_id, fp, ttl_days=self.args.ttl_days, retry_days=self.args.retry_days)
+            if known is not None:
+                # Ya intentado con estos datos: no hay red, como mucho falta escribirlo
+                p = Pending(
+                    table, row["venue_id"], store_id, fp, known.lat, known.lon, known.status,
+                    known.provider, known.query_used, known.label,
+                )
+                if table == "venue_proposals" or known.settled:
+                    self.batch.append(p)
+                continue
+
+            p = self._geocode(table, row, store_id, fp)
+            geocoded += 1
+            # En venues solo escribimos coordenadas buenas; REVIEW/MISS se quedan en --store
+            if table == "venue_proposals" or p.status == STATUS_OK:
+                self.batch.append(p)
+            self.maybe_flush()
+        self.flush()
+        return geocoded
+
+    def _geocode(self, table: str, row: dict, store_id: str, fp: str) -> Pending:
+        name, city = row["name"].strip(), row["city"].strip()
+        addr = gba.clean_address(row["address_text"])
+        local = self.gazetteer.lookup(name, city) if self.gazetteer is not None else None
+        queries = gba.plan_queries(name, city, addr, gba.parse_gmaps_query(row["google_maps_url"]))
+        res = gba.resolve_venue(name, city, queries, self.args.sleep, local=local, osm_ix=self.osm_ix)
+
+        lat = res.hit.lat if res.hit is not None else None
+        lon = res.hit.lon if res.hit is not None else None
+        self.store.record(
+            store_id, lat, lon, res.status, res.provider, res.query_used, res.label, self.run_id, fingerprint=fp
+        )
+        tag = res.status if not res.reason else f"{res.status} ({res.reason})"
+        where = f"{lat:.6f},{lon:.6f} [{res.provider}]" if res.hit is not None else "sin resultado"
+        print(f"[{table}] {tag:<8} {name} ({city}) -> {where}")
+        return Pending(table, row["venue_id"], store_id, fp, lat, lon, res.status, res.provider, res.query_used, res.label, res.reason)
+
+    def maybe_flush(self) -> None:
+        if len(self.batch) >= self.args.batch_size or time.monotonic() - self.last_flush >= self.args.flush_s:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Escribe el lote en una transacción. Si falla la fila, se reintenta en el siguiente
+        ciclo (--store ya lo tiene); si falla la conexión, el lote se conserva y el error
+        sube para que main() reconecte.
+        """
+        self.last_flush = time.monotonic()
+        if not self.batch:
+            return
+        venues = [(p.lat, p.lon, p.row_id) for p in self.batch if p.table == "venues"]
+        proposals = [
+            (
+                json.dumps(
+                    {
+                        "status": p.status,
+                        "lat": p.lat,
+                        "lon": p.lon,
+                        "provider": p.provider,
+                        "query_used": p.query_used,
+                        "label": p.label,
+                        "reason": p.reason,
+                        "fingerprint": p.fingerprint,
+                        "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    },
+                    ensure_ascii=False,
+                ),
+                p.row_id,
+            )
+            for p in self.batch
+            if p.table == "venue_proposals"
+        ]
+        batch, self.batch = self.batch, []
+        try:
+            with self.conn.transaction():
+                with self.conn.cursor() as cur:
+                    if venues:
+                        cur.executemany(UPDATE_VENUE, venues)
+                    if proposals:
+                        cur.executemany(UPDATE_PROPOSAL, proposals)
+        except psycopg.Error as e:
+            if isinstance(e, psycopg.OperationalError) or self.conn.broken:
+                self.batch = batch + self.batch
+                raise
+            print(f"[flush] ERROR {len(batch)} filas sin escribir: {e}")
+            return
+        print(f"[flush] venues={len(venues)} proposals={len(proposals)}")
+        self.written += len(batch)
+
+
+def connect(dsn: str, listen: bool):
+    """(conexión de trabajo, conexión en autocommit con LISTEN o None)."""
+    conn = psycopg.connect(dsn)
+    listen_conn = None
+    if listen:
+        try:
+            listen_conn = psycopg.connect(dsn, autocommit=True)
+            listen_conn.execute(f"LISTEN {CHANNEL}")
+        except psycopg.Error:
+            conn.close()
+            raise
+    return conn, listen_conn
+
+
+def reconnect(dsn: str, listen: bool, delay_s: float):
+    """Reintenta connect() hasta que funcione, doblando la espera entre intentos."""
+    while True:
+        print(f"[db] reconectando en {delay_s:g}s")
+        time.sleep(delay_s)
+        try:
+            return connect(dsn, listen)
+        except psycopg.Error as e:
+            print(f"[db] {type(e).__name__}: {e}")
+            delay_s = min(delay_s * 2, RECONNECT_MAX_S)
+
+
+def close_quietly(*conns) -> None:
+    for c in conns:
+        if c is None:
+            continue
+        try:
+            c.close()
+        except psycopg.Error:
+            pass
+
+
+def wait_for_work(listen_conn, timeout_s: float) -> None:
+    if listen_conn is None:
+        time.sleep(timeout_s)
+        return
+    # Se despierta con el primer NOTIFY; el barrido siguiente ya recoge todo lo pendiente
+    for _ in listen_conn.notifies(timeout=timeout_s, stop_after=1):
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Worker que geocodifica venues y propuestas nuevas sin coordenadas")
+    ap.add_argument("--dsn", default=os.environ.get("DATABASE_URL", ""), help="Conexión Postgres (o DATABASE_URL)")
+    ap.add_argument("--tables", nargs="+", default=list(SOURCES), choices=list(SOURCES))
+    ap.add_argument("--store", default=str(DEFAULT_DB), help="SQLite de coord_store.py (procedencia y reintentos)")
+    ap.add_argument("--run-id", default="")
+    ap.add_argument("--ttl-days", type=float, default=DEFAULT_TTL_DAYS)
+    ap.add_argument("--retry-days", type=float, default=DEFAULT_RETRY_DAYS)
+    ap.add_argument("--sleep", type=float, default=1.1, help="Sleep entre calls a Nominatim (>=1 recomendable)")
+    ap.add_argument("--gazetteer", default="", help="Export OSM como gazetteer local")
+    ap.add_argument("--osm-index", default="", help="Export OSM para validar hits por cercanía")
+    ap.add_argument("--limit", type=int, default=200, help="Filas por tabla y barrido")
+    ap.add_argument("--batch-size", type=int, default=10, help="Resultados por transacción de escritura")
+    ap.add_argument("--flush-s", type=float, default=5.0, help="Tiempo máximo con resultados sin escribir")
+    ap.add_argument("--poll-s", type=float, default=30.0, help="Espera entre barridos (máximo, con --listen)")
+    ap.add_argument("--listen", action="store_true", help=f"LISTEN {CHANNEL}: barrido inmediato al recibir NOTIFY")
+    ap.add_argument("--once", action="store_true", help="Un solo barrido y salir")
+    ap.add_argument("--print-sql", action="store_true", help="Imprime el trigger de NOTIFY y sale")
+    args = ap.parse_args()
+
+    if args.print_sql:
+        print(TRIGGER_SQL)
+        return
+    if not args.dsn:
+        ap.error("Falta --dsn (o DATABASE_URL)")
+
+    gazetteer = osm_ix = None
+    if args.gazetteer:
+        from osm_index import OsmGazetteer
+
+        gazetteer = OsmGazetteer.from_csv(args.gazetteer)
+    if args.osm_index:
+        from osm_index import OsmSpatialIndex
+
+        osm_ix = OsmSpatialIndex.from_csv(args.osm_index)
+
+    store = CoordStore(args.store)
+    conn, listen_conn = connect(args.dsn, args.listen)
+
+    worker = GeocodeWorker(conn, store, args, gazetteer=gazetteer, osm_ix=osm_ix)
+    print(f"Worker {worker.run_id} tablas={','.join(args.tables)} listen={args.listen}")
+    delay_s = RECONNECT_MIN_S
+    try:
+        while True:
+            try:
+                n = worker.cycle()
+                delay_s = RECONNECT_MIN_S
+                if args.once and worker.scan_complete:
+                    break
+                # Sin trabajo y con el recorrido completo: a esperar; si quedan páginas, seguimos
+                if n == 0 and worker.scan_complete:
+                    wait_for_work(listen_conn, args.poll_s)
+            except psycopg.Error as e:
+                # Conexión caída o sesión rota: las dos conexiones fuera y vuelta a empezar
+                print(f"[db] {type(e).__name__}: {e}")
+                close_quietly(conn, listen_conn)
+                conn, listen_conn = reconnect(args.dsn, args.listen, delay_s)
+                worker.conn = conn
+                delay_s = min(delay_s * 2, RECONNECT_MAX_S)
+    except KeyboardInterrupt:
+        print("\nParando...")
+        try:
+            worker.flush()
+        except psycopg.Error as e:
+            print(f"[flush] ERROR {len(worker.batch)} filas sin escribir: {e}")
+    finally:
+        print(f"Escritos: {worker.written} | STORE: {store.stats()}")
+        store.close()
+        close_quietly(conn, listen_conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import csv
 from pathlib import Path
 
+from sinks import CsvSink, FanOut, has_coords
+
+# geocode_premiados.py ya genera el *_OK_min.csv en la misma pasada; esto queda
+# como regeneración manual a partir de un *_OK.csv (fuera del pipeline).
 SRC = Path(__file__).parent / "venue_enrichment_premiados_coords_OK.csv"
 DST = Path(__file__).parent / "venue_enrichment_premiados_coords_OK_min.csv"
 
@@ -8,21 +12,13 @@ def main():
     if not SRC.exists():
         raise FileNotFoundError(f"No existe: {SRC}")
 
-    with SRC.open(newline="", encoding="utf-8") as f, DST.open("w", newline="", encoding="utf-8") as g:
+    sink = CsvSink(DST, ["venue_id", "lat", "lon"], where=has_coords)
+    with SRC.open(newline="", encoding="utf-8-sig") as f, FanOut([sink]) as out:
         r = csv.DictReader(f)
-        w = csv.DictWriter(g, fieldnames=["venue_id", "lat", "lon"])
-        w.writeheader()
-
-        kept = 0
         for row in r:
-            venue_id = (row.get("venue_id") or "").strip()
-            lat = (row.get("lat") or "").strip()
-            lon = (row.get("lon") or "").strip()
-            if venue_id and lat and lon:
-                w.writerow({"venue_id": venue_id, "lat": lat, "lon": lon})
-                kept += 1
+            out.write({k: (row.get(k) or "").strip() for k in ("venue_id", "lat", "lon")})
 
-    print(f"Generado: {DST} (rows={kept})")
+    print(f"Generado: {DST} (rows={sink.kept})")
 
 if __name__ == "__main__":
     main()
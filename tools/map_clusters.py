@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import math
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from coord_store import CoordStore
+from coords_qa import DEFAULT_INPUTS
+from venue_priority import PrioritySignals, add_priority_args, signals_from_args
+
+# Clusters de marcadores precalculados por zoom, en teselas z/x/y estáticas.
+#
+# Para cada zoom (de --max-zoom a --min-zoom) los clusters se forman agrupando los
+# del zoom siguiente en una rejilla de --radius píxeles: cada nivel sale del anterior,
+# así que un cluster de z siempre es la unión exacta de clusters de z+1. Cada cluster
+# lleva recuento, centroide ponderado y los --reps venues más relevantes (prioridad
+# de venue_priority.py). El mapa solo baja las teselas visibles de su zoom:
+#
+#   <out>/index.json
+#   <out>/<z>/<x>/<y>.json   {"z","x","y","clusters":[{"lat","lon","count","ids"[, "name"]}]}
+
+BASE_DIR = Path(__file__).resolve().parent
+OUT_DIR = BASE_DIR / "map_tiles"
+
+TILE_PX = 256
+MIN_ZOOM = 5
+MAX_ZOOM = 16
+CLUSTER_RADIUS_PX = 60
+REPS = 3
+# Web Mercator no llega a los polos
+MAX_LAT = 85.05112878
+
+FORMAT_VERSION = 1
+
+
+@dataclass
+class Points:
+    ids: list[str]
+    names: list[str]
+    lat: np.ndarray
+    lon: np.ndarray
+    score: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+@dataclass
+class Level:
+    """Clusters de un zoom. x/y en píxeles de mundo a --max-zoom; reps = índices de Points (-1 = vacío)."""
+
+    zoom: int
+    x: np.ndarray
+    y: np.ndarray
+    count: np.ndarray
+    reps: np.ndarray  # (n, REPS) int64
+
+
+def load_points(paths: list[Path], store_path: str, signals: PrioritySignals) -> Points:
+    """venue_id -> último punto visto (las entradas posteriores mandan; --store va al final)."""
+    by_id: dict[str, tuple[float, float, str, float]] = {}
+    for p in paths:
+        with p.open("r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                vid = (row.get("venue_id") or "").strip()
+                if not vid and row.get("osm_id"):
+                    # Export OSM (prep_overpass_csv.py): locales aún sin venue en la app
+                    vid = f"osm:{row.get('osm_type') or 'node'}/{row['osm_id'].strip()}"
+                try:
+                    lat = float(row.get("lat") or "")
+                    lon = float(row.get("lon") or "")
+                except ValueError:
+                    continue
+                if vid:
+                    by_id[vid] = (lat, lon, (row.get("name") or "").strip(), signals.score(row))
+    if store_path:
+        with CoordStore(store_path) as store:
+            for b in store.iter_best():
+                if b.settled:
+                    old = by_id.get(b.venue_id)
+                    name = old[2] if old else ""
+                    by_id[b.venue_id] = (b.lat, b.lon, name, signals.score({"venue_id": b.venue_id}))
+
+    ids = list(by_id)
+    vals = list(by_id.values())
+    lat = np.array([v[0] for v in vals], dtype=np.float64)
+    lon = np.array([v[1] for v in vals], dtype=np.float64)
+    ok = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= MAX_LAT) & (np.abs(lon) <= 180)
+    keep = np.flatnonzero(ok)
+    return Points(
+        ids=[ids[i] for i in keep],
+        names=[vals[i][2] for i in keep],
+        lat=lat[keep],
+        lon=lon[keep],
+        score=np.array([vals[i][3] for i in keep], dtype=np.float64),
+    )
+
+
+def project(lat: np.ndarray, lon: np.ndarray, zoom: int) -> tuple[np.ndarray, np.ndarray]:
+    """Web Mercator -> píxeles de mundo (TILE_PX * 2^zoom de lado)."""
+    world = TILE_PX * (1 << zoom)
+    x = (lon + 180.0) / 360.0 * world
+    s = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + s) / (1 - s)) / (4 * math.pi)) * world
+    return x, y
+
+
+def unproject(x: np.ndarray, y: np.ndarray, zoom: int) -> tuple[np.ndarray, np.ndarray]:
+    world = TILE_PX * (1 << zoom)
+    lon = x / world * 360.0 - 180.0
+    n = math.pi - 2 * math.pi * y / world
+    lat = np.degrees(np.arctan(np.sinh(n)))
+    return lat, lon
+
+
+def top_reps(group: np.ndarray, cand: np.ndarray, score: np.ndarray, n_groups: int, k: int) -> np.ndarray:
+    """
+    Los k candidatos de mayor score por grupo. group/cand paralelos (cand -1 = hueco).
+    Orden estable por índice de punto a igual score: mismo input -> mismas teselas.
+    """
+    valid = cand >= 0
+    group, cand = group[valid], cand[valid]
+    order = np.lexsort((cand, -score[cand], group))
+    group, cand = group[order], cand[order]
+    starts = np.searchsorted(group, np.arange(n_groups))
+    rank = np.arange(len(group)) - starts[group]
+    out = np.full((n_groups, k), -1, dtype=np.int64)
+    sel = rank < k
+    out[group[sel], rank[sel]] = cand[sel]
+    return out
+
+
+def merge_level(prev: Level, zoom: int, max_zoom: int, radius_px: float, score: np.ndarray) -> Level:
+    # Tamaño de celda de la rejilla de este zoom, en píxeles de --max-zoom
+    cell = radius_px * (1 << (max_zoom - zoom))
+    cx = np.floor(prev.x / cell).astype(np.int64)
+    cy = np.floor(prev.y / cell).astype(np.int64)
+    key = cx * (1 << 32) + cy
+    uniq, inv = np.unique(key, return_inverse=True)
+    n = len(uniq)
+    count = np.bincount(inv, weights=prev.count, minlength=n)
+    x = np.bincount(inv, weights=prev.x * prev.count, minlength=n) / count
+    y = np.bincount(inv, weights=prev.y * prev.count, minlength=n) / count
+    k = prev.reps.shape[1]
+    reps = top_reps(np.repeat(inv, k), prev.reps.ravel(), score, n, k)
+    return Level(zoom, x, y, count.astype(np.int64), reps)
+
+
+def build_levels(pts: Points, min_zoom: int, max_zoom: int, radius_px: float, reps: int) -> list[Level]:
+    x, y = project(pts.lat, pts.lon, max_zoom)
+    leaf_reps = np.full((len(pts), reps), -1, dtype=np.int64)
+    leaf_reps[:, 0] = np.arange(len(pts))
+    level = Level(max_zoom + 1, x, y, np.ones(len(pts), dtype=np.int64), leaf_reps)
+    levels = []
+    for z in range(max_zoom, min_zoom - 1, -1):
+        level = merge_level(level, z, max_zoom, radius_px, pts.score)
+        levels.append(level)
+    return levels
+
+
+def write_tiles(levels: list[Level], pts: Points, out_dir: Path, max_zoom: int, radius_px: float) -> dict:
+    """Escribe en <out>.tmp y sustituye <out> al final: el cliente nunca ve medio árbol."""
+    tmp = out_dir.with_name(out_dir.name + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    zooms = {}
+    for lv in levels:
+        scale = 1 << (max_zoom - lv.zoom)
+        tx = np.floor(lv.x / scale / TILE_PX).astype(np.int64)
+        ty = np.floor(lv.y / scale / TILE_PX).astype(np.int64)
+        lat, lon = unproject(lv.x, lv.y, max_zoom)
+        order = np.lexsort((ty, tx))
+        key = tx[order] * (1 << 32) + ty[order]
+        bounds = np.flatnonzero(np.diff(key)) + 1
+        n_tiles = 0
+        for chunk in np.split(order, bounds):
+            if not len(chunk):
+                continue
+            x0, y0 = int(tx[chunk[0]]), int(ty[chunk[0]])
+            clusters = []
+            for i in chunk:
+                ids = [pts.ids[j] for j in lv.reps[i] if j >= 0]
+                c = {"lat": round(float(lat[i]), 6), "lon": round(float(lon[i]), 6), "count": int(lv.count[i]), "ids": ids}
+                if lv.count[i] == 1 and pts.names[lv.reps[i][0]]:
+                    c["name"] = pts.names[lv.reps[i][0]]
+                clusters.append(c)
+            p = tmp / str(lv.zoom) / str(x0) / f"{y0}.json"
+            p.parent.mkdir(parents=True, exist_ok=True)
+            p.write_text(
+                json.dumps({"z": lv.zoom, "x": x0, "y": y0, "clusters": clusters}, ensure_ascii=False, separators=(",", ":")),
+                encoding="utf-8",
+            )
+            n_tiles += 1
+        zooms[lv.zoom] = {"clusters": int(len(lv.count)), "tiles": n_tiles}
+
+    index = {
+        "version": FORMAT_VERSION,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "venues": len(pts),
+        "tile_px": TILE_PX,
+        "radius_px": radius_px,
+        "min_zoom": min(zooms) if zooms else None,
+        "max_zoom": max(zooms) if zooms else None,
+        "bounds": [float(pts.lon.min()), float(pts.lat.min()), float(pts.lon.max()), float(pts.lat.max())] if len(pts) else None,
+        "zooms": {str(z): v for z, v in sorted(zooms.items())},
+    }
+    (tmp / "index.json").write_text(json.dumps(index, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    old = out_dir.with_name(out_dir.name + ".old")
+    if out_dir.exists():
+        os.replace(out_dir, old)
+    os.replace(tmp, out_dir)
+    if old.exists():
+        shutil.rmtree(old)
+    return index
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Precalcula clusters de marcadores por zoom en teselas z/x/y")
+    ap.add_argument("inputs", nargs="*", help="CSVs con venue_id (u osm_id), lat, lon y name si lo hay")
+    ap.add_argument("--store", default="", help="SQLite de coord_store.py (mejor coordenada asentada)")
+    ap.add_argument("--out", default=str(OUT_DIR))
+    ap.add_argument("--min-zoom", type=int, default=MIN_ZOOM)
+    ap.add_argument("--max-zoom", type=int, default=MAX_ZOOM)
+    ap.add_argument("--radius", type=float, default=CLUSTER_RADIUS_PX, help="Radio de agrupación en píxeles de pantalla")
+    ap.add_argument("--reps", type=int, default=REPS, help="Venues representativos por cluster")
+    add_priority_args(ap)
+    args = ap.parse_args()
+
+    paths = [Path(p) for p in args.inputs] or [BASE_DIR / p for p in DEFAULT_INPUTS]
+    t0 = time.perf_counter()
+    pts = load_points(paths, args.store, signals_from_args(args))
+    t1 = time.perf_counter()
+    levels = build_levels(pts, args.min_zoom, args.max_zoom, args.radius, args.reps)
+    t2 = time.perf_counter()
+    index = write_tiles(levels, pts, Path(args.out), args.max_zoom, args.radius)
+    t3 = time.perf_counter()
+
+    print(f"Venues: {len(pts)} (carga {t1 - t0:.2f}s, clusters {t2 - t1:.3f}s, teselas {t3 - t2:.2f}s)")
+    for z, v in index["zooms"].items():
+        print(f"  z{z}: {v['clusters']} clusters en {v['tiles']} teselas")
+    print(f"Generado: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import csv
+import math
+import re
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional
+
+from textnorm import norm, split_city_parts, split_street_number
+
+BASE_DIR = Path(__file__).resolve().parent
+OSM_IMPORT = BASE_DIR / "osm_venues_import.csv"
+
+# Amenities que cuentan como "local de comida/bebida" para validar un hit
+FOOD_AMENITIES = {"restaurant", "cafe", "bar", "pub", "fast_food", "ice_cream", "food_court", "biergarten"}
+
+# Palabras que no ayudan a comparar nombres (mismo criterio que is_plausible_match)
+NAME_STOPWORDS = {
+    "bar", "restaurante", "restaurant", "cafeteria", "cafe", "grupo",
+    "el", "la", "los", "las", "de", "del", "i", "y", "l", "d", "s",
+}
+
+# Tipos de vía y partículas que varían entre fuentes ("C/ Quart" vs "Carrer de Quart")
+STREET_STOPWORDS = {
+    "c", "calle", "carrer", "cl", "av", "avda", "avenida", "avinguda", "pl", "pza", "plaza", "placa",
+    "pg", "paseo", "passeig", "cm", "cami", "camino", "ctra", "carretera", "ronda", "travesia",
+    "de", "del", "la", "el", "les", "los", "las", "l", "d", "dels",
+}
+
+# Validación espacial: radio de búsqueda y distancia a partir de la cual el score decae
+NEAR_RADIUS_M = 80.0
+NEAR_FULL_M = 30.0
+ACCEPT_SCORE = 0.75
+
+EARTH_R_M = 6371008.8
+
+
+@dataclass
+class OsmVenue:
+    osm_type: str
+    osm_id: str
+    name: str
+    amenity: str
+    addr_city: str
+    addr_street: str
+    addr_housenumber: str
+    addr_postcode: str
+    website: str
+    phone: str
+    lat: float
+    lon: float
+
+    @property
+    def label(self) -> str:
+        street = " ".join(p for p in (self.addr_street, self.addr_housenumber) if p)
+        return ", ".join(p for p in (self.name, street, self.addr_postcode, self.addr_city) if p)
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_R_M * math.asin(math.sqrt(a))
+
+
+def name_tokens(name: str) -> list[str]:
+    return [t for t in re.split(r"[^a-z0-9ñ]+", norm(name)) if t and t not in NAME_STOPWORDS]
+
+
+def name_similarity(a: str, b: str) -> float:
+    """
+    0..1. Solapamiento de tokens "raros" (sin bar/restaurante/el/la...) y, como
+    respaldo para typos o nombres pegados, ratio de difflib sobre los tokens unidos.
+
+    Que un nombre contenga al otro solo puntúa 1.0 si comparten al menos dos tokens
+    ("Casa Pepe" / "Casa Pepe Russafa"); con uno solo es Jaccard, que si no "Bar Central"
+    y "Cafetería Central Park" o "La Pepica" y "Pepica Beach Club" serían el mismo local.
+    """
+    ta, tb = name_tokens(a), name_tokens(b)
+    if not ta or not tb:
+        return 0.0
+    sa, sb = set(ta), set(tb)
+    shared = len(sa & sb)
+    overlap = shared / min(len(sa), len(sb)) if shared >= 2 else shared / len(sa | sb)
+    ratio = SequenceMatcher(None, " ".join(ta), " ".join(tb)).ratio()
+    return max(overlap, ratio)
+
+
+def load_osm_venues(path: Path | str = OSM_IMPORT) -> list[OsmVenue]:
+    """Lee la salida de prep_overpass_csv.py; ignora filas sin lat/lon válidos."""
+    if Path(path).suffix.lower() != ".csv":
+        # numpy/pyarrow solo para los exports columnar (ver osm_table.py)
+        from osm_table import COLUMNAR_SUFFIXES, OsmTable
+
+        if Path(path).suffix.lower() in COLUMNAR_SUFFIXES:
+            return list(OsmTable.read(path).iter_venues())
+    out: list[OsmVenue] = []
+    with Path(path).open("r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                lat = float(row.get("lat") or "")
+                lon = float(row.get("lon") or "")
+            except ValueError:
+                continue
+            out.append(
+                OsmVenue(
+                    osm_type=(row.get("osm_type") or "").strip(),
+                    osm_id=(row.get("osm_id") or "").strip(),
+                    name=(row.get("name") or "").strip(),
+                    amenity=(row.get("amenity") or "").strip(),
+                    addr_city=(row.get("addr_city") or "").strip(),
+                    addr_street=(row.get("addr_street") or "").strip(),
+                    addr_housenumber=(row.get("addr_housenumber") or "").strip(),
+                    addr_postcode=(row.get("addr_postcode") or "").strip(),
+                    website=(row.get("website") or "").strip(),
+                    phone=(row.get("phone") or "").strip(),
+                    lat=lat,
+                    lon=lon,
+                )
+            )
+    return out
+
+
+@lru_cache(maxsize=4)
+def load_osm_venues_cached(path: str) -> tuple[OsmVenue, ...]:
+    # Gazetteer e índice espacial suelen apuntar al mismo fichero: se lee una vez
+    return tuple(load_osm_venues(path))
+
+
+class OsmGazetteer:
+    """
+    Gazetteer local sobre el export de OSM: nombre normalizado -> venues.
+    Solo devuelve un resultado si es inequívoco: un único candidato con ese nombre
+    cuyo addr_city encaja con la ciudad. Así no inventamos coordenadas (la mayoría
+    de filas OSM no traen addr_city; esas siguen yendo a la red).
+    """
+
+    def __init__(self, venues: list[OsmVenue]):
+        self.venues = venues
+        self.by_name: dict[str, list[OsmVenue]] = {}
+        for v in venues:
+            k = norm(v.name)
+            if k:
+                self.by_name.setdefault(k, []).append(v)
+
+    @classmethod
+    def from_csv(cls, path: Path | str = OSM_IMPORT) -> "OsmGazetteer":
+        return cls(list(load_osm_venues_cached(str(path))))
+
+    def lookup(self, name: str, city: str) -> Optional[OsmVenue]:
+        cands = self.by_name.get(norm(name)) or []
+        if not cands:
+            return None
+        parts = {norm(p) for p in split_city_parts(city)}
+        same_city = [v for v in cands if v.addr_city and norm(v.addr_city) in parts]
+        if len(same_city) == 1:
+            return same_city[0]
+        return None
+
+
+@dataclass
+class Plausibility:
+    score: float
+    match: Optional[OsmVenue] = None
+    dist_m: Optional[float] = None
+
+    @property
+    def accepted(self) -> bool:
+        return self.score >= ACCEPT_SCORE
+
+    def describe(self) -> str:
+        if self.match is None:
+            return f"osm {self.score:.2f}"
+        return f"osm {self.score:.2f} '{self.match.name}' @ {self.dist_m:.0f}m"
+
+
+class OsmSpatialIndex:
+    """
+    Rejilla lat/lon en memoria sobre el export OSM (celdas de ~100 m).
+    Un hit del geocoder es plausible si hay un local de comida con nombre
+    parecido a pocas decenas de metros: sin llamadas extra a la red.
+    """
+
+    CELL_DEG = 0.001
+
+    def __init__(self, venues: list[OsmVenue], food_only: bool = True):
+        self.cells: dict[tuple[int, int], list[OsmVenue]] = {}
+        for v in venues:
+            if food_only and v.amenity not in FOOD_AMENITIES:
+                continue
+            self.cells.setdefault(self._cell(v.lat, v.lon), []).append(v)
+
+    @classmethod
+    def from_csv(cls, path: Path | str = OSM_IMPORT) -> "OsmSpatialIndex":
+        return cls(list(load_osm_venues_cached(str(path))))
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return (math.floor(lat / self.CELL_DEG), math.floor(lon / self.CELL_DEG))
+
+    def nearby(self, lat: float, lon: float, radius_m: float = NEAR_RADIUS_M) -> Iterator[tuple[OsmVenue, float]]:
+        # 1 grado de latitud ~ 111 km; en longitud se encoge con cos(lat)
+        dlat = radius_m / 111_320.0
+        dlon = radius_m / (111_320.0 * max(math.cos(math.radians(lat)), 0.01))
+        c0 = self._cell(lat - dlat, lon - dlon)
+        c1 = self._cell(lat + dlat, lon + dlon)
+        for ci in range(c0[0], c1[0] + 1):
+            for cj in range(c0[1], c1[1] + 1):
+                for v in self.cells.get((ci, cj), ()):
+                    d = haversine_m(lat, lon, v.lat, v.lon)
+                    if d <= radius_m:
+                        yield v, d
+
+    def plausibility(self, name: str, lat: float, lon: float, radius_m: float = NEAR_RADIUS_M) -> Plausibility:
+        """
+        Score 0..1 = similitud de nombre * factor de distancia (1 hasta NEAR_FULL_M,
+        decae linealmente a 0 en radius_m). Se queda con el mejor candidato.
+        """
+        best = Plausibility(0.0)
+        for v, d in self.nearby(lat, lon, radius_m):
+            sim = name_similarity(name, v.name)
+            if sim <= 0:
+                continue
+            dist_f = 1.0 if d <= NEAR_FULL_M else max(0.0, (radius_m - d) / (radius_m - NEAR_FULL_M))
+            sc = sim * dist_f
+            if sc > best.score:
+                best = Plausibility(sc, v, d)
+        return best
+
+
+def street_key(street: str, housenumber: str) -> str:
+    """"Carrer de Quart", "57" y "C/ Quart", "57" -> "quart|57". Vacío si falta algo."""
+    toks = [t for t in re.split(r"[^a-z0-9ñ]+", norm(street)) if t and t not in STREET_STOPWORDS]
+    num = (housenumber or "").strip().lower()
+    if not toks or not num:
+        return ""
+    return " ".join(toks) + "|" + num
+
+
+class OsmAddressIndex:
+    """
+    Índice de direcciones del export OSM: calle normalizada + número -> venues.
+    Solo entran filas con addr:street y addr:housenumber (en OSM son bastantes menos
+    que las que tienen nombre, pero cuando están son la evidencia más fiable).
+    """
+
+    def __init__(self, venues: list[OsmVenue]):
+        self.by_key: dict[str, list[OsmVenue]] = {}
+        for v in venues:
+            k = street_key(v.addr_street, v.addr_housenumber)
+            if k:
+                self.by_key.setdefault(k, []).append(v)
+
+    @classmethod
+    def from_csv(cls, path: Path | str = OSM_IMPORT) -> "OsmAddressIndex":
+        return cls(list(load_osm_venues_cached(str(path))))
+
+    def lookup(self, address: str) -> list[OsmVenue]:
+        street, num = split_street_number(address)
+        k = street_key(street, num)
+        return list(self.by_key.get(k, ())) if k else []
@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import time
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Tabla columnar del export de OSM (salida de prep_overpass_csv.py).
+#
+# En vez de un dict de strings por fila:
+#   - lat/lon float64 y osm_id int64 (-1 si no es numérico), parseados una sola vez
+#   - osm_type, amenity y addr_city codificados por diccionario (códigos int32 + categorías)
+#   - resto de textos como en Arrow: un buffer UTF-8 y offsets int64 por columna
+#
+# Se lee/escribe en CSV, Parquet o Arrow IPC (.arrow/.feather) según la extensión. Con
+# Arrow IPC la lectura va por mmap y las columnas se envuelven sin copiar; slice() tampoco
+# copia. pyarrow solo hace falta para Parquet/Arrow.
+#
+#   python osm_table.py osm_venues_import.csv osm_venues_import.parquet
+
+BASE_DIR = Path(__file__).resolve().parent
+
+CSV_FIELDS = [
+    "osm_type", "osm_id", "name", "amenity",
+    "addr_city", "addr_street", "addr_housenumber", "addr_postcode",
+    "website", "phone",
+    "lat", "lon",
+]
+DICT_FIELDS = ("osm_type", "amenity", "addr_city")
+STR_FIELDS = ("name", "addr_street", "addr_housenumber", "addr_postcode", "website", "phone")
+
+ARROW_SUFFIXES = {".arrow", ".feather", ".ipc"}
+PARQUET_SUFFIXES = {".parquet", ".pq"}
+COLUMNAR_SUFFIXES = ARROW_SUFFIXES | PARQUET_SUFFIXES
+
+# Filas por bloque al construir desde CSV
+CHUNK = 100_000
+
+
+@dataclass
+class StrColumn:
+    """Strings en layout Arrow: data[offsets[i]:offsets[i+1]] es la fila i."""
+
+    data: np.ndarray  # uint8
+    offsets: np.ndarray  # int64, len = n + 1
+
+    @classmethod
+    def from_list(cls, values: list[str]) -> "StrColumn":
+        enc = [v.encode("utf-8") for v in values]
+        offsets = np.zeros(len(enc) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in enc], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(enc), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.offsets[i] : self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        buf = self.data.tobytes()
+        off = self.offsets.tolist()
+        for a, b in zip(off, off[1:]):
+            yield buf[a:b].decode("utf-8")
+
+    def slice(self, start: int, stop: int) -> "StrColumn":
+        # Sin copia: offsets es una vista y data sigue siendo el mismo buffer
+        return StrColumn(self.data, self.offsets[start : stop + 1])
+
+    def take(self, idx: np.ndarray) -> "StrColumn":
+        return StrColumn.from_list([self[int(i)] for i in idx])
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @classmethod
+    def concat(cls, cols: list["StrColumn"]) -> "StrColumn":
+        datas = [c.data[c.offsets[0] : c.offsets[-1]] for c in cols]
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for c in cols:
+            offsets.append(c.offsets[1:] - c.offsets[0] + base)
+            base += int(c.offsets[-1] - c.offsets[0])
+        return cls(np.concatenate(datas) if datas else np.zeros(0, dtype=np.uint8), np.concatenate(offsets))
+
+
+@dataclass
+class DictColumn:
+    codes: np.ndarray  # int32
+    categories: list[str]
+
+    @classmethod
+    def from_list(cls, values: list[str]) -> "DictColumn":
+        cats: dict[str, int] = {}
+        codes = np.fromiter((cats.setdefault(v, len(cats)) for v in values), dtype=np.int32, count=len(values))
+        return cls(codes, list(cats))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> str:
+        return self.categories[self.codes[i]]
+
+    def __iter__(self) -> Iterator[str]:
+        cats = self.categories
+        return (cats[c] for c in self.codes.tolist())
+
+    def code_of(self, value: str) -> int:
+        """-1 si el valor no aparece (ningún código lo iguala en un filtro)."""
+        try:
+            return self.categories.index(value)
+        except ValueError:
+            return -1
+
+    def isin(self, values: Iterable[str]) -> np.ndarray:
+        want = {self.code_of(v) for v in values} - {-1}
+        return np.isin(self.codes, list(want)) if want else np.zeros(len(self.codes), dtype=bool)
+
+    def slice(self, start: int, stop: int) -> "DictColumn":
+        return DictColumn(self.codes[start:stop], self.categories)
+
+    def take(self, idx: np.ndarray) -> "DictColumn":
+        return DictColumn(self.codes[idx], self.categories)
+
+    @classmethod
+    def concat(cls, cols: list["DictColumn"]) -> "DictColumn":
+        cats: dict[str, int] = {}
+        parts = []
+        for c in cols:
+            remap = np.array([cats.setdefault(v, len(cats)) for v in c.categories], dtype=np.int32)
+            parts.append(remap[c.codes] if len(remap) else c.codes)
+        return cls(np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32), list(cats))
+
+
+@dataclass
+class OsmTable:
+    osm_type: DictColumn
+    osm_id: np.ndarray  # int64
+    name: StrColumn
+    amenity: DictColumn
+    addr_city: DictColumn
+    addr_street: StrColumn
+    addr_housenumber: StrColumn
+    addr_postcode: StrColumn
+    website: StrColumn
+    phone: StrColumn
+    lat: np.ndarray  # float64
+    lon: np.ndarray  # float64
+
+    def __len__(self) -> int:
+        return len(self.osm_id)
+
+    def _map(self, fn) -> "OsmTable":
+        return OsmTable(**{f.name: fn(getattr(self, f.name)) for f in fields(self)})
+
+    def slice(self, start: int, stop: int) -> "OsmTable":
+        return self._map(lambda c: c[start:stop] if isinstance(c, np.ndarray) else c.slice(start, stop))
+
+    def take(self, idx: np.ndarray) -> "OsmTable":
+        return self._map(lambda c: c[idx] if isinstance(c, np.ndarray) else c.take(idx))
+
+    def filter(self, mask: np.ndarray) -> "OsmTable":
+        return self.take(np.flatnonzero(mask))
+
+    def row(self, i: int) -> dict:
+        """Fila como la del CSV (osm_id y coords como texto)."""
+        out = {f: getattr(self, f)[i] for f in DICT_FIELDS + STR_FIELDS}
+        out["osm_id"] = str(int(self.osm_id[i])) if self.osm_id[i] >= 0 else ""
+        out["lat"] = repr(float(self.lat[i]))
+        out["lon"] = repr(float(self.lon[i]))
+        return out
+
+    def iter_rows(self) -> Iterator[dict]:
+        cols = {f: iter(getattr(self, f)) for f in DICT_FIELDS + STR_FIELDS}
+        ids, lat, lon = self.osm_id.tolist(), self.lat.tolist(), self.lon.tolist()
+        for i in range(len(self)):
+            row = {f: next(c) for f, c in cols.items()}
+            row["osm_id"] = str(ids[i]) if ids[i] >= 0 else ""
+            row["lat"] = repr(lat[i])
+            row["lon"] = repr(lon[i])
+            yield row
+
+    def iter_venues(self):
+        """OsmVenue por fila, para los índices de osm_index.py."""
+        from osm_index import OsmVenue  # import diferido: osm_index carga tablas desde aquí
+
+        for r in self.iter_rows():
+            r["lat"], r["lon"] = float(r["lat"]), float(r["lon"])
+            yield OsmVenue(**r)
+
+    # --- CSV ---
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict], chunk: int = CHUNK) -> "OsmTable":
+        """
+        Filas con las columnas de CSV_FIELDS; descarta las que no tienen lat/lon numéricos.
+        Se convierte a columnas cada `chunk` filas para no tener todo el export como strings.
+        """
+        parts: list[OsmTable] = []
+        cols: dict[str, list] = {f: [] for f in CSV_FIELDS}
+        for row in rows:
+            try:
+                lat = float(row.get("lat") or "")
+                lon = float(row.get("lon") or "")
+            except ValueError:
+                continue
+            oid = (row.get("osm_id") or "").strip()
+            cols["osm_id"].append(int(oid) if oid.isdigit() else -1)
+            cols["lat"].append(lat)
+            cols["lon"].append(lon)
+            for f in DICT_FIELDS + STR_FIELDS:
+                cols[f].append((row.get(f) or "").strip())
+            if len(cols["osm_id"]) >= chunk:
+                parts.append(cls._from_lists(cols))
+                cols = {f: [] for f in CSV_FIELDS}
+        if cols["osm_id"] or not parts:
+            parts.append(cls._from_lists(cols))
+        return parts[0] if len(parts) == 1 else cls.concat(parts)
+
+    @classmethod
+    def _from_lists(cls, cols: dict[str, list]) -> "OsmTable":
+        return cls(
+            osm_id=np.array(cols["osm_id"], dtype=np.int64),
+            lat=np.array(cols["lat"], dtype=np.float64),
+            lon=np.array(cols["lon"], dtype=np.float64),
+            **{f: DictColumn.from_list(cols[f]) for f in DICT_FIELDS},
+            **{f: StrColumn.from_list(cols[f]) for f in STR_FIELDS},
+        )
+
+    @classmethod
+    def concat(cls, tables: list["OsmTable"]) -> "OsmTable":
+        out = {}
+        for f in fields(cls):
+            first = getattr(tables[0], f.name)
+            if isinstance(first, np.ndarray):
+                out[f.name] = np.concatenate([getattr(t, f.name) for t in tables])
+            else:
+                out[f.name] = type(first).concat([getattr(t, f.name) for t in tables])
+        return cls(**out)
+
+    @classmethod
+    def from_csv(cls, path: Path | str) -> "OsmTable":
+        with Path(path).open("r", encoding="utf-8-sig", newline="") as f:
+            return cls.from_rows(csv.DictReader(f))
+
+    def to_csv(self, path: Path | str) -> None:
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            w.writeheader()
+            w.writerows(self.iter_rows())
+        tmp.replace(path)
+
+    # --- Arrow / Parquet ---
+
+    def to_arrow(self):
+        import pyarrow as pa
+
+        arrays, names = [], []
+        for f in CSV_FIELDS:
+            col = getattr(self, f)
+            if isinstance(col, DictColumn):
+                arr = pa.DictionaryArray.from_arrays(pa.array(col.codes, pa.int32()), pa.array(col.categories, pa.string()))
+            elif isinstance(col, StrColumn):
+                # Rebase por si la columna es un slice (offsets[0] != 0)
+                off = col.offsets - col.offsets[0]
+                data = col.data[col.offsets[0] : col.offsets[-1]]
+                arr = pa.LargeStringArray.from_buffers(len(col), pa.py_buffer(off), pa.py_buffer(data))
+            else:
+                arr = pa.array(col)
+            arrays.append(arr)
+            names.append(f)
+        return pa.Table.from_arrays(arrays, names=names)
+
+    @classmethod
+    def from_arrow(cls, table) -> "OsmTable":
+        import pyarrow as pa
+
+        def chunk(name):
+            return table.column(name).combine_chunks()
+
+        cols = {}
+        for f in DICT_FIELDS:
+            arr = chunk(f)
+            if not pa.types.is_dictionary(arr.type):
+                arr = arr.dictionary_encode()
+            codes = arr.indices.cast(pa.int32()).fill_null(0).to_numpy(zero_copy_only=False)
+            cats = [c if c is not None else "" for c in arr.dictionary.to_pylist()]
+            if arr.null_count:
+                # Nulos -> "" para que las filas se comporten como las del CSV
+                cats.append("")
+                codes = np.where(arr.is_null().to_numpy(zero_copy_only=False), len(cats) - 1, codes).astype(np.int32)
+            cols[f] = DictColumn(codes, cats)
+        for f in STR_FIELDS:
+            arr = chunk(f).cast(pa.large_string())
+            if arr.null_count:
+                arr = arr.fill_null("")
+            _, off_buf, data_buf = arr.buffers()
+            off = np.frombuffer(off_buf, dtype=np.int64)[arr.offset : arr.offset + len(arr) + 1]
+            data = np.frombuffer(data_buf, dtype=np.uint8) if data_buf is not None else np.zeros(0, dtype=np.uint8)
+            cols[f] = StrColumn(data, off)
+        cols["osm_id"] = chunk("osm_id").cast(pa.int64()).fill_null(-1).to_numpy()
+        cols["lat"] = chunk("lat").cast(pa.float64()).to_numpy(zero_copy_only=False)
+        cols["lon"] = chunk("lon").cast(pa.float64()).to_numpy(zero_copy_only=False)
+        return cls(**cols)
+
+    @classmethod
+    def read(cls, path: Path | str) -> "OsmTable":
+        path = Path(path)
+        suffix = path.suffix.lower()
+        if suffix in PARQUET_SUFFIXES:
+            import pyarrow.parquet as pq
+
+            return cls.from_arrow(pq.read_table(path))
+        if suffix in ARROW_SUFFIXES:
+            import pyarrow as pa
+
+            # mmap: las columnas apuntan al fichero mapeado, no se copian a memoria
+            with pa.memory_map(str(path), "r") as src:
+                return cls.from_arrow(pa.ipc.open_file(src).read_all())
+        return cls.from_csv(path)
+
+    def write(self, path: Path | str) -> None:
+        """Escribe en <path>.tmp y renombra al final, como los sinks."""
+        path = Path(path)
+        suffix = path.suffix.lower()
+        if suffix not in COLUMNAR_SUFFIXES:
+            self.to_csv(path)
+            return
+        tmp = path.with_name(path.name + ".tmp")
+        table = self.to_arrow()
+        if suffix in PARQUET_SUFFIXES:
+            import pyarrow.parquet as pq
+
+            pq.write_table(table, tmp, compression="zstd")
+        else:
+            import pyarrow as pa
+
+            # Sin compresión: es lo que permite leerlo por mmap sin copiar
+            with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as w:
+                w.write_table(table)
+        tmp.replace(path)
+
+    def nbytes(self) -> int:
+        total = 0
+        for f in fields(self):
+            c = getattr(self, f.name)
+            if isinstance(c, np.ndarray):
+                total += c.nbytes
+            elif isinstance(c, StrColumn):
+                total += int(c.offsets[-1] - c.offsets[0]) + c.offsets.nbytes
+            else:
+                total += c.codes.nbytes + sum(len(s) for s in c.categories)
+        return total
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convierte el export OSM entre CSV, Parquet y Arrow IPC")
+    ap.add_argument("src", help="osm_venues_import.csv / .parquet / .arrow")
+    ap.add_argument("dst", help="Formato por extensión: .csv, .parquet, .arrow/.feather")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    table = OsmTable.read(args.src)
+    t1 = time.perf_counter()
+    table.write(args.dst)
+    t2 = time.perf_counter()
+    print(f"Filas: {len(table)} | en memoria: {table.nbytes() / 1e6:.1f} MB | lectura {t1 - t0:.2f}s, escritura {t2 - t1:.2f}s")
+    print(f"Generado: {args.dst} ({Path(args.dst).stat().st_size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+# Runner del pipeline de tools/: prep_overpass -> exact_join -> geocoders (OK_min/SQL
+# salen en la misma pasada del geocoder).
+#
+# Cada etapa declara entradas, salidas y parámetros. Su clave es el hash del argv, del
+# código (el script y los módulos de tools/ que importa, también los diferidos) y del
+# contenido de las entradas. Si la clave coincide con la de la última ejecución buena y
+# las salidas siguen ahí, la etapa se salta; si no, se ejecuta. Las etapas sin
+# dependencias entre sí corren en paralelo (--jobs), salvo las que comparten `lock`
+# (los geocoders: un solo cliente contra Nominatim a la vez).
+#
+#   python pipeline.py                 # offline: las etapas de red quedan como están
+#   python pipeline.py --network       # incluye geocoders si sus entradas cambiaron
+#   python pipeline.py --dry-run       # qué se ejecutaría y por qué
+#
+# Una salida editada a mano (p.ej. un exact_join_OK.csv revisado) no invalida su etapa: se
+# avisa y las etapas de después la ven como entrada cambiada. --force la rehace.
+# Estado en pipeline_state.json; salida de cada etapa en pipeline_logs/<etapa>.log.
+
+BASE_DIR = Path(__file__).resolve().parent
+STATE_FILE = BASE_DIR / "pipeline_state.json"
+LOG_DIR = BASE_DIR / "pipeline_logs"
+STATE_VERSION = 1
+
+IMPORT_RE = re.compile(r"^\s*(?:from\s+(\w+)\s+import|import\s+(\w+))", re.MULTILINE)
+
+
+@dataclass
+class Stage:
+    name: str
+    script: str
+    args: list[str]
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+    # Sale a la red (solo con --network)
+    network: bool = False
+    # Etapas con el mismo lock no corren a la vez
+    lock: str = ""
+
+    @property
+    def argv(self) -> list[str]:
+        return [sys.executable, str(BASE_DIR / self.script)] + self.args
+
+
+def build_stages() -> list[Stage]:
+    osm = "osm_venues_import.csv"
+    venues = "venues_need_coords.csv"
+    unmatched = "venues_need_coords_unmatched.csv"
+    prem = "venue_enrichment_premiados_coords"
+    return [
+        Stage("prep_overpass", "prep_overpass_csv.py", ["overpass_cv.csv", osm], ["overpass_cv.csv"], [osm]),
+        Stage(
+            "exact_join",
+            "exact_join.py",
+            [venues, "--osm", "overpass_cv.csv", "--out", "exact_join_OK.csv", "--out-review", "exact_join_REVIEW.csv", "--out-unmatched", unmatched],
+            [venues, "overpass_cv.csv"],
+            ["exact_join_OK.csv", "exact_join_REVIEW.csv", unmatched],
+        ),
+        Stage(
+            "geocode_by_address",
+            "geocode_by_address.py",
+            ["--input", unmatched, "--gazetteer", osm, "--osm-index", osm],
+            [unmatched, osm],
+            ["venue_coords_OK.csv", "venue_coords_REVIEW.csv", "venue_coords_REVIEW_candidates.csv"],
+            network=True,
+            lock="nominatim",
+        ),
+        Stage(
+            "geocode_premiados",
+            "geocode_premiados.py",
+            ["--gazetteer", osm, "--osm-index", osm, "--out-sql", f"{prem}_OK.sql"],
+            ["premiados_sin_coords.csv", osm],
+            [
+                f"{prem}_ALL.csv", f"{prem}_OK.csv", f"{prem}_REVIEW.csv", f"{prem}_OK_min.csv",
+                f"{prem}_REVIEW_candidates.csv", f"{prem}_OK.sql",
+            ],
+            network=True,
+            lock="nominatim",
+        ),
+    ]
+
+
+def code_files(script: str) -> list[Path]:
+    """El script y, recursivamente, los módulos de tools/ que importa."""
+    seen: dict[str, Path] = {}
+    todo = [script[:-3] if script.endswith(".py") else script]
+    while todo:
+        mod = todo.pop()
+        path = BASE_DIR / f"{mod}.py"
+        if mod in seen or not path.exists():
+            continue
+        seen[mod] = path
+        for a, b in IMPORT_RE.findall(path.read_text(encoding="utf-8")):
+            todo.append(a or b)
+    return [seen[m] for m in sorted(seen)]
+
+
+class Hasher:
+    """sha256 de ficheros, cacheado por (tamaño, mtime_ns) entre ejecuciones."""
+
+    def __init__(self, cache: dict):
+        self.cache = cache
+
+    def digest(self, path: Path) -> str:
+        if not path.exists():
+            return "<missing>"
+        st = path.stat()
+        key = str(path.resolve())
+        hit = self.cache.get(key)
+        if hit and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+            return hit[2]
+        h = hashlib.sha256()
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        self.cache[key] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def stage_key(self, stage: Stage) -> str:
+        h = hashlib.sha256()
+        h.update(json.dumps([stage.name, stage.script, stage.args]).encode("utf-8"))
+        for p in code_files(stage.script):
+            h.update(f"code:{p.name}:{self.digest(p)}".encode("utf-8"))
+        for name in stage.inputs:
+            h.update(f"in:{name}:{self.digest(BASE_DIR / name)}".encode("utf-8"))
+        return h.hexdigest()
+
+
+def load_state(path: Path) -> dict:
+    if path.exists():
+        state = json.loads(path.read_text(encoding="utf-8"))
+        if state.get("version") == STATE_VERSION:
+            return state
+    return {"version": STATE_VERSION, "stages": {}, "files": {}}
+
+
+def save_state(path: Path, state: dict) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(state, indent=1, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    owner: dict[str, str] = {}
+    for s in stages:
+        for o in s.outputs:
+            if o in owner:
+                raise ValueError(f"{o} lo generan {owner[o]} y {s.name}")
+            owner[o] = s.name
+    deps = {s.name: {owner[i] for i in s.inputs if i in owner and owner[i] != s.name} for s in stages}
+    # Orden topológico solo para detectar ciclos
+    done: set[str] = set()
+    while len(done) < len(deps):
+        ready = [n for n, d in deps.items() if n not in done and d <= done]
+        if not ready:
+            raise ValueError(f"Ciclo entre etapas: {sorted(set(deps) - done)}")
+        done.update(ready)
+    return deps
+
+
+@dataclass
+class Outcome:
+    status: str  # RUN, SKIP, FAIL, OFFLINE, BLOCKED
+    seconds: float = 0.0
+    why: str = ""
+
+
+def run_stage(stage: Stage) -> tuple[int, float]:
+    LOG_DIR.mkdir(exist_ok=True)
+    t0 = time.perf_counter()
+    with (LOG_DIR / f"{stage.name}.log").open("wb") as log:
+        code = subprocess.call(stage.argv, cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT)
+    return code, time.perf_counter() - t0
+
+
+class Runner:
+    def __init__(self, stages: list[Stage], state: dict, network: bool, force: set[str], dry_run: bool):
+        self.stages = {s.name: s for s in stages}
+        self.deps = dependencies(stages)
+        self.state = state
+        self.hasher = Hasher(state["files"])
+        self.network = network
+        self.force = force
+        self.dry_run = dry_run
+        self.outcomes: dict[str, Outcome] = {}
+
+    def why_stale(self, stage: Stage, key: str) -> str:
+        """Motivo para ejecutar la etapa ("" si sigue valiendo)."""
+        if stage.name in self.force:
+            return "--force"
+        prev = self.state["stages"].get(stage.name)
+        if prev is None:
+            return "sin ejecución previa"
+        missing = [o for o in stage.outputs if not (BASE_DIR / o).exists()]
+        if missing:
+            return f"falta {missing[0]}"
+        if prev["key"] != key:
+            return "cambiaron entradas, código o parámetros"
+        return ""
+
+    def edited_outputs(self, stage: Stage) -> list[str]:
+        prev = self.state["stages"].get(stage.name) or {}
+        recorded = prev.get("outputs") or {}
+        return [o for o in stage.outputs if o in recorded and self.hasher.digest(BASE_DIR / o) != recorded[o]]
+
+    def decide(self, stage: Stage) -> tuple[Optional[Outcome], str, str]:
+        """(outcome, clave, motivo). outcome None = hay que ejecutarla."""
+        bad = [d for d in self.deps[stage.name] if self.outcomes[d].status in ("FAIL", "BLOCKED")]
+        if bad:
+            return Outcome("BLOCKED", why=f"falló {bad[0]}"), "", ""
+        key = self.hasher.stage_key(stage)
+        why = self.why_stale(stage, key)
+        edited = self.edited_outputs(stage)
+        if edited:
+            print(f"  aviso: {stage.name}: {', '.join(edited)} modificado fuera del pipeline")
+        if self.dry_run:
+            # Lo que cuelga de una etapa que se rehará también cambiará
+            redo = [d for d in self.deps[stage.name] if self.outcomes[d].status == "WOULD_RUN"]
+            if redo and not why:
+                why = f"se rehace {redo[0]}"
+        if not why:
+            return Outcome("SKIP", why="al día"), key, why
+        if stage.network and not self.network:
+            return Outcome("OFFLINE", why=f"{why} (sin --network)"), key, why
+        if self.dry_run:
+            return Outcome("WOULD_RUN", why=why), key, why
+        return None, key, why
+
+    def record(self, stage: Stage, key: str, seconds: float) -> None:
+        self.state["stages"][stage.name] = {
+            "key": key,
+            "outputs": {o: self.hasher.digest(BASE_DIR / o) for o in stage.outputs},
+            "seconds": round(seconds, 3),
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+    def run(self, jobs: int) -> None:
+        todo = list(self.stages)
+        running: dict[Future, tuple[Stage, str, str]] = {}
+        locks: set[str] = set()
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while todo or running:
+                for name in list(todo):
+                    stage = self.stages[name]
+                    if len(running) >= jobs or not all(d in self.outcomes for d in self.deps[name]):
+                        continue
+                    if stage.lock and stage.lock in locks:
+                        continue
+                    todo.remove(name)
+                    out, key, why = self.decide(stage)
+                    if out is not None:
+                        self.outcomes[name] = out
+                        self.report(name)
+                        continue
+                    print(f"  {name}: ejecutando ({why})")
+                    if stage.lock:
+                        locks.add(stage.lock)
+                    running[pool.submit(run_stage, stage)] = (stage, key, why)
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    stage, key, why = running.pop(fut)
+                    locks.discard(stage.lock)
+                    code, seconds = fut.result()
+                    if code == 0:
+                        self.record(stage, key, seconds)
+                        self.outcomes[stage.name] = Outcome("RUN", seconds, why)
+                    else:
+                        self.outcomes[stage.name] = Outcome("FAIL", seconds, f"exit {code}, ver {LOG_DIR / stage.name}.log")
+                    self.report(stage.name)
+
+    def report(self, name: str) -> None:
+        o = self.outcomes[name]
+        print(f"  {name}: {o.status} {o.seconds:.2f}s ({o.why})")
+
+
+def positive_int(s: str) -> int:
+    n = int(s)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"debe ser >= 1: {s}")
+    return n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pipeline de tools/ con caché por contenido y etapas en paralelo")
+    ap.add_argument("stages", nargs="*", help="Solo estas etapas (y nada más; las previas deben estar al día)")
+    ap.add_argument("--jobs", type=positive_int, default=os.cpu_count() or 2, help="Etapas en paralelo (>= 1)")
+    ap.add_argument("--network", action="store_true", help="Permite las etapas que salen a la red (geocoders)")
+    ap.add_argument("--force", nargs="*", default=None, help="Rehace estas etapas (sin nombres: todas)")
+    ap.add_argument("--dry-run", action="store_true", help="Solo dice qué se ejecutaría")
+    ap.add_argument("--state", default=str(STATE_FILE))
+    args = ap.parse_args()
+
+    stages = build_stages()
+    names = [s.name for s in stages]
+    unknown = set(args.stages) - set(names)
+    if unknown:
+        ap.error(f"Etapas desconocidas: {', '.join(sorted(unknown))} (hay: {', '.join(names)})")
+    force = set(names) if args.force == [] else set(args.force or [])
+
+    state_path = Path(args.state)
+    state = load_state(state_path)
+    runner = Runner(stages, state, args.network, force, args.dry_run)
+    if args.stages:
+        # Las no pedidas cuentan como resueltas con lo que haya en disco
+        for n in names:
+            if n not in args.stages:
+                runner.outcomes[n] = Outcome("SKIP", why="no pedida")
+        runner.stages = {n: s for n, s in runner.stages.items() if n in args.stages}
+
+    t0 = time.perf_counter()
+    try:
+        runner.run(args.jobs)
+    finally:
+        if not args.dry_run:
+            save_state(state_path, state)
+    wall = time.perf_counter() - t0
+
+    print(f"\n{'etapa':<20} {'estado':<9} {'s':>8}  motivo")
+    for n in names:
+        o = runner.outcomes.get(n)
+        if o is not None:
+            print(f"{n:<20} {o.status:<9} {o.seconds:>8.2f}  {o.why}")
+    busy = sum(o.seconds for o in runner.outcomes.values())
+    print(f"Total: {wall:.2f}s de reloj, {busy:.2f}s sumando etapas")
+    sys.exit(1 if any(o.status in ("FAIL", "BLOCKED") for o in runner.outcomes.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,215 @@
+import argparse
 import csv
-import sys
+import re
+from collections import Counter
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Optional
+
+from textnorm import CITY_BOUNDS, norm
+
+# Columnas de Overpass que aceptamos para cada campo (los exports varían según la herramienta)
+TAG_KEYS = {
+    "@type": ("@type", "::type", "type"),
+    "@id": ("@id", "::id", "id"),
+    "addr:city": ("addr:city", "addr_city"),
+    "addr:street": ("addr:street", "addr_street"),
+    "addr:housenumber": ("addr:housenumber", "addr_housenumber"),
+    "addr:postcode": ("addr:postcode", "addr_postcode"),
+    "phone": ("phone", "contact:phone", "contact_phone"),
+    "website": ("website", "contact:website", "contact_website"),
+    "@lat": ("@lat", "::lat", "lat"),
+    "@lon": ("@lon", "::lon", "lon"),
+}
+
+
+@dataclass
+class PrepFilters:
+    """
+    Filtros que se evalúan durante la lectura, antes de materializar la fila. Van de
+    más barato a más caro y cada fila descartada cuenta solo en el primero que falla.
+    """
+
+    amenities: set[str] = field(default_factory=set)
+    required_tags: list[str] = field(default_factory=list)
+    bbox: Optional[tuple[float, float, float, float]] = None  # lat_min, lat_max, lon_min, lon_max
+    municipalities: set[str] = field(default_factory=set)  # norm()
+    name_re: Optional[re.Pattern] = None
+    rejected: Counter = field(default_factory=Counter)
+
+    def reject(self, get, name: str, amenity: str, lat: str, lon: str) -> str:
+        """Motivo del descarte ("" si la fila pasa)."""
+        # filtro mínimo “pro”: nombre + lat/lon
+        if not name or not lat or not lon:
+            return "basic"
+        if self.amenities and amenity not in self.amenities:
+            return "amenity"
+        for tag in self.required_tags:
+            if not get(*TAG_KEYS.get(tag, (tag,))):
+                return f"tag:{tag}"
+        if self.bbox is not None or self.municipalities:
+            try:
+                la, lo = float(lat), float(lon)
+            except ValueError:
+                return "coords"
+            if self.bbox is not None:
+                la0, la1, lo0, lo1 = self.bbox
+                if not (la0 <= la <= la1 and lo0 <= lo <= lo1):
+                    return "bbox"
+            if self.municipalities and not self._in_municipality(norm(get(*TAG_KEYS["addr:city"])), la, lo):
+                return "municipality"
+        if self.name_re is not None and not (self.name_re.search(name) or self.name_re.search(norm(name))):
+            return "name_regex"
+        return ""
+
+    def _in_municipality(self, city: str, lat: float, lon: float) -> bool:
+        if city:
+            return city in self.municipalities
+        # Sin addr:city (la mayoría de filas): vale el bbox del municipio si lo conocemos
+        for m in self.municipalities:
+            b = CITY_BOUNDS.get(m)
+            if b and b[0] <= lat <= b[1] and b[2] <= lon <= b[3]:
+                return True
+        return False
+
+    def active(self) -> list[str]:
+        out = []
+        if self.amenities:
+            out.append(f"amenity in {sorted(self.amenities)}")
+        if self.required_tags:
+            out.append(f"tags {self.required_tags}")
+        if self.bbox is not None:
+            out.append(f"bbox {self.bbox}")
+        if self.municipalities:
+            out.append(f"municipio {sorted(self.municipalities)}")
+        if self.name_re is not None:
+            out.append(f"nombre ~ {self.name_re.pattern!r}")
+        return out
+
+
+def tag_getter(row: dict):
+    """
+    get(*keys): el primer valor no vacío entre las columnas candidatas. Overpass exporta
+    todas las columnas pedidas: phone vacío no tapa un contact:phone informado.
+    """
+
+    def get(*keys):
+        for k in keys:
+            v = row.get(k)
+            if v is not None and str(v).strip():
+                return str(v).strip()
+        return ""
+
+    return get
+
+
+def prep_row(row: dict, filters: PrepFilters) -> Optional[dict]:
+    """Fila de Overpass -> fila de osm_venues_import, o None si la descarta algún filtro."""
+    get = tag_getter(row)
+    name = get("name")
+    amenity = get("amenity")
+    lat = get(*TAG_KEYS["@lat"])
+    lon = get(*TAG_KEYS["@lon"])
+
+    why = filters.reject(get, name, amenity, lat, lon)
+    if why:
+        filters.rejected[why] += 1
+        return None
+
+    return {
+        "osm_type": get(*TAG_KEYS["@type"]),
+        "osm_id": get(*TAG_KEYS["@id"]),
+        "name": name,
+        "amenity": amenity,
+        "addr_city": get(*TAG_KEYS["addr:city"]),
+        "addr_street": get(*TAG_KEYS["addr:street"]),
+        "addr_housenumber": get(*TAG_KEYS["addr:housenumber"]),
+        "addr_postcode": get(*TAG_KEYS["addr:postcode"]),
+        "website": get(*TAG_KEYS["website"]),
+        "phone": get(*TAG_KEYS["phone"]),
+        "lat": lat,
+        "lon": lon,
+    }
+
+
+def parse_bbox(s: str) -> tuple[float, float, float, float]:
+    """"lat_min,lon_min,lat_max,lon_max" (orden de Overpass) -> (lat_min, lat_max, lon_min, lon_max)."""
+    try:
+        s_, w_, n_, e_ = (float(x) for x in s.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"bbox inválido (lat_min,lon_min,lat_max,lon_max): {s}")
+    return (min(s_, n_), max(s_, n_), min(w_, e_), max(w_, e_))
+
 
 def main():
-    if len(sys.argv) < 3:
-        print("Uso: python prep_overpass_csv.py overpass_cv.csv osm_venues_import.csv")
-        sys.exit(1)
+    ap = argparse.ArgumentParser(description="Normaliza el export de Overpass a osm_venues_import (CSV, Parquet o Arrow)")
+    ap.add_argument("src", help="overpass_cv.csv")
+    ap.add_argument("dst", help="osm_venues_import.csv | .parquet | .arrow")
+    ap.add_argument("--bbox", type=parse_bbox, default=None, help="lat_min,lon_min,lat_max,lon_max")
+    ap.add_argument("--municipality", nargs="*", default=[], help="addr:city; sin addr:city, bbox del municipio si está en CITY_BOUNDS")
+    ap.add_argument("--amenity", nargs="*", default=[], help="Solo estas amenities (restaurant cafe bar ...)")
+    ap.add_argument("--require-tag", nargs="*", default=[], help="Tags que deben venir informados (website, phone, addr:street...)")
+    ap.add_argument("--name-regex", default="", help="Regex sobre el nombre (sin distinguir mayúsculas; también contra el nombre sin acentos)")
+    args = ap.parse_args()
 
-    src = Path(sys.argv[1])
-    dst = Path(sys.argv[2])
+    src = Path(args.src)
+    dst = Path(args.dst)
 
     if not src.exists():
         raise FileNotFoundError(f"No existe: {src}")
 
-    # Overpass suele exportar columnas con nombres especiales.
-    # Vamos a mapear por nombre “probable” y ser tolerantes.
-    def get(row, *keys):
-        for k in keys:
-            if k in row and row[k] is not None:
-                return str(row[k]).strip()
-        return ""
+    filters = PrepFilters(
+        amenities=set(args.amenity),
+        required_tags=list(args.require_tag),
+        bbox=args.bbox,
+        municipalities={norm(m) for m in args.municipality},
+        name_re=re.compile(args.name_regex, re.IGNORECASE) if args.name_regex else None,
+    )
+
+    out_fields = [
+        "osm_type","osm_id","name","amenity",
+        "addr_city","addr_street","addr_housenumber","addr_postcode",
+        "website","phone",
+        "lat","lon"
+    ]
+
+    read = 0
+
+    def rows(r):
+        nonlocal read
+        for row in r:
+            read += 1
+            out = prep_row(row, filters)
+            if out is not None:
+                yield out
 
     kept = 0
-    with src.open(newline="", encoding="utf-8") as f, dst.open("w", newline="", encoding="utf-8") as g:
+    with src.open(newline="", encoding="utf-8") as f:
         r = csv.DictReader(f)
+        columnar = False
+        if dst.suffix.lower() != ".csv":
+            # numpy (y pyarrow) solo hacen falta para las salidas columnar
+            from osm_table import COLUMNAR_SUFFIXES
 
-        out_fields = [
-            "osm_type","osm_id","name","amenity",
-            "addr_city","addr_street","addr_housenumber","addr_postcode",
-            "website","phone",
-            "lat","lon"
-        ]
-        w = csv.DictWriter(g, fieldnames=out_fields)
-        w.writeheader()
+            columnar = dst.suffix.lower() in COLUMNAR_SUFFIXES
+        if columnar:
+            from osm_table import OsmTable
 
-        for row in r:
-            osm_type = get(row, "@type", "::type", "type")
-            osm_id   = get(row, "@id", "::id", "id")
-            name     = get(row, "name")
-            amenity  = get(row, "amenity")
-
-            addr_city = get(row, "addr:city", "addr_city")
-            addr_street = get(row, "addr:street", "addr_street")
-            addr_hn = get(row, "addr:housenumber", "addr_housenumber")
-            addr_pc = get(row, "addr:postcode", "addr_postcode")
-
-            website = get(row, "website")
-            phone = get(row, "phone", "contact:phone", "contact_phone")
-
-            lat = get(row, "@lat", "::lat", "lat")
-            lon = get(row, "@lon", "::lon", "lon")
-
-            # filtro mínimo “pro”: nombre + lat/lon
-            if not name or not lat or not lon:
-                continue
-
-            w.writerow({
-                "osm_type": osm_type,
-                "osm_id": osm_id,
-                "name": name,
-                "amenity": amenity,
-                "addr_city": addr_city,
-                "addr_street": addr_street,
-                "addr_housenumber": addr_hn,
-                "addr_postcode": addr_pc,
-                "website": website,
-                "phone": phone,
-                "lat": lat,
-                "lon": lon,
-            })
-            kept += 1
+            # Parquet / Arrow IPC: columnas tipadas (ver osm_table.py); descarta coords no numéricas
+            table = OsmTable.from_rows(rows(r))
+            table.write(dst)
+            kept = len(table)
+        else:
+            with dst.open("w", newline="", encoding="utf-8") as g:
+                w = csv.DictWriter(g, fieldnames=out_fields)
+                w.writeheader()
+                for row in rows(r):
+                    w.writerow(row)
+                    kept += 1
 
+    print(f"Leídas: {read} | filtros: {'; '.join(filters.active()) or '-'}")
+    for why, n in filters.rejected.most_common():
+        print(f"  descartadas por {why}: {n}")
     print(f"Generado: {dst} (rows={kept})")
 
 if __name__ == "__main__":
@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from sinks import CsvSink, FanOut, ReplaceSqlSink
+
+# Rankings bayesianos materializados por ciudad, tipo de producto y mes.
+#
+# Lee un export de ratings (vw_rating_overall: id, venue_id, overall_score, created_at
+# [, updated_at, product_type_id]) en streaming y mantiene en SQLite las sumas/recuentos
+# por (venue, tipo de producto, mes). Solo se procesan ratings con fecha >= la marca de
+# agua de la ejecución anterior; un rating ya visto que vuelve con otra nota (edición del
+# mismo mes) resta su contribución antigua antes de sumar la nueva.
+#
+# Las puntuaciones se calculan vectorizadas sobre los acumulados:
+#
+#   bayes = (m * C + suma) / (m + n)     C = media del ámbito, m = --min-votes
+#
+# para cada ámbito (ciudad o todas) x (tipo de producto o todos), all-time y por mes.
+# Salida: rank_all_time.csv / rank_monthly.csv (top --top por ámbito) y, con --sql,
+# el mismo contenido como reemplazo completo de las tablas materializadas.
+#
+# Los borrados de ratings no llegan por la marca de agua: --full reconstruye desde cero.
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_DB = BASE_DIR / "ratings_rank.sqlite"
+
+MIN_VOTES = 5.0
+TOP = 200
+CHUNK = 50_000
+
+# "" = todas las ciudades / todos los tipos / todo el histórico
+ALL = ""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS acc (
+    venue_id        TEXT NOT NULL,
+    product_type_id TEXT NOT NULL,
+    month           TEXT NOT NULL,
+    sum             REAL NOT NULL,
+    n               INTEGER NOT NULL,
+    PRIMARY KEY (venue_id, product_type_id, month)
+);
+-- Última contribución de cada rating, para poder restarla si se edita
+CREATE TABLE IF NOT EXISTS seen (
+    rating_id       TEXT PRIMARY KEY,
+    venue_id        TEXT NOT NULL,
+    product_type_id TEXT NOT NULL,
+    month           TEXT NOT NULL,
+    score           REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+RANK_FIELDS = [
+    "rank_key", "period", "city_scope", "product_type_id", "rank", "venue_id", "name", "city",
+    "ratings_count", "avg_score", "bayes_score", "generated_at",
+]
+
+
+@dataclass
+class Rating:
+    rating_id: str
+    venue_id: str
+    product_type_id: str
+    month: str
+    ts: str
+    score: float
+
+
+def read_ratings(path: Path, watermark: str) -> Iterator[Rating]:
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            rid = (row.get("id") or row.get("rating_id") or "").strip()
+            vid = (row.get("venue_id") or "").strip()
+            created = (row.get("created_at") or "").strip()
+            # Las ediciones mueven updated_at, no created_at; el mes sigue siendo el de creación
+            ts = (row.get("updated_at") or "").strip() or created
+            try:
+                score = float(row.get("overall_score") or row.get("score") or "")
+            except ValueError:
+                continue
+            if not rid or not vid or len(created) < 7 or ts < watermark:
+                continue
+            yield Rating(rid, vid, (row.get("product_type_id") or "").strip(), created[:7], ts, score)
+
+
+def chunks(it: Iterator[Rating], size: int) -> Iterator[list[Rating]]:
+    buf: list[Rating] = []
+    for r in it:
+        buf.append(r)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+class RankState:
+    def __init__(self, path: Path | str):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "RankState":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def reset(self) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM acc")
+            self.conn.execute("DELETE FROM seen")
+            self.conn.execute("DELETE FROM meta")
+
+    def watermark(self) -> str:
+        r = self.conn.execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+        return r[0] if r else ""
+
+    def apply(self, batch: list[Rating]) -> tuple[int, int]:
+        """
+        (nuevos, editados). Una transacción por lote; la marca de agua no se toca aquí:
+        el export no viene ordenado por fecha y un lote a medias dejaría atrás filas más
+        antiguas de lotes sin aplicar (ver advance_watermark).
+        """
+        # Un mismo rating puede venir varias veces en el export: manda la última fila
+        latest = {r.rating_id: r for r in batch}
+        old: dict[str, tuple] = {}
+        ids = list(latest)
+        for i in range(0, len(ids), 500):
+            part = ids[i : i + 500]
+            q = f"SELECT rating_id, venue_id, product_type_id, month, score FROM seen WHERE rating_id IN ({','.join('?' * len(part))})"
+            for row in self.conn.execute(q, part):
+                old[row[0]] = row[1:]
+
+        delta: dict[tuple[str, str, str], list[float]] = {}
+        added = edited = 0
+        for r in latest.values():
+            key = (r.venue_id, r.product_type_id, r.month)
+            prev = old.get(r.rating_id)
+            if prev is not None:
+                if tuple(prev) == (*key, r.score):
+                    continue
+                d = delta.setdefault(tuple(prev[:3]), [0.0, 0])
+                d[0] -= prev[3]
+                d[1] -= 1
+                edited += 1
+            else:
+                added += 1
+            d = delta.setdefault(key, [0.0, 0])
+            d[0] += r.score
+            d[1] += 1
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO acc (venue_id, product_type_id, month, sum, n) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (venue_id, product_type_id, month) DO UPDATE SET sum = sum + excluded.sum, n = n + excluded.n",
+                [(*k, s, n) for k, (s, n) in delta.items() if n or s],
+            )
+            self.conn.execute("DELETE FROM acc WHERE n <= 0")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO seen (rating_id, venue_id, product_type_id, month, score) VALUES (?, ?, ?, ?, ?)",
+                [(r.rating_id, r.venue_id, r.product_type_id, r.month, r.score) for r in latest.values()],
+            )
+        return added, edited
+
+    def advance_watermark(self, wm: str) -> None:
+        """Solo tras consumir el export entero: si se corta antes, se relee desde la marca anterior."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('watermark', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)",
+                (wm,),
+            )
+
+    def load(self) -> tuple[list[str], list[str], list[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Acumulados como arrays: (venues, tipos, meses, vi, pi, mi, sum, n)."""
+        rows = self.conn.execute("SELECT venue_id, product_type_id, month, sum, n FROM acc").fetchall()
+        venues = sorted({r[0] for r in rows})
+        types = sorted({r[1] for r in rows})
+        months = sorted({r[2] for r in rows})
+        vix = {v: i for i, v in enumerate(venues)}
+        pix = {p: i for i, p in enumerate(types)}
+        mix = {m: i for i, m in enumerate(months)}
+        vi = np.fromiter((vix[r[0]] for r in rows), dtype=np.int64, count=len(rows))
+        pi = np.fromiter((pix[r[1]] for r in rows), dtype=np.int64, count=len(rows))
+        mi = np.fromiter((mix[r[2]] for r in rows), dtype=np.int64, count=len(rows))
+        s = np.fromiter((r[3] for r in rows), dtype=np.float64, count=len(rows))
+        n = np.fromiter((r[4] for r in rows), dtype=np.float64, count=len(rows))
+        return venues, types, months, vi, pi, mi, s, n
+
+
+def read_venues(path: Path) -> dict[str, tuple[str, str]]:
+    out: dict[str, tuple[str, str]] = {}
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            vid = (row.get("venue_id") or row.get("id") or "").strip()
+            if vid:
+                out[vid] = ((row.get("name") or "").strip(), (row.get("city") or "").strip())
+    return out
+
+
+def rank_scopes(
+    scope: np.ndarray, vi: np.ndarray, s: np.ndarray, n: np.ndarray, min_votes: float, top: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    scope/vi/s/n paralelos (una fila por acumulado). Agrega por (ámbito, venue), calcula
+    el bayesiano con la media de cada ámbito y devuelve el top por ámbito ordenado:
+    (scope, venue, n, avg, bayes, rank).
+    """
+    nv = int(vi.max()) + 1
+    uniq, inv = np.unique(scope * nv + vi, return_inverse=True)
+    gs = np.bincount(inv, weights=s, minlength=len(uniq))
+    gn = np.bincount(inv, weights=n, minlength=len(uniq))
+    g_scope, g_venue = uniq // nv, uniq % nv
+
+    n_scopes = int(g_scope.max()) + 1 if len(g_scope) else 0
+    scope_sum = np.bincount(g_scope, weights=gs, minlength=n_scopes)
+    scope_n = np.bincount(g_scope, weights=gn, minlength=n_scopes)
+    prior = np.divide(scope_sum, scope_n, out=np.zeros(n_scopes), where=scope_n > 0)
+
+    keep = gn > 0
+    g_scope, g_venue, gs, gn = g_scope[keep], g_venue[keep], gs[keep], gn[keep]
+    avg = gs / gn
+    bayes = (min_votes * prior[g_scope] + gs) / (min_votes + gn)
+
+    # Por ámbito, bayes desc; a igualdad, más votos y luego venue. Redondeado para que el
+    # orden de suma (incremental vs --full) no rompa empates exactos.
+    order = np.lexsort((g_venue, -gn, -np.round(bayes, 9), g_scope))
+    g_scope, g_venue, gn, avg, bayes = g_scope[order], g_venue[order], gn[order], avg[order], bayes[order]
+    starts = np.searchsorted(g_scope, np.arange(n_scopes))
+    rank = np.arange(len(g_scope)) - starts[g_scope] + 1
+    sel = rank <= top
+    return g_scope[sel], g_venue[sel], gn[sel], avg[sel], bayes[sel], rank[sel]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Materializa rankings bayesianos por ciudad / tipo de producto / mes")
+    ap.add_argument("ratings", help="Export de ratings (id, venue_id, overall_score, created_at[, updated_at, product_type_id])")
+    ap.add_argument("--venues", default="", help="Export de venues (id/venue_id, name, city) para nombre y ciudad")
+    ap.add_argument("--db", default=str(DEFAULT_DB), help="Estado incremental (acumulados + marca de agua)")
+    ap.add_argument("--full", action="store_true", help="Descarta el estado y reprocesa todo el export")
+    ap.add_argument("--min-votes", type=float, default=MIN_VOTES, help="Peso m del prior bayesiano")
+    ap.add_argument("--top", type=int, default=TOP, help="Venues por ámbito")
+    ap.add_argument("--out-all-time", default="rank_all_time.csv")
+    ap.add_argument("--out-monthly", default="rank_monthly.csv")
+    ap.add_argument("--sql", action="store_true", help="Genera también rank_*.sql para reemplazar las tablas materializadas")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    with RankState(args.db) as state:
+        if args.full:
+            state.reset()
+        wm = state.watermark()
+        added = edited = 0
+        max_ts = ""
+        for batch in chunks(read_ratings(Path(args.ratings), wm), CHUNK):
+            a, e = state.apply(batch)
+            added += a
+            edited += e
+            max_ts = max(max_ts, max(r.ts for r in batch))
+        if max_ts:
+            state.advance_watermark(max_ts)
+        new_wm = state.watermark()
+        venues, types, months, vi, pi, mi, s, n = state.load()
+    t1 = time.perf_counter()
+
+    info = read_venues(Path(args.venues)) if args.venues else {}
+    cities = sorted({info.get(v, ("", ""))[1] for v in venues} - {ALL})
+    cix = {c: i + 1 for i, c in enumerate(cities)}  # 0 = todas
+    venue_city = np.array([cix.get(info.get(v, ("", ""))[1], 0) for v in venues], dtype=np.int64)
+    ci = venue_city[vi] if len(vi) else np.zeros(0, dtype=np.int64)
+    city_names = [ALL] + cities
+    # Sin product_type_id en el export todo cae en el tipo "": es el mismo ámbito que "todos"
+    ptypes = sorted(set(types) - {ALL})
+    pix = {t: i + 1 for i, t in enumerate(ptypes)}  # 0 = todos
+    type_code = np.array([pix.get(t, 0) for t in types], dtype=np.int64)
+    type_names = [ALL] + ptypes
+    n_c, n_p = len(city_names), len(type_names)
+
+    generated_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    out_all = Path(args.out_all_time)
+    out_month = Path(args.out_monthly)
+    sinks_all = [CsvSink(out_all, RANK_FIELDS)]
+    sinks_month = [CsvSink(out_month, RANK_FIELDS)]
+    if args.sql:
+        sinks_all.append(ReplaceSqlSink(out_all.with_suffix(".sql"), "venue_rank_all_time_mat", RANK_FIELDS, key="rank_key"))
+        sinks_month.append(ReplaceSqlSink(out_month.with_suffix(".sql"), "venue_rank_monthly_mat", RANK_FIELDS, key="rank_key"))
+
+    # Cada acumulado cuenta en 4 ámbitos: (todas|su ciudad) x (todos|su tipo)
+    p1 = type_code[pi] if len(pi) else np.zeros(0, dtype=np.int64)
+    combos = [(np.zeros_like(ci), np.zeros_like(p1)), (ci, np.zeros_like(p1)), (np.zeros_like(ci), p1), (ci, p1)]
+    # Sin ciudad (o sin tipo) conocido solo entra en "todas" ("todos"); evita duplicar el ámbito 0
+    valid = [np.ones(len(vi), dtype=bool), ci > 0, p1 > 0, (ci > 0) & (p1 > 0)]
+
+    def emit(out: FanOut, period_idx: np.ndarray, period_names: list[str]) -> int:
+        per = period_idx[mi]
+        sc = np.concatenate([(per[v] * n_c + c[v]) * n_p + p[v] for (c, p), v in zip(combos, valid)])
+        vv = np.concatenate([vi[v] for v in valid])
+        ss = np.concatenate([s[v] for v in valid])
+        nn = np.concatenate([n[v] for v in valid])
+        if not len(vv):
+            return 0
+        g_scope, g_venue, gn, avg, bayes, rank = rank_scopes(sc, vv, ss, nn, args.min_votes, args.top)
+        for k in range(len(g_scope)):
+            sk = int(g_scope[k])
+            period = period_names[sk // (n_c * n_p)]
+            city_scope = city_names[(sk // n_p) % n_c]
+            ptype = type_names[sk % n_p]
+            vid = venues[int(g_venue[k])]
+            name, city = info.get(vid, ("", ""))
+            out.write(
+                {
+                    "rank_key": f"{period}|{city_scope}|{ptype}|{vid}",
+                    "period": period,
+                    "city_scope": city_scope,
+                    "product_type_id": ptype,
+                    "rank": int(rank[k]),
+                    "venue_id": vid,
+                    "name": name,
+                    "city": city,
+                    "ratings_count": int(gn[k]),
+                    "avg_score": round(float(avg[k]), 4),
+                    "bayes_score": round(float(bayes[k]), 4),
+                    "generated_at": generated_at,
+                }
+            )
+        return len(g_scope)
+
+    with FanOut(sinks_all) as out:
+        n_all = emit(out, np.zeros(len(months) or 1, dtype=np.int64), ["all_time"])
+    with FanOut(sinks_month) as out:
+        n_month = emit(out, np.arange(len(months), dtype=np.int64), months)
+    t2 = time.perf_counter()
+
+    print(f"Marca de agua: {wm or '-'} -> {new_wm or '-'} | nuevos: {added} | editados: {edited} ({t1 - t0:.2f}s)")
+    print(f"Acumulados: {len(vi)} | venues: {len(venues)} | ciudades: {len(cities)} | tipos: {len(ptypes)} | meses: {len(months)}")
+    print(f"Filas de ranking: all-time {n_all}, mensual {n_month} ({t2 - t1:.2f}s)")
+    for s_ in sinks_all + sinks_month:
+        print(f"Generado: {s_.path} ({s_.kept})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import argparse
+import csv
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+from coord_store import CoordStore
+from textnorm import CITY_BOUNDS, in_city_bounds, norm, split_city_parts
+from osm_index import (
+    OSM_IMPORT,
+    OsmAddressIndex,
+    OsmGazetteer,
+    OsmSpatialIndex,
+    OsmVenue,
+    haversine_m,
+    name_similarity,
+)
+from sinks import CsvSink, FanOut
+
+# Revalida en bloque coordenadas que ya tenemos, sin red.
+#
+# Para cada venue con lat/lon busca la mejor evidencia local en el export OSM
+# (misma dirección, mismo nombre) y mide cuánto se separa el punto guardado.
+# Solo los que se desvían más de --threshold-m van a la cola de re-geocodificación,
+# que sale con las mismas columnas que la entrada: sirve tal cual como --input
+# de geocode_by_address.py / geocode_premiados.py. Con --store, además, se caduca el
+# resultado guardado de cada venue encolado (CoordStore.expire); si no, la huella sigue
+# siendo la misma y el geocoder lo reaprovecharía sin volver a consultarlo.
+
+BASE_DIR = Path(__file__).resolve().parent
+
+DRIFT_THRESHOLD_M = 150.0
+# Más allá de esto un local con el mismo nombre es otro (cadenas, homónimos)
+MAX_EVIDENCE_KM = 10.0
+# Similitud mínima para considerar que el local de esa dirección es el nuestro
+SAME_NAME_SIM = 0.8
+
+# Orden de preferencia de la evidencia
+EV_NAME_ADDR = "name_addr"
+EV_ADDR = "addr"
+EV_NAME = "name"
+
+REPORT_FIELDS = [
+    "venue_id", "name", "city", "address_text", "lat", "lon",
+    "evidence", "ev_lat", "ev_lon", "drift_m", "osm_label",
+]
+
+
+@dataclass
+class Evidence:
+    kind: str
+    venue: OsmVenue
+    dist_m: float
+
+
+def _coords(row: dict) -> Optional[tuple[float, float]]:
+    try:
+        return float(row.get("lat") or ""), float(row.get("lon") or "")
+    except ValueError:
+        return None
+
+
+def _in_city(v: OsmVenue, city: str, city_parts: set[str]) -> bool:
+    if not city_parts:
+        return True
+    if v.addr_city:
+        return norm(v.addr_city) in city_parts
+    # Sin addr:city (lo habitual en el export), decide el bbox del municipio si lo conocemos.
+    # Si no, no sabemos: mejor sin evidencia que comparar con un homónimo de otro pueblo
+    if norm(city) not in CITY_BOUNDS:
+        return False
+    return in_city_bounds(city, v.lat, v.lon)
+
+
+def _nearest(cands: list[OsmVenue], lat: float, lon: float, max_m: float) -> Optional[tuple[OsmVenue, float]]:
+    best = None
+    for v in cands:
+        d = haversine_m(lat, lon, v.lat, v.lon)
+        if d <= max_m and (best is None or d < best[1]):
+            best = (v, d)
+    return best
+
+
+class DriftChecker:
+    def __init__(
+        self,
+        gazetteer: OsmGazetteer,
+        addresses: OsmAddressIndex,
+        spatial: OsmSpatialIndex,
+        threshold_m: float = DRIFT_THRESHOLD_M,
+        max_evidence_km: float = MAX_EVIDENCE_KM,
+    ):
+        self.gazetteer = gazetteer
+        self.addresses = addresses
+        self.spatial = spatial
+        self.threshold_m = threshold_m
+        self.max_m = max_evidence_km * 1000.0
+
+    def evidence(self, name: str, city: str, address: str, lat: float, lon: float) -> Optional[Evidence]:
+        """
+        Mejor evidencia local: local con nuestro nombre en nuestra dirección >
+        cualquier local en nuestra dirección > local más cercano con nuestro nombre.
+        """
+        parts = {norm(p) for p in split_city_parts(city)}
+
+        at_addr = [v for v in self.addresses.lookup(address) if _in_city(v, city, parts)]
+        if at_addr:
+            named = [v for v in at_addr if name_similarity(name, v.name) >= SAME_NAME_SIM]
+            hit = _nearest(named, lat, lon, self.max_m)
+            if hit is not None:
+                return Evidence(EV_NAME_ADDR, *hit)
+            hit = _nearest(at_addr, lat, lon, self.max_m)
+            if hit is not None:
+                return Evidence(EV_ADDR, *hit)
+
+        same_name = [v for v in self.gazetteer.by_name.get(norm(name), ()) if _in_city(v, city, parts)]
+        hit = _nearest(same_name, lat, lon, self.max_m)
+        if hit is not None:
+            return Evidence(EV_NAME, *hit)
+        return None
+
+    def check(self, row: dict, lat: float, lon: float) -> tuple[Optional[Evidence], bool]:
+        """(evidencia, drift). Sin evidencia no hay drift: no sabemos más que el punto guardado."""
+        name = (row.get("name") or "").strip()
+        ev = self.evidence(name, (row.get("city") or "").strip(), (row.get("address_text") or "").strip(), lat, lon)
+        if ev is None or ev.dist_m <= self.threshold_m:
+            return ev, False
+        if ev.kind == EV_NAME and self.spatial.plausibility(name, lat, lon).accepted:
+            # Hay otro local con nuestro nombre junto al punto guardado: el lejano es un homónimo
+            return ev, False
+        return ev, True
+
+
+def load_coord_files(paths: list[Path]) -> dict[str, tuple[float, float]]:
+    """venue_id -> (lat, lon) de salidas de los geocoders; el último fichero manda."""
+    out: dict[str, tuple[float, float]] = {}
+    for p in paths:
+        with p.open("r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                vid = (row.get("venue_id") or "").strip()
+                c = _coords(row)
+                if vid and c is not None:
+                    out[vid] = c
+    return out
+
+
+def iter_venues(path: Path) -> Iterator[dict]:
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Detecta coordenadas guardadas que se han desviado de la evidencia OSM local")
+    ap.add_argument("--input", default=str(BASE_DIR / "venues_need_coords_VLC_ALC_FIX.csv"))
+    ap.add_argument("--coords", nargs="*", default=[], help="Salidas de geocoder (venue_id, lat, lon) si la entrada no trae coords")
+    ap.add_argument("--store", default="", help="SQLite de coord_store.py como fuente de coords; caduca los venues encolados")
+    ap.add_argument("--osm", default=str(OSM_IMPORT), help="Export OSM (salida de prep_overpass_csv.py)")
+    ap.add_argument("--threshold-m", type=float, default=DRIFT_THRESHOLD_M)
+    ap.add_argument("--max-evidence-km", type=float, default=MAX_EVIDENCE_KM)
+    ap.add_argument("--out", default="coords_drift_report.csv")
+    ap.add_argument("--out-queue", default="", help="Venues a re-geocodificar (por defecto <input>_drift.csv)")
+    args = ap.parse_args()
+
+    in_path = Path(args.input)
+    queue_path = Path(args.out_queue) if args.out_queue else in_path.with_name(f"{in_path.stem}_drift.csv")
+
+    # Prioridad de coords: la propia fila > --coords > --store
+    known = load_coord_files([Path(p) for p in args.coords])
+    store = CoordStore(args.store) if args.store else None
+
+    checker = DriftChecker(
+        OsmGazetteer.from_csv(args.osm),
+        OsmAddressIndex.from_csv(args.osm),
+        OsmSpatialIndex.from_csv(args.osm),
+        threshold_m=args.threshold_m,
+        max_evidence_km=args.max_evidence_km,
+    )
+
+    with in_path.open("r", encoding="utf-8-sig", newline="") as f:
+        fieldnames = csv.DictReader(f).fieldnames or []
+
+    total = no_coords = no_evidence = ok = drift = 0
+    report = CsvSink(args.out, REPORT_FIELDS)
+    queue = CsvSink(queue_path, fieldnames)
+    with FanOut([report, queue]) as out:
+        for row in iter_venues(in_path):
+            total += 1
+            vid = (row.get("venue_id") or "").strip()
+            c = _coords(row) or known.get(vid)
+            if c is None and store is not None:
+                sc = store.best(vid)
+                if sc is not None and sc.lat is not None and sc.lon is not None:
+                    c = (sc.lat, sc.lon)
+            if c is None:
+                no_coords += 1
+                continue
+
+            lat, lon = c
+            ev, is_drift = checker.check(row, lat, lon)
+            if ev is None:
+                no_evidence += 1
+                continue
+            if not is_drift:
+                ok += 1
+                continue
+
+            drift += 1
+            if store is not None:
+                store.expire(vid, commit=False)
+            print(f"[DRIFT] {row.get('name')} ({row.get('city')}) {ev.kind} {ev.dist_m:.0f}m -> {ev.venue.label}")
+            out.write(
+                {
+                    **row,
+                    "lat": f"{lat:.7f}",
+                    "lon": f"{lon:.7f}",
+                    "evidence": ev.kind,
+                    "ev_lat": f"{ev.venue.lat:.7f}",
+                    "ev_lon": f"{ev.venue.lon:.7f}",
+                    "drift_m": f"{ev.dist_m:.0f}",
+                    "osm_label": ev.venue.label,
+                }
+            )
+
+    if store is not None:
+        store.close()
+
+    print(f"Filas: {total}")
+    print(f"  sin coords: {no_coords}")
+    print(f"  sin evidencia local: {no_evidence}")
+    print(f"  dentro de {args.threshold_m:g}m: {ok}")
+    print(f"  con drift: {drift}")
+    print(f"Generado: {args.out} (rows={report.kept})")
+    print(f"Generado: {queue_path} (rows={queue.kept})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import Iterable, Optional
+
+from textnorm import CITY_BOUNDS, base_city, in_city_bounds, looks_plausible, norm, split_city_parts
+from osm_index import haversine_m, name_similarity, name_tokens
+
+# Candidatos alternativos para las filas REVIEW/MISS de los geocoders.
+#
+# Las respuestas de Nominatim/Photon ya pagadas traen varios resultados (limit>1 cuesta
+# la misma llamada); el primero decide el hit y el resto se guarda aquí junto con los
+# locales OSM homónimos (gazetteer por nombre, sin exigir ciudad) y los de nombre
+# parecido alrededor del hit rechazado (en un MISS, dentro del bbox de la ciudad). Se
+# puntúan, se deduplican y salen los TOP_K mejores a un CSV lateral
+# (<review>_candidates.csv), una fila por candidato:
+#
+#   venue_id, rank, score, source, provider, lat, lon, dist_m, name_sim, in_city, label, ...
+#
+# dist_m es la distancia al hit rechazado o, en un MISS, al centro del bbox de la
+# ciudad (vacío si no la conocemos). Aceptar un candidato es copiar su fila al
+# import manual del store, sin volver a la red:
+#
+#   python coord_store.py import --status MANUAL elegidos.csv
+
+TOP_K = 5
+
+# Radio alrededor del hit rechazado en el que buscamos locales OSM con nombre parecido
+OSM_NEAR_M = 1500.0
+OSM_MIN_SIM = 0.5
+# Máximo de locales OSM que pasan a puntuarse (cadenas y nombres genéricos dan cientos)
+OSM_MAX = 20
+
+# Dos candidatos de distinta fuente a menos de esto se confirman entre sí
+AGREE_M = 60.0
+# Mismo punto: se queda el primero visto (orden de la cascada)
+DEDUP_M = 15.0
+
+CANDIDATE_FIELDS = [
+    "venue_id",
+    "rank",
+    "score",
+    "source",
+    "provider",
+    "lat",
+    "lon",
+    "dist_m",
+    "name_sim",
+    "in_city",
+    "label",
+    "osm_ref",
+    "query_used",
+]
+
+
+@dataclass
+class Candidate:
+    lat: float
+    lon: float
+    label: str
+    provider: str
+    query_used: str = ""
+    # "node/123" si el resultado identifica el objeto OSM (Nominatim, Photon, export local)
+    osm_ref: str = ""
+    # Nombre y addr_city del local cuando los sabemos (OSM); si no, se compara el label
+    name: str = ""
+    city: str = ""
+    name_sim: float = 0.0
+    in_city: bool = False
+    dist_m: Optional[float] = None
+    score: float = 0.0
+
+    @property
+    def source(self) -> str:
+        return "osm" if self.provider == "osm_local" else "provider"
+
+
+def from_osm(v) -> Candidate:
+    ref = f"{v.osm_type}/{v.osm_id}"
+    return Candidate(v.lat, v.lon, v.label, "osm_local", f"OSM:{ref}", ref, v.name, v.addr_city)
+
+
+def city_area(city: str) -> Optional[tuple[float, float, float]]:
+    """(lat, lon, radio_m) del círculo que cubre el bbox de la ciudad, si lo conocemos."""
+    b = CITY_BOUNDS.get(norm(base_city(city) or city))
+    if b is None:
+        return None
+    lat, lon = (b[0] + b[1]) / 2, (b[2] + b[3]) / 2
+    return lat, lon, haversine_m(lat, lon, b[1], b[3])
+
+
+def osm_matches(name: str, city: str, hit: Optional[tuple[float, float]], gazetteer=None, osm_ix=None) -> list[Candidate]:
+    """
+    Locales OSM: mismo nombre normalizado (cualquier ciudad) y parecidos cerca del hit
+    o en la ciudad; como mucho OSM_MAX, los de nombre más parecido primero.
+    """
+    out = [from_osm(v) for v in (gazetteer.by_name.get(norm(name)) or [])[:OSM_MAX]] if gazetteer is not None else []
+    area = (hit[0], hit[1], OSM_NEAR_M) if hit is not None else city_area(city)
+    if osm_ix is None or area is None:
+        return out
+    # En un MISS se recorre toda la ciudad: quick_ratio (cota superior del ratio de
+    # difflib, con seq2 cacheada) descarta casi todo antes de name_similarity
+    toks = set(name_tokens(name))
+    sm = SequenceMatcher(None, "", " ".join(name_tokens(name)))
+    near = []
+    for v, d in osm_ix.nearby(*area):
+        vt = name_tokens(v.name)
+        sm.set_seq1(" ".join(vt))
+        if not (toks & set(vt) or sm.quick_ratio() >= OSM_MIN_SIM):
+            continue
+        sim = name_similarity(name, v.name)
+        if sim >= OSM_MIN_SIM:
+            near.append((-sim, d, v.osm_type, v.osm_id, v))
+    near.sort(key=lambda t: t[:4])
+    return out + [from_osm(t[-1]) for t in near[: OSM_MAX - len(out)]]
+
+
+def _in_city(c: Candidate, city: str) -> bool:
+    base = base_city(city) or city
+    if not in_city_bounds(norm(base), c.lat, c.lon):
+        return False
+    if c.source == "osm":
+        # El export casi nunca trae addr_city: sin él, vale el bbox
+        return not c.city or norm(c.city) in {norm(p) for p in split_city_parts(city)}
+    return looks_plausible(city, c.label)
+
+
+def rank_candidates(
+    name: str,
+    city: str,
+    seen: Iterable[Candidate],
+    hit: Optional[tuple[float, float]] = None,
+    gazetteer=None,
+    osm_ix=None,
+    k: int = TOP_K,
+) -> list[Candidate]:
+    """
+    Puntúa y ordena los candidatos de un venue. `seen` son los resultados de proveedor
+    en orden de cascada; `hit` el punto rechazado (si lo hubo).
+    score = 0.55 nombre + 0.30 ciudad + 0.15 confirmado por otra fuente a < AGREE_M.
+    """
+    area = city_area(city)
+    anchor = hit or (area[:2] if area is not None else None)
+    pool: list[Candidate] = []
+    refs: dict[str, int] = {}
+    # El mismo objeto OSM devuelto por el proveedor y por el export: una fila, ya confirmada
+    confirmed: set[int] = set()
+    for c in list(seen) + osm_matches(name, city, hit, gazetteer, osm_ix):
+        j = refs.get(c.osm_ref) if c.osm_ref else None
+        if j is not None:
+            if pool[j].source != c.source:
+                confirmed.add(j)
+            continue
+        if any(p.source == c.source and haversine_m(p.lat, p.lon, c.lat, c.lon) < DEDUP_M for p in pool):
+            continue
+        if c.osm_ref:
+            refs[c.osm_ref] = len(pool)
+        pool.append(c)
+
+    for i, c in enumerate(pool):
+        c.name_sim = name_similarity(name, c.name or c.label)
+        c.in_city = _in_city(c, city)
+        c.dist_m = None if anchor is None else haversine_m(anchor[0], anchor[1], c.lat, c.lon)
+        agree = i in confirmed or any(
+            p.source != c.source and haversine_m(p.lat, p.lon, c.lat, c.lon) < AGREE_M for p in pool
+        )
+        c.score = 0.55 * c.name_sim + 0.30 * c.in_city + 0.15 * agree
+
+    # A igualdad de score, el más cercano y después el orden de llegada
+    order = sorted(
+        range(len(pool)),
+        key=lambda i: (-round(pool[i].score, 6), math.inf if pool[i].dist_m is None else pool[i].dist_m, i),
+    )
+    return [pool[i] for i in order[:k]]
+
+
+def candidate_rows(venue_id: str, cands: list[Candidate]) -> list[dict]:
+    return [
+        {
+            "venue_id": venue_id,
+            "rank": rank,
+            "score": f"{c.score:.3f}",
+            "source": c.source,
+            "provider": c.provider,
+            "lat": f"{c.lat:.7f}",
+            "lon": f"{c.lon:.7f}",
+            "dist_m": "" if c.dist_m is None else f"{c.dist_m:.0f}",
+            "name_sim": f"{c.name_sim:.2f}",
+            "in_city": int(c.in_city),
+            "label": c.label,
+            "osm_ref": c.osm_ref,
+            "query_used": c.query_used,
+        }
+        for rank, c in enumerate(cands, start=1)
+    ]
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import argparse
+import bisect
+import csv
+import hashlib
+import inspect
+import json
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+from textnorm import norm
+
+# Índice de búsqueda por nombre/ciudad para resolver la búsqueda en local (sin ilike
+# por tecla contra Supabase).
+#
+# - Tokens normalizados con el mismo norm() de los geocoders (sin acentos, minúsculas).
+# - Lista ordenada de tokens: búsqueda por prefijo con bisect ("rus" -> "russafa").
+# - Trigramas de token -> tokens: tolerancia a typos ("rusafa", "pepika").
+# - Postings token -> docs, separadas para nombre y ciudad (la ciudad puntúa menos).
+#
+# El fichero JSON guarda una huella por documento; al regenerar con --base solo se
+# re-tokenizan los venues nuevos/cambiados y los borrados dejan hueco (se compacta
+# cuando los huecos pasan de COMPACT_RATIO).
+#
+# "norm" lleva NORM_VERSION, huella del código de norm() y tokenize(): si cambia la
+# normalización, --base se descarta (sus tokens ya no valen) y el port de la app puede
+# detectar que su normalizador no es el del índice.
+
+FORMAT_VERSION = 1
+COMPACT_RATIO = 0.2
+
+SCORE_EXACT = 1.0
+SCORE_PREFIX = 0.8
+SCORE_FUZZY = 0.6
+CITY_WEIGHT = 0.7
+FUZZY_MIN_DICE = 0.5
+FUZZY_MIN_LEN = 3
+
+
+def tokenize(s: str) -> list[str]:
+    return [t for t in re.split(r"[^a-z0-9ñ]+", norm(s)) if t]
+
+
+# Calculado sobre el código (no a mano): no hay que acordarse de subirla
+NORM_VERSION = "textnorm.norm@" + hashlib.sha1(
+    (inspect.getsource(norm) + inspect.getsource(tokenize)).encode("utf-8")
+).hexdigest()[:10]
+
+
+def trigrams(token: str) -> set[str]:
+    t = f"  {token} "
+    return {t[i : i + 3] for i in range(len(t) - 2)}
+
+
+def doc_hash(name: str, city: str) -> str:
+    return hashlib.sha1(f"{name}\0{city}".encode("utf-8")).hexdigest()[:10]
+
+
+class SearchIndex:
+    def __init__(self):
+        # Slots estables: un venue borrado deja None hasta la siguiente compactación
+        self.docs: list[Optional[tuple[str, str, str, str]]] = []  # (venue_id, name, city, hash)
+        self.slot_by_id: dict[str, int] = {}
+        self.name_post: dict[str, set[int]] = {}
+        self.city_post: dict[str, set[int]] = {}
+        self._tokens: Optional[list[str]] = None
+        self._tri: Optional[dict[str, list[int]]] = None
+
+    # --- construcción ---
+
+    def _index(self, slot: int, name: str, city: str, sign: int) -> None:
+        for post, text in ((self.name_post, name), (self.city_post, city)):
+            for t in set(tokenize(text)):
+                if sign > 0:
+                    post.setdefault(t, set()).add(slot)
+                else:
+                    s = post.get(t)
+                    if s is not None:
+                        s.discard(slot)
+                        if not s:
+                            del post[t]
+        self._tokens = self._tri = None
+
+    def upsert(self, venue_id: str, name: str, city: str) -> bool:
+        """True si el documento era nuevo o ha cambiado."""
+        h = doc_hash(name, city)
+        slot = self.slot_by_id.get(venue_id)
+        if slot is not None:
+            old = self.docs[slot]
+            if old[3] == h:
+                return False
+            self._index(slot, old[1], old[2], -1)
+        else:
+            slot = len(self.docs)
+            self.docs.append(None)
+            self.slot_by_id[venue_id] = slot
+        self.docs[slot] = (venue_id, name, city, h)
+        self._index(slot, name, city, +1)
+        return True
+
+    def remove(self, venue_id: str) -> None:
+        slot = self.slot_by_id.pop(venue_id, None)
+        if slot is None:
+            return
+        _, name, city, _ = self.docs[slot]
+        self._index(slot, name, city, -1)
+        self.docs[slot] = None
+
+    def holes(self) -> int:
+        return len(self.docs) - len(self.slot_by_id)
+
+    def compact(self) -> None:
+        live = [d for d in self.docs if d is not None]
+        fresh = SearchIndex()
+        for vid, name, city, _ in live:
+            fresh.upsert(vid, name, city)
+        self.__dict__.update(fresh.__dict__)
+
+    def _ensure_lookup(self) -> None:
+        if self._tokens is not None:
+            return
+        self._tokens = sorted(set(self.name_post) | set(self.city_post))
+        tri: dict[str, list[int]] = {}
+        for i, t in enumerate(self._tokens):
+            for g in trigrams(t):
+                tri.setdefault(g, []).append(i)
+        self._tri = tri
+
+    # --- búsqueda (referencia para el port en la app) ---
+
+    def _token_matches(self, q: str) -> dict[str, float]:
+        """token del índice -> score de match con el token de la query."""
+        self._ensure_lookup()
+        out: dict[str, float] = {}
+        i = bisect.bisect_left(self._tokens, q)
+        while i < len(self._tokens) and self._tokens[i].startswith(q):
+            t = self._tokens[i]
+            out[t] = SCORE_EXACT if t == q else SCORE_PREFIX
+            i += 1
+        if len(q) >= FUZZY_MIN_LEN:
+            qg = trigrams(q)
+            shared: Counter = Counter()
+            for g in qg:
+                shared.update(self._tri.get(g, ()))
+            for ti, n in shared.items():
+                t = self._tokens[ti]
+                dice = 2 * n / (len(qg) + len(trigrams(t)))
+                if dice >= FUZZY_MIN_DICE and t not in out:
+                    out[t] = SCORE_FUZZY * dice
+        return out
+
+    def search(self, query: str, limit: int = 20) -> list[tuple[float, str, str, str]]:
+        qtoks = tokenize(query)
+        if not qtoks:
+            return []
+        per_token: list[dict[int, float]] = []
+        for q in qtoks:
+            scores: dict[int, float] = {}
+            for t, sc in self._token_matches(q).items():
+                for slot in self.name_post.get(t, ()):
+                    scores[slot] = max(scores.get(slot, 0.0), sc)
+                for slot in self.city_post.get(t, ()):
+                    scores[slot] = max(scores.get(slot, 0.0), sc * CITY_WEIGHT)
+            per_token.append(scores)
+
+        # Todos los tokens de la query deben casar (AND); si nada cumple, OR
+        common = set(per_token[0])
+        for s in per_token[1:]:
+            common &= set(s)
+        cand = common or set().union(*per_token)
+        # Empates por nombre e id: el orden no depende de los slots (build completo == incremental)
+        ranked = sorted(cand, key=lambda d: (-sum(s.get(d, 0.0) for s in per_token), self.docs[d][1], self.docs[d][0]))
+        out = []
+        for d in ranked[:limit]:
+            vid, name, city, _ = self.docs[d]
+            out.append((sum(s.get(d, 0.0) for s in per_token), vid, name, city))
+        return out
+
+    # --- serialización ---
+
+    def to_json(self) -> dict:
+        """
+        docs: [venue_id, name, city, hash] o null (hueco)
+        tokens: ordenados; name_post/city_post: por token, slots en delta (primero absoluto)
+        trigrams: trigrama -> índices de token en delta
+        """
+        self._ensure_lookup()
+
+        def delta(xs) -> list[int]:
+            xs = sorted(xs)
+            return [xs[0]] + [b - a for a, b in zip(xs, xs[1:])] if xs else []
+
+        return {
+            "version": FORMAT_VERSION,
+            "norm": NORM_VERSION,
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "docs": [list(d) if d is not None else None for d in self.docs],
+            "tokens": self._tokens,
+            "name_post": [delta(self.name_post.get(t, ())) for t in self._tokens],
+            "city_post": [delta(self.city_post.get(t, ())) for t in self._tokens],
+            "trigrams": {g: delta(ix) for g, ix in sorted(self._tri.items())},
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "SearchIndex":
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Versión de índice no soportada: {data.get('version')}")
+        idx = cls()
+        idx.docs = [tuple(d) if d is not None else None for d in data["docs"]]
+        idx.slot_by_id = {d[0]: i for i, d in enumerate(idx.docs) if d is not None}
+
+        def undelta(xs: list[int]) -> set[int]:
+            out, acc = set(), 0
+            for i, x in enumerate(xs):
+                acc = x if i == 0 else acc + x
+                out.add(acc)
+            return out
+
+        for t, np_, cp in zip(data["tokens"], data["name_post"], data["city_post"]):
+            if np_:
+                idx.name_post[t] = undelta(np_)
+            if cp:
+                idx.city_post[t] = undelta(cp)
+        return idx
+
+
+def read_venues(path: Path) -> dict[str, tuple[str, str]]:
+    out: dict[str, tuple[str, str]] = {}
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            vid = (row.get("venue_id") or row.get("id") or "").strip()
+            name = (row.get("name") or "").strip()
+            if vid and name:
+                out[vid] = (name, (row.get("city") or "").strip())
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Construye el índice local de búsqueda por nombre/ciudad")
+    ap.add_argument("--venues", required=False, default="", help="Export de venues (id/venue_id, name, city)")
+    ap.add_argument("--base", default="", help="Índice anterior: solo se re-indexan los venues cambiados")
+    ap.add_argument("--out", default="venues_search_index.json")
+    ap.add_argument("--query", default="", help="Prueba una búsqueda contra el índice (--out o --base)")
+    ap.add_argument("--limit", type=int, default=10)
+    args = ap.parse_args()
+
+    if args.query and not args.venues:
+        src = Path(args.base or args.out)
+        idx = SearchIndex.from_json(json.loads(src.read_text(encoding="utf-8")))
+        t0 = time.perf_counter()
+        hits = idx.search(args.query, args.limit)
+        dt = (time.perf_counter() - t0) * 1000
+        for sc, vid, name, city in hits:
+            print(f"{sc:5.2f}  {name} ({city})  {vid}")
+        print(f"{len(hits)} resultados en {dt:.1f} ms")
+        return
+    if not args.venues:
+        ap.error("Falta --venues")
+
+    t0 = time.perf_counter()
+    venues = read_venues(Path(args.venues))
+    idx = SearchIndex()
+    if args.base and Path(args.base).exists():
+        base = json.loads(Path(args.base).read_text(encoding="utf-8"))
+        if base.get("norm") == NORM_VERSION:
+            idx = SearchIndex.from_json(base)
+        else:
+            print(f"[WARN] --base con otra normalización ({base.get('norm')}); se re-indexa todo")
+
+    removed = [vid for vid in idx.slot_by_id if vid not in venues]
+    for vid in removed:
+        idx.remove(vid)
+    changed = sum(idx.upsert(vid, name, city) for vid, (name, city) in venues.items())
+    if idx.docs and idx.holes() / len(idx.docs) > COMPACT_RATIO:
+        idx.compact()
+
+    data = idx.to_json()
+    out = Path(args.out)
+    tmp = out.with_name(out.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    tmp.replace(out)
+    dt = time.perf_counter() - t0
+
+    print(f"Venues: {len(venues)} | cambiados/nuevos: {changed} | borrados: {len(removed)} | huecos: {idx.holes()}")
+    print(f"Tokens: {len(data['tokens'])} | trigramas: {len(data['trigrams'])} | {dt:.2f}s")
+    print(f"Generado: {out} ({out.stat().st_size / 1024:.1f} KB)")
+
+    if args.query:
+        for sc, vid, name, city in idx.search(args.query, args.limit):
+            print(f"{sc:5.2f}  {name} ({city})  {vid}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import csv
+import json
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+RowFilter = Callable[[dict], bool]
+
+
+def _all(row: dict) -> bool:
+    return True
+
+
+class Sink:
+    """
+    Proyección de un stream de filas a un fichero: filtro + columnas propias.
+    Escribe incrementalmente en <path>.tmp y solo al cerrar sin errores hace el
+    rename atómico sobre <path>; si algo falla, el fichero anterior queda intacto.
+    Siempre UTF-8 sin BOM.
+    """
+
+    def __init__(self, path: Path | str, columns: Optional[list[str]] = None, where: RowFilter = _all):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.columns = columns
+        self.where = where
+        self.kept = 0
+        self._f = None
+
+    def open(self) -> None:
+        self._f = self.tmp_path.open("w", encoding="utf-8", newline="")
+        self._begin()
+
+    def write(self, row: dict) -> None:
+        if not self.where(row):
+            return
+        self._write(self._project(row))
+        self.kept += 1
+
+    def commit(self) -> None:
+        self._end()
+        self._f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        if self._f is not None and not self._f.closed:
+            self._f.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+    def _project(self, row: dict) -> dict:
+        if self.columns is None:
+            return row
+        return {k: ("" if row.get(k) is None else row.get(k)) for k in self.columns}
+
+    # Hooks de formato
+    def _begin(self) -> None:
+        pass
+
+    def _write(self, row: dict) -> None:
+        raise NotImplementedError
+
+    def _end(self) -> None:
+        pass
+
+
+class CsvSink(Sink):
+    def _begin(self) -> None:
+        if self.columns is None:
+            raise ValueError(f"CsvSink necesita columnas: {self.path}")
+        self._w = csv.DictWriter(self._f, fieldnames=self.columns, extrasaction="ignore")
+        self._w.writeheader()
+
+    def _write(self, row: dict) -> None:
+        self._w.writerow(row)
+
+
+class JsonlSink(Sink):
+    def _write(self, row: dict) -> None:
+        self._f.write(json.dumps(row, ensure_ascii=False))
+        self._f.write("\n")
+
+
+def sql_literal(v) -> str:
+    if v is None or v == "":
+        return "NULL"
+    if isinstance(v, (int, float)):
+        return repr(v)
+    return "'" + str(v).replace("'", "''") + "'"
+
+
+class SqlSink(Sink):
+    """
+    INSERT ... ON CONFLICT (key) DO UPDATE por fila, en una transacción.
+    Pensado para pegar en el SQL editor de Supabase o pasar a psql.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        table: str,
+        columns: list[str],
+        key: str = "venue_id",
+        where: RowFilter = _all,
+    ):
+        super().__init__(path, columns=columns, where=where)
+        self.table = table
+        self.key = key
+
+    def _begin(self) -> None:
+        self._f.write("BEGIN;\n")
+
+    def _write(self, row: dict) -> None:
+        cols = ", ".join(self.columns)
+        vals = ", ".join(sql_literal(row[c]) for c in self.columns)
+        upd = ", ".join(f"{c} = EXCLUDED.{c}" for c in self.columns if c != self.key)
+        self._f.write(f"INSERT INTO {self.table} ({cols}) VALUES ({vals}) ON CONFLICT ({self.key}) DO UPDATE SET {upd};\n")
+
+    def _end(self) -> None:
+        self._f.write("COMMIT;\n")
+
+
+class ReplaceSqlSink(SqlSink):
+    """Como SqlSink, pero vacía la tabla al empezar: para tablas que se publican completas."""
+
+    def _begin(self) -> None:
+        super()._begin()
+        self._f.write(f"DELETE FROM {self.table};\n")
+
+
+class FanOut:
+    """
+    Reparte un único stream de resultados entre varios sinks en una sola pasada.
+
+        with FanOut([CsvSink(...), JsonlSink(...)]) as out:
+            for row in results:
+                out.write(row)
+
+    Si el bloque termina con excepción, ningún sink sustituye su fichero.
+    """
+
+    def __init__(self, sinks: list[Sink]):
+        self.sinks = sinks
+
+    def __enter__(self) -> "FanOut":
+        for s in self.sinks:
+            s.open()
+        return self
+
+    def write(self, row: dict) -> None:
+        for s in self.sinks:
+            s.write(row)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            for s in self.sinks:
+                s.abort()
+            return
+        for s in self.sinks:
+            s.commit()
+
+    def summary(self) -> list[tuple[Path, int]]:
+        return [(s.path, s.kept) for s in self.sinks]
+
+
+def has_coords(row: dict) -> bool:
+    return bool(str(row.get("venue_id") or "").strip() and str(row.get("lat") or "").strip() and str(row.get("lon") or "").strip())
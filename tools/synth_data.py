@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import random
+import urllib.parse
+import uuid
+from pathlib import Path
+from typing import Iterator
+
+# Generador de datos sintéticos para probar las etapas offline a escala (hasta ~10M filas).
+#
+#   python synth_data.py overpass --rows 1000000 --out synth_overpass.csv
+#   python synth_data.py venues --rows 100000 --with-coords --out synth_venues.csv
+#
+# Mismo --seed = mismo fichero byte a byte (bench_stages.py compara checksums).
+# Mezcla nombres/direcciones valencianos y castellanos, duplicados (mismo local con
+# otro id, variantes de nombre y jitter de coordenadas) y filas rotas que las etapas
+# deben tolerar: sin nombre, coords vacías o no numéricas, lat/lon cruzados, 0,0...
+
+OVERPASS_FIELDS = [
+    "@type", "@id", "name", "amenity", "addr:city", "addr:street", "addr:housenumber",
+    "addr:postcode", "website", "phone", "contact:phone", "@lat", "@lon",
+]
+VENUE_FIELDS = ["venue_id", "name", "city", "address_text", "google_maps_url"]
+
+# (ciudad, lat, lon, radio en grados, prefijo CP, peso)
+CITIES = [
+    ("València", 39.4699, -0.3763, 0.045, "460", 30),
+    ("Alicante", 38.3452, -0.4810, 0.035, "030", 12),
+    ("Elche", 38.2669, -0.6984, 0.03, "032", 6),
+    ("Castelló de la Plana", 39.9864, -0.0513, 0.03, "120", 6),
+    ("Torrent", 39.4371, -0.4655, 0.02, "469", 3),
+    ("Gandia", 38.9680, -0.1850, 0.02, "467", 3),
+    ("Benidorm", 38.5411, -0.1225, 0.02, "035", 4),
+    ("Sagunt", 39.6794, -0.2784, 0.02, "465", 2),
+    ("Dénia", 38.8408, 0.1057, 0.02, "037", 2),
+    ("Xàtiva", 38.9904, -0.5185, 0.015, "468", 1),
+    ("Madrid", 40.4168, -3.7038, 0.08, "280", 25),
+    ("Barcelona", 41.3874, 2.1686, 0.06, "080", 20),
+    ("Sevilla", 37.3891, -5.9845, 0.05, "410", 8),
+    ("Zaragoza", 41.6488, -0.8891, 0.04, "500", 5),
+    ("Málaga", 36.7213, -4.4214, 0.04, "290", 6),
+    ("Bilbao", 43.2630, -2.9350, 0.03, "480", 4),
+]
+
+AMENITIES = [("restaurant", 40), ("cafe", 20), ("bar", 25), ("fast_food", 8), ("pub", 4), ("ice_cream", 3)]
+
+NAME_PREFIX = [
+    "Bar", "Restaurante", "Cafetería", "Casa", "Forn", "Horchatería", "Taberna", "Bodega",
+    "Cervecería", "Mesón", "Tasca", "Arrocería", "Pizzeria", "Café", "", "", "",
+]
+NAME_CORE = [
+    "Pepe", "Paco", "Amparo", "Vicent", "Toni", "Rosa", "Carmen", "Manolo", "Pilar", "Xelo",
+    "La Pepica", "El Racó", "La Llotja", "El Molí", "Lola", "La Tasqueta", "El Rincón", "Sol",
+    "La Marina", "El Puerto", "Central", "Mercat", "La Plaça", "El Carme", "Russafa", "Benimaclet",
+    "La Huerta", "L'Horta", "El Cabanyal", "La Albufera", "El Palmar", "Valencia", "Mediterráneo",
+    "La Fallera", "El Tío", "La Tía", "Del Mar", "Montaña", "El Jardí", "Els Arcs", "La Barraca",
+]
+NAME_SUFFIX = ["", "", "", "", " 1915", " II", " Centro", " & Co", " del Mar", " Gastro", " Express"]
+
+STREET_TYPE = ["Carrer de", "Calle", "Avinguda de", "Avenida de", "Plaça de", "Plaza de", "C/", "Avda.", "Passeig de"]
+STREET_NAME = [
+    "Quart", "Ribera", "Colón", "Sueca", "Cuba", "Blasco Ibáñez", "Reina", "Pintor López",
+    "Sant Vicent Màrtir", "Xàtiva", "Alicante", "Jesús", "Pérez Galdós", "Maestro Gozalbo",
+    "la Mar", "Sagunt", "Ruzafa", "Dénia", "Burjassot", "Doctor Clará", "Joaquín Costa",
+    "Obispo Salinas", "Concepción Arenal", "San Roque", "Cabo San Antonio", "Tetuán",
+]
+
+VALENCIAN_CITIES = {c[0] for c in CITIES[:10]}
+
+
+class SynthVenues:
+    """Fuente determinista de locales sintéticos."""
+
+    def __init__(self, seed: int = 42):
+        self.rng = random.Random(seed)
+        self._cities = list(CITIES)
+        self._city_w = [c[5] for c in CITIES]
+        self._amen = [a for a, _ in AMENITIES]
+        self._amen_w = [w for _, w in AMENITIES]
+        self.next_id = 100_000_000
+
+    def name(self) -> str:
+        r = self.rng
+        pre = r.choice(NAME_PREFIX)
+        core = r.choice(NAME_CORE)
+        return f"{pre} {core}{r.choice(NAME_SUFFIX)}".strip()
+
+    def street(self, valencian: bool) -> str:
+        r = self.rng
+        types = STREET_TYPE if valencian else ["Calle", "Avenida de", "Plaza de", "C/", "Avda.", "Paseo de"]
+        return f"{r.choice(types)} {r.choice(STREET_NAME)}"
+
+    def venue(self) -> dict:
+        r = self.rng
+        city, clat, clon, rad, cp, _ = r.choices(self._cities, self._city_w)[0]
+        self.next_id += r.randint(1, 50)
+        # Distribución más densa en el centro, como en la realidad
+        lat = clat + r.gauss(0, rad / 2)
+        lon = clon + r.gauss(0, rad / 2)
+        has_addr = r.random() < 0.35
+        return {
+            "osm_type": "node" if r.random() < 0.85 else "way",
+            "osm_id": str(self.next_id),
+            "name": self.name(),
+            "amenity": r.choices(self._amen, self._amen_w)[0],
+            "city": city,
+            "addr_city": city if has_addr and r.random() < 0.6 else "",
+            "street": self.street(city in VALENCIAN_CITIES),
+            "housenumber": str(r.randint(1, 180)),
+            "has_addr": has_addr,
+            "postcode": f"{cp}{r.randint(1, 30):02d}" if has_addr else "",
+            "website": f"https://www.{uuid.UUID(int=r.getrandbits(128)).hex[:10]}.es" if r.random() < 0.2 else "",
+            "phone": f"+34 96{r.randint(0, 9)} {r.randint(10, 99)} {r.randint(10, 99)} {r.randint(10, 99)}" if r.random() < 0.25 else "",
+            "lat": lat,
+            "lon": lon,
+        }
+
+    def duplicate(self, v: dict) -> dict:
+        """Mismo local visto otra vez: otro id, nombre con otra grafía, unos metros movido."""
+        r = self.rng
+        d = dict(v)
+        self.next_id += r.randint(1, 50)
+        d["osm_id"] = str(self.next_id)
+        k = r.random()
+        if k < 0.3:
+            d["name"] = d["name"].upper()
+        elif k < 0.5:
+            d["name"] = d["name"].replace("à", "a").replace("é", "e").replace("í", "i").replace("ó", "o")
+        elif k < 0.7:
+            d["name"] = f"  {d['name']} "
+        d["lat"] = v["lat"] + r.gauss(0, 0.0002)
+        d["lon"] = v["lon"] + r.gauss(0, 0.0002)
+        return d
+
+    def stream(self, rows: int, dup_rate: float, bad_rate: float) -> Iterator[tuple[dict, str]]:
+        """(venue, defecto) con defecto "" en las filas sanas."""
+        recent: list[dict] = []
+        r = self.rng
+        for _ in range(rows):
+            x = r.random()
+            if recent and x < dup_rate:
+                v = self.duplicate(r.choice(recent))
+            else:
+                v = self.venue()
+                if len(recent) < 1000:
+                    recent.append(v)
+                else:
+                    recent[r.randrange(1000)] = v
+            bad = ""
+            if r.random() < bad_rate:
+                bad = r.choice(["no_name", "no_coords", "bad_coords", "swapped", "zero", "quotes"])
+            yield v, bad
+
+
+def _fmt(x: float) -> str:
+    return f"{x:.7f}"
+
+
+def overpass_row(v: dict, bad: str) -> list[str]:
+    lat, lon = _fmt(v["lat"]), _fmt(v["lon"])
+    name = v["name"]
+    if bad == "no_name":
+        name = ""
+    elif bad == "no_coords":
+        lat = lon = ""
+    elif bad == "bad_coords":
+        lat = "39,47"
+    elif bad == "swapped":
+        lat, lon = lon, lat
+    elif bad == "zero":
+        lat = lon = "0"
+    elif bad == "quotes":
+        name = f'{name}, "el de siempre"'
+    # Unos locales traen phone y otros contact:phone, como en el export real
+    phone = v["phone"]
+    return [
+        v["osm_type"], v["osm_id"], name, v["amenity"], v["addr_city"],
+        v["street"] if v["has_addr"] else "", v["housenumber"] if v["has_addr"] else "",
+        v["postcode"], v["website"], phone if phone and v["osm_id"][-1] < "5" else "",
+        phone if phone and v["osm_id"][-1] >= "5" else "", lat, lon,
+    ]
+
+
+def venue_row(v: dict, bad: str, rng: random.Random, with_coords: bool) -> list[str]:
+    vid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    addr = f"{v['street']}, {v['housenumber']}, {v['postcode'] or ''} {v['city']}".replace(",  ", ", ") if rng.random() < 0.7 else ""
+    name = "" if bad == "no_name" else v["name"]
+    q = urllib.parse.quote_plus(", ".join(p for p in (name, addr, v["city"], "España") if p))
+    gmaps = f"https://www.google.com/maps/search/?api=1&query={q}" if rng.random() < 0.8 else ""
+    row = [vid, name, v["city"], addr, gmaps]
+    if with_coords:
+        lat, lon = _fmt(v["lat"]), _fmt(v["lon"])
+        if bad in ("no_coords", "zero"):
+            lat = lon = ""
+        elif bad == "bad_coords":
+            lat = "n/a"
+        elif bad == "swapped":
+            lat, lon = lon, lat
+        row += [lat, lon]
+    return row
+
+
+def write_csv(path: Path, header: list[str], rows: Iterator[list[str]], chunk: int = 50_000) -> int:
+    n = 0
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        buf: list[list[str]] = []
+        for row in rows:
+            buf.append(row)
+            if len(buf) >= chunk:
+                w.writerows(buf)
+                n += len(buf)
+                buf.clear()
+        w.writerows(buf)
+        n += len(buf)
+    return n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Genera CSVs sintéticos (Overpass / venues_need_coords) para pruebas de escala")
+    ap.add_argument("kind", choices=["overpass", "venues"])
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--dup-rate", type=float, default=0.05, help="Fracción de filas que repiten un local ya visto")
+    ap.add_argument("--bad-rate", type=float, default=0.01, help="Fracción de filas con algún defecto")
+    ap.add_argument("--with-coords", action="store_true", help="venues: añade lat/lon (como venues_need_coords_VLC_ALC_FIX.csv)")
+    ap.add_argument("--out", default="")
+    args = ap.parse_args()
+
+    gen = SynthVenues(args.seed)
+    stream = gen.stream(args.rows, args.dup_rate, args.bad_rate)
+    if args.kind == "overpass":
+        out = Path(args.out or "synth_overpass.csv")
+        n = write_csv(out, OVERPASS_FIELDS, (overpass_row(v, bad) for v, bad in stream))
+    else:
+        out = Path(args.out or "synth_venues.csv")
+        header = VENUE_FIELDS + (["lat", "lon"] if args.with_coords else [])
+        n = write_csv(out, header, (venue_row(v, bad, gen.rng, args.with_coords) for v, bad in stream))
+    print(f"Generado: {out} (rows={n})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los scripts de tools/ se importan entre sí por nombre (sin paquete)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,37 @@
+from collections import Counter
+
+import pytest
+
+from city_facets import CITY_ALIASES, CityCanon, build_facets
+
+STANDALONE = ["Valencia", "València", "Alicante", "Elche", "Massanassa", "Godella", "Vila-real"]
+
+
+@pytest.fixture
+def canon():
+    return CityCanon(CITY_ALIASES, set(STANDALONE))
+
+
+@pytest.mark.parametrize(
+    "raw, municipality, zone",
+    [
+        ("Elx (Elche)", "elche", ""),
+        ("Elche (Elx)", "elche", ""),
+        ("Massanassa (Horta Sud)", "massanassa", ""),
+        ("Massanassa (L'Horta Sud)", "massanassa", ""),
+        ("Borbotó (Valencia)", "valencia", "borboto"),
+        ("Valencia (Campanar)", "valencia", "campanar"),
+        ("Godella (Valencia)", "godella", ""),
+        ("Alacant/Alicante", "alicante", ""),
+        ("Vila-real", "vila-real", ""),
+    ],
+)
+def test_split(canon, raw, municipality, zone):
+    m_key, _, z_key, _ = canon.split(raw)
+    assert (m_key, z_key) == (municipality, zone)
+
+
+def test_alias_in_parentheses_makes_no_locality(canon):
+    facets = build_facets(Counter({"Elche": 5, "Elx (Elche)": 2, "Massanassa (Horta Sud)": 1}), canon)
+    assert set(facets) == {"elche", "massanassa"}
+    assert facets["elche"].count == 7
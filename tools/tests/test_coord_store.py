@@ -0,0 +1,129 @@
+import pytest
+
+from coord_store import (
+    STATUS_MANUAL,
+    STATUS_MISS,
+    STATUS_OK,
+    STATUS_REVIEW,
+    CoordStore,
+    fingerprint_scope,
+    row_fingerprint,
+)
+
+DAY = 86400.0
+T0 = 1_700_000_000.0
+
+ROW = {"name": "Casa Pepe", "city": "Valencia", "address_text": "Carrer de Quart 12", "google_maps_url": ""}
+MOVED = {**ROW, "address_text": "Carrer de Russafa 3"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    with CoordStore(tmp_path / "coords.sqlite") as s:
+        yield s
+
+
+def fp(row, version="by_address-v1"):
+    return row_fingerprint(row, version)
+
+
+def test_fingerprint_is_scoped_by_tool():
+    assert fingerprint_scope(fp(ROW)) == "by_address"
+    assert fingerprint_scope(fp(ROW, "premiados-v2")) == "premiados"
+    assert fp(ROW, "by_address-v1") != fp(ROW, "by_address-v2")
+    assert fingerprint_scope("3f2a") == ""
+
+
+def test_equal_rank_newest_wins_regardless_of_insertion_order(store):
+    store.record("v1", 1, 1, STATUS_OK, "nominatim", run_id="a", created_at=2000)
+    store.record("v1", 2, 2, STATUS_OK, "nominatim", run_id="b", created_at=1000)
+    assert store.best("v1").lat == 1.0
+
+
+def test_review_from_other_tool_does_not_replace_ok(store):
+    store.record("v1", 1, 1, STATUS_OK, "nominatim_struct", created_at=T0, fingerprint=fp(ROW))
+    won = store.record("v1", 2, 2, STATUS_REVIEW, "photon", created_at=T0 + 1, fingerprint=fp(ROW, "premiados-v1"))
+    assert not won
+    assert store.best("v1").lat == 1.0
+
+
+def test_ok_from_other_tool_needs_rank(store):
+    store.record("v1", 1, 1, STATUS_OK, "osm_exact", created_at=T0, fingerprint=fp(ROW, "exact_join-v1"))
+    assert not store.record("v1", 2, 2, STATUS_OK, "photon", created_at=T0 + 1, fingerprint=fp(ROW))
+    assert store.best("v1").provider == "osm_exact"
+
+
+def test_new_input_replaces_stale_best_of_same_tool(store):
+    store.record("v1", 1, 1, STATUS_OK, "nominatim_struct", created_at=T0, fingerprint=fp(ROW))
+    # La dirección cambió y el nuevo intento falla: la coordenada vieja ya no vale
+    assert store.record("v1", None, None, STATUS_MISS, created_at=T0 + DAY, fingerprint=fp(MOVED))
+    assert not store.best("v1").settled
+
+
+def test_manual_is_never_overridden(store):
+    store.record("v1", 1, 1, STATUS_MANUAL, "manual", created_at=T0)
+    assert not store.record("v1", 2, 2, STATUS_OK, "nominatim", created_at=T0 + 1, fingerprint=fp(MOVED))
+    assert store.best("v1").status == STATUS_MANUAL
+    assert store.reusable("v1", fp(MOVED), now=T0 + 1000 * DAY) is not None
+
+
+def test_reusable_honours_retry_days_for_edited_venue(store):
+    store.record("v1", 1, 1, STATUS_OK, "nominatim", created_at=T0, fingerprint=fp(ROW))
+    assert store.reusable("v1", fp(MOVED), now=T0 + DAY) is None
+    store.record("v1", None, None, STATUS_MISS, run_id="r2", created_at=T0 + DAY, fingerprint=fp(MOVED))
+    # Sigue fallando: no se reintenta en cada ejecución, sino pasados los retry_days
+    assert store.reusable("v1", fp(MOVED), retry_days=7, now=T0 + 3 * DAY) is not None
+    assert store.reusable("v1", fp(MOVED), retry_days=7, now=T0 + 9 * DAY) is None
+
+
+def test_reusable_ttl_counts_from_last_check(store):
+    store.record("v1", 1, 1, STATUS_OK, "nominatim", run_id="r1", created_at=T0, fingerprint=fp(ROW))
+    store.record("v1", 1, 1, STATUS_REVIEW, "photon", run_id="r2", created_at=T0 + 100 * DAY, fingerprint=fp(ROW))
+    assert store.best("v1").status == STATUS_OK
+    assert store.reusable("v1", fp(ROW), ttl_days=180, now=T0 + 250 * DAY) is not None
+    assert store.reusable("v1", fp(ROW), ttl_days=180, now=T0 + 290 * DAY) is None
+
+
+def test_tools_do_not_invalidate_each_other(store):
+    store.record("v1", 1, 1, STATUS_OK, "nominatim", created_at=T0, fingerprint=fp(ROW))
+    store.record("v1", 1.5, 1.5, STATUS_REVIEW, "photon", created_at=T0 + 1, fingerprint=fp(ROW, "premiados-v1"))
+    assert store.reusable("v1", fp(ROW), now=T0 + DAY) is not None
+    assert store.reusable("v1", fp(ROW, "premiados-v1"), now=T0 + DAY) is not None
+    # Otra herramienta que aún no lo ha visto aprovecha el OK asentado
+    assert store.reusable("v1", fp(ROW, "exact_join-v1"), now=T0 + DAY) is not None
+
+
+def test_query_version_bump_invalidates(store):
+    store.record("v1", 1, 1, STATUS_OK, "nominatim", created_at=T0, fingerprint=fp(ROW, "by_address-v1"))
+    assert store.reusable("v1", fp(ROW, "by_address-v2"), now=T0 + DAY) is None
+
+
+def test_imported_results_without_fingerprint(store, tmp_path):
+    src = tmp_path / "venue_coords_OK.csv"
+    src.write_text("venue_id,lat,lon,provider\nv1,39.47,-0.37,nominatim\nv2,,,\n", encoding="utf-8")
+    assert store.import_csv(src) == 1
+    assert store.import_csv(src) == 1  # el histórico no se duplica
+    assert len(store.history("v1")) == 1
+    assert store.reusable("v1", fp(ROW), now=src.stat().st_mtime + DAY) is not None
+
+
+def test_expire_forces_regeocode_in_every_tool(store):
+    store.record("v1", 1, 1, STATUS_OK, "nominatim_struct", created_at=T0, fingerprint=fp(ROW))
+    premiados = fp(ROW, "premiados-v1")
+    assert store.reusable("v1", fp(ROW), now=T0 + DAY) is not None
+    assert store.reusable("v1", premiados, now=T0 + DAY) is not None
+
+    store.expire("v1")
+    assert store.reusable("v1", fp(ROW), now=T0 + DAY) is None
+    assert store.reusable("v1", premiados, now=T0 + DAY) is None
+    # El mejor sigue ahí para quien solo lo lee
+    assert store.best("v1").lat == 1.0
+
+    store.record("v1", 1, 1, STATUS_OK, "nominatim_struct", run_id="b", created_at=T0 + 2 * DAY, fingerprint=fp(ROW))
+    assert store.reusable("v1", fp(ROW), now=T0 + 3 * DAY) is not None
+
+
+def test_expire_keeps_manual(store):
+    store.record("v1", 1, 1, STATUS_MANUAL, "manual", created_at=T0)
+    store.expire("v1")
+    assert store.reusable("v1", fp(ROW), now=T0 + DAY).status == STATUS_MANUAL
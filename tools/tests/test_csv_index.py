@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from csv_index import CsvIndex, StaleIndex, sidecar_path
+
+ROWS = (
+    "osm_type,osm_id,name,note\r\n"
+    "node,2,Casa Pepe,\"con coma, y \"\"comillas\"\"\"\r\n"
+    "way,10,Bar Central,\"dos\nlíneas\"\r\n"
+    "node,1,La Pepica,\r\n"
+    "node,2,Casa Pepe (dup),\r\n"
+)
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    p = tmp_path / "osm.csv"
+    p.write_bytes(ROWS.encode("utf-8"))
+    return p
+
+
+def test_lookup_round_trip(csv_path):
+    with CsvIndex.open(csv_path, key=("osm_type", "osm_id")) as ix:
+        assert len(ix) == 4
+        assert list(ix.iter_keys()) == sorted(ix.iter_keys())
+        assert ix.get("node/1")["name"] == "La Pepica"
+        assert ix.get("way/10")["note"] == "dos\nlíneas"
+        assert [r["name"] for r in ix.get_all("node/2")] == ["Casa Pepe", "Casa Pepe (dup)"]
+        assert ix.get("node/2")["note"] == 'con coma, y "comillas"'
+        assert "node/3" not in ix and ix.get("node/3") is None
+        assert set(ix.get_many(["node/1", "way/10", "node/3"])) == {"node/1", "way/10"}
+
+
+def test_changed_csv_rebuilds_or_raises(csv_path):
+    CsvIndex.open(csv_path, key=("osm_type", "osm_id")).close()
+    assert sidecar_path(csv_path, ("osm_type", "osm_id")).exists()
+
+    with csv_path.open("ab") as f:
+        f.write(b"node,3,Nuevo,\r\n")
+    st = csv_path.stat()
+    os.utime(csv_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    with pytest.raises(StaleIndex):
+        CsvIndex.open(csv_path, key=("osm_type", "osm_id"), rebuild=False)
+    with CsvIndex.open(csv_path, key=("osm_type", "osm_id")) as ix:
+        assert ix.get("node/3")["name"] == "Nuevo"
+
+
+def test_index_of_another_key_is_not_reused(csv_path):
+    CsvIndex.open(csv_path, key=("osm_type", "osm_id")).close()
+    with pytest.raises(StaleIndex):
+        CsvIndex.open(csv_path, key=("name",), rebuild=False)
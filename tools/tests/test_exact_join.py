@@ -0,0 +1,73 @@
+from exact_join import ExactIndex, osm_key, phone_keys, website_key
+
+
+def test_phone_keys_normalizes_spanish_numbers():
+    assert phone_keys("96 312 34 56 / +34 600-11-22-33") == ["+34963123456", "+34600112233"]
+    assert phone_keys("0034 963123456") == ["+34963123456"]
+    assert phone_keys("34963123456; 963123456") == ["+34963123456"]
+    assert phone_keys("+44 20 7946 0958") == ["+442079460958"]
+    assert phone_keys("112") == []
+    assert phone_keys("") == []
+
+
+def test_website_key_hosts_and_platforms():
+    assert website_key("https://www.CasaPepe.es/carta") == "casapepe.es"
+    assert website_key("casapepe.es") == "casapepe.es"
+    assert website_key("https://es-es.facebook.com/casapepe/") == "facebook.com/casapepe"
+    assert website_key("http://m.facebook.com/casapepe") == "facebook.com/casapepe"
+    assert website_key("https://www.facebook.com/pages/") == ""
+    assert website_key("https://casapepe.wixsite.com/menu") == "casapepe.wixsite.com/menu"
+    assert website_key("https://www.tiktok.com/@casapepe") == "tiktok.com/@casapepe"
+    assert website_key("https://maps.app.goo.gl/xyz") == ""
+
+
+def test_website_key_rejects_email():
+    assert website_key("info@gmail.com") == ""
+    assert website_key("info@casapepe.es") == ""
+    assert website_key("mailto:info@casapepe.es") == ""
+    assert website_key("https://gmail.com") == ""
+
+
+def test_osm_key():
+    assert osm_key("OSM:node/123") == "node/123"
+    assert osm_key("https://www.openstreetmap.org/way/45") == "way/45"
+    assert osm_key("relation:9") == "relation/9"
+    assert osm_key("https://maps.google.com/?q=1") == ""
+
+
+def osm(otype, oid, lat, lon, name="Casa Pepe", **tags):
+    return {"osm_type": otype, "osm_id": oid, "name": name, "lat": str(lat), "lon": str(lon), **tags}
+
+
+def test_match_merges_node_and_building_pinned_by_different_keys():
+    ix = ExactIndex()
+    ix.add(osm("node", "1", 39.47000, -0.37000, phone="963123456"))
+    # El edificio, ~15 m al norte, lleva la web
+    ix.add(osm("way", "2", 39.47013, -0.37000, website="https://casapepe.es"))
+    place, kinds, reason, _ = ix.match({"name": "Casa Pepe", "phone": "96 312 34 56", "website": "www.casapepe.es"})
+    assert reason == ""
+    assert place.ref == "node/1"
+    assert sorted(kinds) == ["phone", "website"]
+
+
+def test_match_conflicting_keys_far_apart():
+    ix = ExactIndex()
+    ix.add(osm("node", "1", 39.47, -0.37, phone="963123456"))
+    ix.add(osm("node", "2", 39.48, -0.37, website="https://casapepe.es"))
+    place, _, reason, seen = ix.match({"name": "Casa Pepe", "phone": "963123456", "website": "casapepe.es"})
+    assert place is None
+    assert reason == "conflicting_keys"
+    assert {pl.ref for pl in seen} == {"node/1", "node/2"}
+
+
+def test_match_shared_phone_is_ambiguous_and_name_checked():
+    ix = ExactIndex()
+    ix.add(osm("node", "1", 39.47, -0.37, phone="902000000"))
+    ix.add(osm("node", "2", 39.48, -0.37, phone="902000000"))
+    ix.add(osm("node", "3", 39.49, -0.37, name="Autoescuela Turia", phone="961111111"))
+    assert ix.match({"name": "Casa Pepe", "phone": "902000000"})[2] == "ambiguous_key"
+    assert ix.match({"name": "Casa Pepe", "phone": "961111111"})[2] == "name_mismatch"
+    # El id OSM no necesita parecido de nombre
+    place, kinds, reason, _ = ix.match({"name": "Otro", "query_used": "OSM:node/3"})
+    assert (place.ref, kinds, reason) == ("node/3", ["osm"], "")
+    assert ix.match({"name": "Casa Pepe"}) == (None, [], "", [])
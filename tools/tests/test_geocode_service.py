@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from coord_store import CoordStore
+from geocode_service import GeocodeService, make_app
+
+ROW = {"name": "Casa Pepe", "city": "Valencia", "address_text": "Carrer de Quart 12", "google_maps_url": ""}
+
+
+def fake_resolve(release: threading.Event):
+    def _resolve(row, fp):
+        release.wait(5)
+        return {
+            "status": "OK", "lat": 39.47, "lon": -0.38, "provider": "nominatim",
+            "label": "Casa Pepe", "query_used": "q", "reason": "", "fingerprint": fp,
+        }
+
+    return _resolve
+
+
+def test_coalesced_requests_are_recorded_for_every_venue(tmp_path):
+    store = CoordStore(tmp_path / "coords.sqlite")
+    svc = GeocodeService(store=store, workers=1)
+    release = threading.Event()
+    svc._resolve = fake_resolve(release)
+
+    async def go():
+        tasks = [asyncio.ensure_future(svc.geocode({**ROW, "venue_id": vid})) for vid in ("v1", "v2", "v3")]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(go())
+    assert [r["source"] for r in results] == ["network", "coalesced", "coalesced"]
+    for vid in ("v1", "v2", "v3"):
+        assert store.best(vid).lat == 39.47
+    svc.pool.shutdown()
+    store.close()
+
+
+def cors_headers(cors_origin, origin):
+    async def go():
+        svc = GeocodeService()
+        async with TestClient(TestServer(make_app(svc, cors_origin=cors_origin))) as client:
+            resp = await client.options("/geocode", headers={"Origin": origin})
+            return dict(resp.headers)
+
+    return asyncio.run(go())
+
+
+def test_cors_only_for_the_configured_origin():
+    assert cors_headers("http://localhost:8081", "http://localhost:8081")["Access-Control-Allow-Origin"] == (
+        "http://localhost:8081"
+    )
+    assert "Access-Control-Allow-Origin" not in cors_headers("http://localhost:8081", "https://evil.example")
+    assert "Access-Control-Allow-Origin" not in cors_headers("", "http://localhost:8081")
@@ -0,0 +1,36 @@
+import pytest
+
+from osm_index import ACCEPT_SCORE, OsmSpatialIndex, OsmVenue, name_similarity
+
+
+def venue(name, lat=39.47, lon=-0.376, amenity="restaurant"):
+    return OsmVenue("node", "1", name, amenity, "", "", "", "", "", "", lat, lon)
+
+
+@pytest.mark.parametrize(
+    "ours, theirs",
+    [
+        ("Bar Central", "Cafeteria Central Park"),
+        ("La Pepica", "Pepica Beach Club"),
+    ],
+)
+def test_one_shared_token_is_not_the_same_place(ours, theirs):
+    assert name_similarity(ours, theirs) < ACCEPT_SCORE
+    assert not OsmSpatialIndex([venue(theirs)]).plausibility(ours, 39.47, -0.376).accepted
+
+
+@pytest.mark.parametrize(
+    "ours, theirs",
+    [
+        ("Casa Pepe", "Casa Pepe Russafa"),
+        ("La Pepica", "Restaurante La Pepica"),
+        ("Cafe de las Horas", "Café de Las Horas"),
+    ],
+)
+def test_same_place_variants_match(ours, theirs):
+    assert name_similarity(ours, theirs) == 1.0
+    assert OsmSpatialIndex([venue(theirs)]).plausibility(ours, 39.47, -0.376).accepted
+
+
+def test_only_stopwords_scores_zero():
+    assert name_similarity("Bar", "Bar Restaurante") == 0.0
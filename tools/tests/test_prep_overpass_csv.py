@@ -0,0 +1,44 @@
+from prep_overpass_csv import PrepFilters, prep_row, tag_getter
+
+
+def overpass_row(**tags):
+    # Overpass exporta todas las columnas pedidas, vacías si el objeto no tiene el tag
+    row = {k: "" for k in ("@type", "@id", "name", "amenity", "@lat", "@lon", "phone", "contact:phone", "website", "contact:website", "addr:city")}
+    row.update({"@type": "node", "@id": "1", "name": "Casa Pepe", "amenity": "restaurant", "@lat": "39.47", "@lon": "-0.37"})
+    row.update(tags)
+    return row
+
+
+def test_get_skips_empty_columns():
+    get = tag_getter(overpass_row(**{"contact:phone": "+34 961 23 45 67"}))
+    assert get("phone", "contact:phone") == "+34 961 23 45 67"
+    assert get("website", "contact:website") == ""
+
+
+def test_get_prefers_first_filled_column():
+    get = tag_getter(overpass_row(phone="961", **{"contact:phone": "962"}))
+    assert get("phone", "contact:phone") == "961"
+
+
+def test_require_tag_accepts_alias_column():
+    f = PrepFilters(required_tags=["phone", "website"])
+    out = prep_row(overpass_row(**{"contact:phone": "961234567", "contact:website": "https://pepe.es"}), f)
+    assert out is not None
+    assert out["phone"] == "961234567"
+    assert out["website"] == "https://pepe.es"
+
+
+def test_require_tag_rejects_when_all_empty():
+    f = PrepFilters(required_tags=["phone"])
+    assert prep_row(overpass_row(), f) is None
+    assert f.rejected == {"tag:phone": 1}
+
+
+def test_basic_filter_and_municipality_bbox():
+    f = PrepFilters(municipalities={"valencia"})
+    assert prep_row(overpass_row(name=""), f) is None
+    # Sin addr:city decide el bbox del municipio
+    assert prep_row(overpass_row(), f) is not None
+    assert prep_row(overpass_row(**{"@lat": "38.34", "@lon": "-0.48"}), f) is None
+    assert prep_row(overpass_row(**{"addr:city": "València"}), f) is not None
+    assert f.rejected == {"basic": 1, "municipality": 1}
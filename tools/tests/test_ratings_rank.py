@@ -0,0 +1,110 @@
+import csv
+import sys
+
+import pytest
+
+import ratings_rank
+
+
+def write_csv(path, fields, rows):
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fields)
+        w.writeheader()
+        w.writerows(rows)
+
+
+def read_csv(path):
+    with path.open("r", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def run(tmp_path, monkeypatch, ratings, with_types=True, extra=()):
+    fields = ["id", "venue_id", "overall_score", "created_at"] + (["product_type_id"] if with_types else [])
+    write_csv(tmp_path / "ratings.csv", fields, ratings)
+    write_csv(
+        tmp_path / "venues.csv",
+        ["id", "name", "city"],
+        [{"id": "v1", "name": "Uno", "city": "Valencia"}, {"id": "v2", "name": "Dos", "city": "Alicante"}],
+    )
+    argv = [
+        "ratings_rank.py", str(tmp_path / "ratings.csv"),
+        "--venues", str(tmp_path / "venues.csv"),
+        "--db", str(tmp_path / "state.sqlite"),
+        "--out-all-time", str(tmp_path / "all.csv"),
+        "--out-monthly", str(tmp_path / "month.csv"),
+        "--min-votes", "1",
+        *extra,
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+    ratings_rank.main()
+    return read_csv(tmp_path / "all.csv"), read_csv(tmp_path / "month.csv")
+
+
+RATINGS = [
+    {"id": "r1", "venue_id": "v1", "overall_score": "9", "created_at": "2024-05-01T10:00:00", "product_type_id": "paella"},
+    {"id": "r2", "venue_id": "v1", "overall_score": "7", "created_at": "2024-06-01T10:00:00", "product_type_id": "paella"},
+    {"id": "r3", "venue_id": "v2", "overall_score": "5", "created_at": "2024-06-02T10:00:00", "product_type_id": "arroz"},
+]
+
+
+def test_scopes_without_product_type_are_not_duplicated(tmp_path, monkeypatch):
+    rows = [{k: v for k, v in r.items() if k != "product_type_id"} for r in RATINGS]
+    all_time, monthly = run(tmp_path, monkeypatch, rows, with_types=False)
+    for out in (all_time, monthly):
+        keys = [r["rank_key"] for r in out]
+        assert len(keys) == len(set(keys))
+        assert {r["product_type_id"] for r in out} == {""}
+    # todas + Valencia + Alicante
+    assert {r["city_scope"] for r in all_time} == {"", "Valencia", "Alicante"}
+    assert len(all_time) == 4
+
+
+def test_scopes_with_product_type(tmp_path, monkeypatch):
+    all_time, _ = run(tmp_path, monkeypatch, RATINGS)
+    keys = [r["rank_key"] for r in all_time]
+    assert len(keys) == len(set(keys))
+    scopes = {(r["city_scope"], r["product_type_id"]) for r in all_time}
+    assert scopes == {
+        ("", ""), ("Valencia", ""), ("Alicante", ""),
+        ("", "paella"), ("Valencia", "paella"), ("", "arroz"), ("Alicante", "arroz"),
+    }
+    top = [r for r in all_time if r["city_scope"] == "" and r["product_type_id"] == ""]
+    assert [r["venue_id"] for r in sorted(top, key=lambda r: int(r["rank"]))] == ["v1", "v2"]
+    assert top[0]["ratings_count"] == "2"
+
+
+def test_incremental_edit_matches_full_rebuild(tmp_path, monkeypatch):
+    run(tmp_path, monkeypatch, RATINGS)
+    edited = RATINGS[:2] + [{**RATINGS[2], "overall_score": "10", "updated_at": "2024-07-01T00:00:00"}]
+    for r in edited:
+        r.setdefault("updated_at", "")
+    write = ["id", "venue_id", "overall_score", "created_at", "updated_at", "product_type_id"]
+    write_csv(tmp_path / "ratings.csv", write, edited)
+    incremental = ratings_rank_state(tmp_path, monkeypatch, [])
+    full = ratings_rank_state(tmp_path, monkeypatch, ["--full"])
+    assert incremental == full
+
+
+def ratings_rank_state(tmp_path, monkeypatch, extra):
+    argv = [
+        "ratings_rank.py", str(tmp_path / "ratings.csv"),
+        "--db", str(tmp_path / "state.sqlite"),
+        "--out-all-time", str(tmp_path / "all.csv"),
+        "--out-monthly", str(tmp_path / "month.csv"),
+        *extra,
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+    ratings_rank.main()
+    return [{k: v for k, v in r.items() if k != "generated_at"} for r in read_csv(tmp_path / "all.csv")]
+
+
+@pytest.mark.parametrize("size", [1, 2])
+def test_watermark_advances_only_after_whole_stream(tmp_path, size):
+    write_csv(tmp_path / "r.csv", ["id", "venue_id", "overall_score", "created_at"], [
+        {"id": "a", "venue_id": "v1", "overall_score": "8", "created_at": "2024-05-02"},
+        {"id": "b", "venue_id": "v1", "overall_score": "6", "created_at": "2024-03-01"},
+    ])
+    with ratings_rank.RankState(tmp_path / "s.sqlite") as st:
+        it = ratings_rank.chunks(ratings_rank.read_ratings(tmp_path / "r.csv", st.watermark()), size)
+        st.apply(next(it))
+        assert st.watermark() == ""
@@ -0,0 +1,83 @@
+import json
+import sys
+
+import search_index
+from search_index import NORM_VERSION, SearchIndex
+
+
+def run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["search_index.py", *argv])
+    search_index.main()
+
+
+def test_index_carries_the_normalizer_version():
+    idx = SearchIndex()
+    idx.upsert("v1", "Casa Pepe", "Valencia")
+    assert idx.to_json()["norm"] == NORM_VERSION
+    assert NORM_VERSION.startswith("textnorm.norm@")
+
+
+def test_base_with_other_normalizer_is_rebuilt(tmp_path, monkeypatch):
+    venues = tmp_path / "venues.csv"
+    venues.write_text("venue_id,name,city\nv1,Casa Pepe,Valencia\n", encoding="utf-8")
+    base = tmp_path / "base.json"
+    stale = SearchIndex()
+    stale.upsert("v1", "Casa Pepe", "Valencia")
+    data = stale.to_json()
+    # Tokens de un normalizador viejo: con --base se quedarían si no se descartara
+    data["norm"] = "geocode_by_address.norm"
+    data["tokens"] = ["CASA", "PEPE", "VALENCIA"]
+    base.write_text(json.dumps(data), encoding="utf-8")
+
+    out = tmp_path / "out.json"
+    run(monkeypatch, "--venues", str(venues), "--base", str(base), "--out", str(out))
+    rebuilt = json.loads(out.read_text(encoding="utf-8"))
+    assert rebuilt["norm"] == NORM_VERSION
+    assert rebuilt["tokens"] == ["casa", "pepe", "valencia"]
+
+
+def build(venues):
+    idx = SearchIndex()
+    for vid, name, city in venues:
+        idx.upsert(vid, name, city)
+    return idx
+
+
+VENUES = [
+    ("v1", "Casa Pepe", "Valencia"),
+    ("v2", "La Pepica", "Valencia"),
+    ("v3", "Bar Central", "Alicante"),
+    ("v4", "Ultramarinos Russafa", "Valencia"),
+]
+QUERIES = ["pepe", "pep", "rusafa", "central alicante", "valencia", "pepika"]
+
+
+def test_json_round_trip_answers_the_same():
+    idx = build(VENUES)
+    idx.remove("v3")
+    back = SearchIndex.from_json(json.loads(json.dumps(idx.to_json())))
+    assert back.docs == idx.docs
+    assert back.holes() == 1
+    for q in QUERIES:
+        assert back.search(q) == idx.search(q), q
+    assert [h[1] for h in back.search("rus")] == ["v4"]
+    assert "v3" not in {h[1] for h in back.search("central")}
+
+
+def test_compact_keeps_results():
+    idx = build(VENUES)
+    idx.remove("v1")
+    idx.remove("v3")
+    before = {q: idx.search(q) for q in QUERIES}
+    idx.compact()
+    assert idx.holes() == 0
+    back = SearchIndex.from_json(idx.to_json())
+    for q in QUERIES:
+        assert back.search(q) == before[q], q
+
+
+def test_upsert_reports_only_changes():
+    idx = build(VENUES)
+    assert not idx.upsert("v1", "Casa Pepe", "Valencia")
+    assert idx.upsert("v1", "Casa Pepe Russafa", "Valencia")
+    assert {h[1] for h in idx.search("russafa")} == {"v1", "v4"}
@@ -0,0 +1,64 @@
+import pytest
+
+import venue_images
+from venue_images import ImagePipeline
+
+
+class FakeResponse:
+    def __init__(self, chunks, headers=None):
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for c in self.chunks:
+            self.read += 1
+            yield c
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, timeout, stream):
+        assert stream
+        return self.response
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setattr(venue_images, "MAX_SOURCE_BYTES", 10)
+    return ImagePipeline(tmp_path)
+
+
+def serve(pipeline, monkeypatch, response):
+    monkeypatch.setattr(pipeline, "_http", lambda: FakeSession(response))
+    return response
+
+
+def test_download_stops_at_the_limit(pipeline, monkeypatch):
+    resp = serve(pipeline, monkeypatch, FakeResponse([b"x" * 6] * 100))
+    with pytest.raises(ValueError):
+        pipeline.read_source("https://example.com/a.jpg")
+    assert resp.read == 2
+
+
+def test_declared_length_rejected_before_reading(pipeline, monkeypatch):
+    resp = serve(pipeline, monkeypatch, FakeResponse([b"x"], {"Content-Length": "11"}))
+    with pytest.raises(ValueError):
+        pipeline.read_source("https://example.com/a.jpg")
+    assert resp.read == 0
+
+
+def test_small_download_is_returned_whole(pipeline, monkeypatch):
+    serve(pipeline, monkeypatch, FakeResponse([b"abc", b"def"], {"Content-Length": "6"}))
+    assert pipeline.read_source("https://example.com/a.jpg") == b"abcdef"
@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+
+from venue_snapshot import (
+    LAT_NULL,
+    ROW_DELETED,
+    ROW_HAS_COORDS,
+    build_snapshot,
+    id_bytes,
+    make_delta,
+    read_snapshot,
+    write_snapshot,
+)
+
+U1 = "0b9f3c2e-5d1a-4c61-9b5e-3f0d2a7c8e11"
+U2 = "5e2b7a90-1c3d-4e8f-a6b2-0c9d8e7f6a55"
+
+VENUES = [
+    {"venue_id": U1, "name": "Casa Pepe", "city": "València", "lat": "39.4697065", "lon": "-0.3763353",
+     "cover_photo_path": "derived/ab/ab_card.jpg"},
+    {"venue_id": U2, "name": "La Pepica", "city": "València", "lat": "", "lon": ""},
+    {"id": "legacy-3", "name": "Bar Central", "city": "Alicante"},
+]
+STATS = {U1: (4.25, 12)}
+COORDS = {U2: (39.4654, -0.3244)}
+
+
+def snapshot(venues=VENUES, version=1):
+    return build_snapshot(venues, STATS, COORDS, version)
+
+
+def test_round_trip(tmp_path):
+    snap = snapshot()
+    path = tmp_path / "venues.bin"
+    write_snapshot(snap, path)
+    back = read_snapshot(path)
+
+    assert (back.version, back.base_version, len(back)) == (1, 0, 3)
+    for col in ("ids", "lat", "lon", "name", "city", "cover", "count", "flags"):
+        assert np.array_equal(getattr(back, col), getattr(snap, col)), col
+    assert back.strings == snap.strings
+    assert bytes(back.ids[2]) == id_bytes("legacy-3")
+    assert [back.strings[i] for i in back.name] == ["Casa Pepe", "La Pepica", "Bar Central"]
+    assert back.strings[back.cover[0]] == "derived/ab/ab_card.jpg" and back.cover[2] == 0
+
+    # Coords de la fila, de respaldo (COORDS) o ninguna
+    assert back.lat[0] == 394697065 and back.lat[1] == 394654000
+    assert back.lat[2] == LAT_NULL and back.flags[2] == 0
+    assert back.flags[0] == back.flags[1] == ROW_HAS_COORDS
+    assert math.isclose(back.score[0], 4.25) and math.isnan(back.score[1]) and back.count[0] == 12
+
+
+def test_delta_has_only_changes_and_deletions(tmp_path):
+    base = snapshot()
+    edited = [{**VENUES[0], "name": "Casa Pepe Russafa"}, VENUES[1]]
+    delta = make_delta(snapshot(edited, version=2), base)
+
+    path = tmp_path / "delta.bin"
+    write_snapshot(delta, path)
+    back = read_snapshot(path)
+    assert (back.version, back.base_version, len(back)) == (2, 1, 2)
+    assert bytes(back.ids[0]) == id_bytes(U1) and back.strings[back.name[0]] == "Casa Pepe Russafa"
+    assert bytes(back.ids[1]) == id_bytes("legacy-3") and back.flags[1] == ROW_DELETED
+
+
+def test_identical_snapshot_gives_empty_delta():
+    assert len(make_delta(snapshot(version=2), snapshot())) == 0
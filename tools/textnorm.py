@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import re
+
+# Normalización de texto y reglas de ciudad (partes de "Borbotó (Valencia)", provincia,
+# bboxes de municipio, label plausible) compartidas por los geocoders, los índices OSM
+# locales, los candidatos de REVIEW y la preparación del export.
+#
+# Vive aparte y sin dependencias para que osm_index.py, prep_overpass_csv.py y demás no
+# tengan que importar geocode_by_address.py (requests, store...; y este a su vez carga
+# osm_index.py: al ejecutar el geocoder como script, el ciclo cargaba el módulo dos veces).
+
+# Bounds para sanity-check (lat_min, lat_max, lon_min, lon_max)
+CITY_BOUNDS = {
+    "valencia": (39.405, 39.563, -0.431, -0.260),
+    "alicante": (38.332, 38.407, -0.563, -0.435),
+}
+
+
+def norm(s: str) -> str:
+    s = (s or "").strip().lower()
+    s = s.replace("à", "a").replace("á", "a").replace("ä", "a")
+    s = s.replace("è", "e").replace("é", "e").replace("ë", "e")
+    s = s.replace("ì", "i").replace("í", "i").replace("ï", "i")
+    s = s.replace("ò", "o").replace("ó", "o").replace("ö", "o")
+    s = s.replace("ù", "u").replace("ú", "u").replace("ü", "u")
+    s = s.replace("ç", "c")
+    return re.sub(r"\s+", " ", s)
+
+
+def split_city_parts(city: str) -> list[str]:
+    """
+    Admite cosas como:
+      - "Valencia"
+      - "Borbotó (Valencia)"
+      - "Alacant/Alicante" (si alguna vez apareciera)
+    Devuelve una lista de tokens plausibles para "match" contra labels.
+    """
+    c = (city or "").strip()
+    parts: list[str] = []
+    if not c:
+        return parts
+
+    # Lo de dentro de paréntesis ayuda a validar labels (p.ej. "Borbotó (Valencia)")
+    m = re.findall(r"\((.*?)\)", c)
+    if m:
+        parts.extend([p.strip() for p in m if p.strip()])
+
+    # Y el "city base" sin paréntesis
+    base = re.sub(r"\s*\(.*?\)\s*", " ", c).strip()
+    if base:
+        parts.append(base)
+
+    # Split por separadores comunes
+    out: list[str] = []
+    for p in parts:
+        out.extend([x.strip() for x in re.split(r"[/,-]", p) if x.strip()])
+
+    # Quita duplicados manteniendo orden
+    seen = set()
+    final = []
+    for p in out:
+        n = norm(p)
+        if n and n not in seen:
+            seen.add(n)
+            final.append(p)
+    return final
+
+
+def split_street_number(address: str) -> tuple[str, str]:
+    """
+    Intenta separar "Calle X 12" en ("Calle X", "12").
+    Suficiente para un structured search básico.
+    """
+    if not address:
+        return "", ""
+    m = re.search(r"^(.*?)[, ]+(\d+[A-Za-z]?)\b", address.strip())
+    if not m:
+        return "", ""
+    street = m.group(1).strip()
+    num = m.group(2).strip()
+    return street, num
+
+
+def in_city_bounds(city: str, lat: float, lon: float) -> bool:
+    c = norm(city)
+    if c not in CITY_BOUNDS:
+        return True  # no restringimos otras ciudades
+    lat_min, lat_max, lon_min, lon_max = CITY_BOUNDS[c]
+    return (lat_min <= lat <= lat_max) and (lon_min <= lon <= lon_max)
+
+
+def base_city(city: str) -> str:
+    """
+    Para construir query: si viene "Borbotó (Valencia)" devolvemos "Borbotó, Valencia"
+    para ayudar al geocoding sin perder el ancla provincial.
+    """
+    c = (city or "").strip()
+    if not c:
+        return ""
+    inners = re.findall(r"\((.*?)\)", c)
+    outer = re.sub(r"\s*\(.*?\)\s*", " ", c).strip()
+    if inners and outer:
+        # "outer, inner"
+        inner = inners[0].strip()
+        if inner and inner.lower() not in outer.lower():
+            return f"{outer}, {inner}"
+    return outer or c
+
+
+def province_hint(city: str) -> str:
+    c = norm(city)
+    if "valencia" in c or "valencia" in " ".join(split_city_parts(city)).lower():
+        return "Valencia"
+    if "alicante" in c or "alacant" in c or "alicante" in " ".join(split_city_parts(city)).lower():
+        return "Alicante"
+    if "castellon" in c or "castello" in c:
+        return "Castellón"
+    return ""
+
+
+def looks_plausible(city: str, label: str) -> bool:
+    """
+    Heurística suave: si Nominatim te da algo en ES pero sin ciudad clara,
+    no lo tiramos automáticamente. Solo usamos esto como filtro de "alarmas".
+    """
+    if not label:
+        return True
+
+    label_n = norm(label)
+
+    # Si el label menciona España/València/Alicante, mejor.
+    # Y si el city tiene paréntesis, aceptamos cualquiera de sus partes.
+    city_parts = split_city_parts(city)
+    if not city_parts:
+        return True
+
+    for p in city_parts:
+        pn = norm(p)
+        if pn and pn in label_n:
+            return True
+
+    # fallback: provincia
+    prov = province_hint(city)
+    if prov and norm(prov) in label_n:
+        return True
+
+    return False
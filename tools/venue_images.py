@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import requests
+from PIL import Image, ImageOps
+
+from geocode_premiados import FIELDNAMES, HEADERS
+from sinks import CsvSink, FanOut
+
+# Miniaturas para el bucket venue-photos a partir de fotos originales (rutas locales o URLs).
+#
+# Cada imagen se guarda por contenido (sha256 de los bytes de origen): la misma foto
+# usada por dos venues, o reprocesada en otra ejecución, no se vuelve a descargar
+# ni a recodificar. Rellena cover_photo_path / hero_image_url del CSV de enrichment
+# y deja un manifest con las rutas a subir al bucket.
+
+BASE_DIR = Path(__file__).resolve().parent
+INPUT = BASE_DIR / "venue_enrichment_premiados_coords_ALL.csv"
+OUT_DIR = BASE_DIR / "venue_images"
+
+# Variantes: nombre -> (ancho, alto). Alto 0 = solo se limita el ancho, sin recorte.
+# list: VenueThumb de las listas; card: tarjetas y cabecera de la ficha; hero: pantalla completa.
+VARIANTS = {
+    "list": (160, 160),
+    "card": (640, 480),
+    "hero": (1440, 0),
+}
+JPEG_QUALITY = {"list": 75, "card": 80, "hero": 82}
+
+# Prefijo dentro del bucket (venueCoverUrl acepta rutas relativas al bucket)
+STORAGE_PREFIX = "derived"
+
+MAX_SOURCE_BYTES = 25 * 1024 * 1024
+FETCH_TIMEOUT_S = 30
+
+MANIFEST_FIELDS = ["venue_id", "source", "sha256", "variant", "storage_path", "width", "height", "bytes"]
+
+
+@dataclass
+class ImageResult:
+    venue_id: str
+    source: str
+    sha256: str = ""
+    # variante -> (storage_path, ancho, alto, bytes)
+    variants: dict[str, tuple[str, int, int, int]] = field(default_factory=dict)
+    reused: bool = False
+    error: str = ""
+
+
+def storage_path(sha: str, variant: str) -> str:
+    # Dos niveles para no tener decenas de miles de ficheros en un directorio
+    return f"{STORAGE_PREFIX}/{sha[:2]}/{sha}_{variant}.jpg"
+
+
+def render_variant(img: Image.Image, size: tuple[int, int]) -> Image.Image:
+    w, h = size
+    if h:
+        return ImageOps.fit(img, (w, h), method=Image.Resampling.LANCZOS)
+    if img.width <= w:
+        return img
+    return img.resize((w, round(img.height * w / img.width)), Image.Resampling.LANCZOS)
+
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class ImagePipeline:
+    """
+    Descarga/lee, decodifica y genera las variantes en un pool de hilos.
+    Las descargas van aparte con un semáforo (--max-fetch) para no abrir
+    demasiadas conexiones a la vez aunque haya muchos workers recodificando.
+    """
+
+    def __init__(self, out_dir: Path, max_fetch: int = 4):
+        self.out_dir = out_dir
+        self._fetch_slots = threading.Semaphore(max_fetch)
+        self._lock = threading.Lock()
+        # source -> sha de ejecuciones en curso: misma URL en varios venues = una descarga
+        self._sha_by_source: dict[str, str] = {}
+        self._session = threading.local()
+
+    def _http(self) -> requests.Session:
+        s = getattr(self._session, "s", None)
+        if s is None:
+            s = self._session.s = requests.Session()
+            s.headers.update(HEADERS)
+        return s
+
+    def read_source(self, source: str) -> bytes:
+        if source.startswith(("http://", "https://")):
+            with self._fetch_slots:
+                return self._download(source)
+        p = Path(source)
+        if not p.is_absolute():
+            p = BASE_DIR / p
+        size = p.stat().st_size
+        if size > MAX_SOURCE_BYTES:
+            raise ValueError(f"origen demasiado grande ({size} bytes)")
+        return p.read_bytes()
+
+    def _download(self, url: str) -> bytes:
+        # En streaming: se corta en MAX_SOURCE_BYTES sin bajar el resto (Content-Length
+        # puede faltar o mentir)
+        with self._http().get(url, timeout=FETCH_TIMEOUT_S, stream=True) as r:
+            r.raise_for_status()
+            declared = r.headers.get("Content-Length", "")
+            if declared.isdigit() and int(declared) > MAX_SOURCE_BYTES:
+                raise ValueError(f"origen demasiado grande ({declared} bytes)")
+            buf = bytearray()
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                buf += chunk
+                if len(buf) > MAX_SOURCE_BYTES:
+                    raise ValueError(f"origen demasiado grande (>{MAX_SOURCE_BYTES} bytes)")
+            return bytes(buf)
+
+    def _variants_on_disk(self, sha: str) -> Optional[dict[str, tuple[str, int, int, int]]]:
+        out = {}
+        for name in VARIANTS:
+            sp = storage_path(sha, name)
+            p = self.out_dir / sp
+            if not p.exists():
+                return None
+            with Image.open(p) as im:
+                out[name] = (sp, im.width, im.height, p.stat().st_size)
+        return out
+
+    def process(self, venue_id: str, source: str) -> ImageResult:
+        res = ImageResult(venue_id, source)
+        try:
+            with self._lock:
+                known = self._sha_by_source.get(source)
+            if known:
+                done = self._variants_on_disk(known)
+                if done is not None:
+                    res.sha256, res.variants, res.reused = known, done, True
+                    return res
+
+            data = self.read_source(source)
+            sha = hashlib.sha256(data).hexdigest()
+            res.sha256 = sha
+            with self._lock:
+                self._sha_by_source[source] = sha
+
+            done = self._variants_on_disk(sha)
+            if done is not None:
+                res.variants, res.reused = done, True
+                return res
+
+            with Image.open(io.BytesIO(data)) as im:
+                im = ImageOps.exif_transpose(im)
+                im = im.convert("RGB")
+                for name, size in VARIANTS.items():
+                    v = render_variant(im, size)
+                    blob = encode_jpeg(v, JPEG_QUALITY[name])
+                    sp = storage_path(sha, name)
+                    _write_atomic(self.out_dir / sp, blob)
+                    res.variants[name] = (sp, v.width, v.height, len(blob))
+        except Exception as e:
+            res.error = f"{type(e).__name__}: {e}"
+        return res
+
+
+def load_sources(path: Path, src_col: str) -> dict[str, str]:
+    """venue_id -> ruta/URL de la foto original."""
+    out: dict[str, str] = {}
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            vid = (row.get("venue_id") or "").strip()
+            src = (row.get(src_col) or "").strip()
+            if vid and src:
+                out[vid] = src
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Genera miniaturas list/card/hero y rellena cover_photo_path/hero_image_url")
+    ap.add_argument("--input", default=str(INPUT), help="CSV de enrichment (geocode_premiados.py)")
+    ap.add_argument("--images", required=True, help="CSV venue_id,<src-col> con rutas locales o URLs de la foto original")
+    ap.add_argument("--src-col", default="image_source")
+    ap.add_argument("--out", default="", help="Enrichment con columnas rellenas (por defecto <input>_images.csv)")
+    ap.add_argument("--out-manifest", default="venue_images_manifest.csv", help="Ficheros a subir al bucket venue-photos")
+    ap.add_argument("--out-dir", default=str(OUT_DIR), help="Raíz local con la misma estructura que el bucket")
+    ap.add_argument("--workers", type=int, default=min(8, (os.cpu_count() or 2)))
+    ap.add_argument("--max-fetch", type=int, default=4, help="Descargas HTTP simultáneas como máximo")
+    ap.add_argument("--cover-variant", default="card", choices=sorted(VARIANTS))
+    ap.add_argument("--public-base", default="", help="URL pública del bucket para hero_image_url (si no, ruta relativa)")
+    ap.add_argument("--refresh", action="store_true", help="Rehace también los venues que ya tienen cover_photo_path")
+    args = ap.parse_args()
+
+    in_path = Path(args.input)
+    out_path = Path(args.out) if args.out else in_path.with_name(f"{in_path.stem}_images.csv")
+    sources = load_sources(Path(args.images), args.src_col)
+
+    with in_path.open("r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames or FIELDNAMES
+        rows = list(reader)
+    for col in ("hero_image_url", "cover_photo_path"):
+        if col not in fieldnames:
+            fieldnames = fieldnames + [col]
+
+    todo = [
+        (r["venue_id"].strip(), sources[r["venue_id"].strip()])
+        for r in rows
+        if r.get("venue_id", "").strip() in sources and (args.refresh or not (r.get("cover_photo_path") or "").strip())
+    ]
+    print(f"Venues: {len(rows)} | con foto origen: {len(todo)} | workers={args.workers} max_fetch={args.max_fetch}")
+
+    pipeline = ImagePipeline(Path(args.out_dir), max_fetch=args.max_fetch)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = {r.venue_id: r for r in pool.map(lambda t: pipeline.process(*t), todo)}
+    dt = time.perf_counter() - t0
+
+    base = args.public_base.rstrip("/")
+    ok = reused = failed = 0
+    enrich = CsvSink(out_path, fieldnames)
+    manifest = CsvSink(args.out_manifest, MANIFEST_FIELDS)
+    with FanOut([enrich, manifest]):
+        for row in rows:
+            res = results.get((row.get("venue_id") or "").strip())
+            if res is not None and res.error:
+                failed += 1
+                print(f"[ERR] {res.venue_id} {res.source}: {res.error}")
+            elif res is not None:
+                ok += 1
+                reused += res.reused
+                row["cover_photo_path"] = res.variants[args.cover_variant][0]
+                hero = res.variants["hero"][0]
+                row["hero_image_url"] = f"{base}/{hero}" if base else hero
+                for name, (sp, w, h, nbytes) in res.variants.items():
+                    manifest.write(
+                        {
+                            "venue_id": res.venue_id,
+                            "source": res.source,
+                            "sha256": res.sha256,
+                            "variant": name,
+                            "storage_path": sp,
+                            "width": w,
+                            "height": h,
+                            "bytes": nbytes,
+                        }
+                    )
+            enrich.write(row)
+
+    print(f"OK: {ok} (reutilizadas: {reused}) | errores: {failed} | {dt:.1f}s")
+    print(f"Generado: {out_path}")
+    print(f"Generado: {args.out_manifest} (rows={manifest.kept})")
+    print(f"Variantes en: {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import heapq
+import math
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+
+# Pesos de cada señal. Un premiado pesa más que un destacado, y ambos más
+# que las valoraciones (que entran en log para que 5000 ratings no lo aplasten todo).
+W_EXPLICIT = 1000.0
+W_AWARD = 100.0
+W_FEATURED = 50.0
+W_RATINGS = 10.0  # * log1p(ratings_count)
+
+
+def _read_rows(path: Path | str) -> list[dict]:
+    # utf-8-sig: los exports de Supabase a veces traen BOM
+    with Path(path).open("r", encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _num(v) -> float:
+    try:
+        return float(str(v or "").strip() or 0)
+    except ValueError:
+        return 0.0
+
+
+@dataclass
+class PrioritySignals:
+    """
+    Señales de valor por venue_id:
+      - awarded: ids premiados (premiados_sin_coords.csv o export de venue_awards)
+      - featured: venue_id -> priority de featured_venues (más alto = más importante)
+      - ratings: venue_id -> ratings_count (export de vw_venue_stats_all_time_current)
+      - explicit_col: columna opcional de la propia entrada con prioridad manual
+    """
+
+    awarded: set[str] = field(default_factory=set)
+    featured: dict[str, float] = field(default_factory=dict)
+    ratings: dict[str, float] = field(default_factory=dict)
+    explicit_col: str = "priority"
+
+    def score(self, row: dict) -> float:
+        vid = (row.get("venue_id") or row.get("id") or "").strip()
+        s = W_EXPLICIT * _num(row.get(self.explicit_col)) if self.explicit_col else 0.0
+        if vid in self.awarded:
+            s += W_AWARD
+        if vid in self.featured:
+            s += W_FEATURED + min(self.featured[vid], W_FEATURED - 1)
+        n = self.ratings.get(vid, _num(row.get("ratings_count")))
+        if n > 0:
+            s += W_RATINGS * math.log1p(n)
+        return s
+
+
+class VenueQueue:
+    """
+    Cola de prioridad (heap) sobre filas de entrada. A igual prioridad respeta el
+    orden del fichero, así una ejecución sin señales se comporta como antes.
+    """
+
+    def __init__(self, rows: list[dict], signals: Optional[PrioritySignals] = None):
+        self.signals = signals or PrioritySignals()
+        self._heap: list[tuple[float, int, dict]] = []
+        for seq, row in enumerate(rows):
+            self.push(row, seq)
+
+    def push(self, row: dict, seq: int) -> None:
+        heapq.heappush(self._heap, (-self.signals.score(row), seq, row))
+
+    def pop(self) -> tuple[float, dict]:
+        neg, _, row = heapq.heappop(self._heap)
+        return -neg, row
+
+    def drain(self) -> list[dict]:
+        """Vacía la cola devolviendo las filas pendientes en orden de prioridad."""
+        out = []
+        while self._heap:
+            out.append(self.pop()[1])
+        return out
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __iter__(self) -> Iterator[tuple[float, dict]]:
+        while self._heap:
+            yield self.pop()
+
+
+def add_priority_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--awards", default="", help="CSV con venue_id premiados (p.ej. premiados_sin_coords.csv)")
+    ap.add_argument("--featured", default="", help="Export de featured_venues (venue_id, priority)")
+    ap.add_argument("--ratings", default="", help="Export con venue_id, ratings_count")
+    ap.add_argument("--priority-col", default="priority", help="Columna de prioridad explícita en la entrada")
+
+
+def signals_from_args(args: argparse.Namespace) -> PrioritySignals:
+    sig = PrioritySignals(explicit_col=args.priority_col)
+    if args.awards:
+        sig.awarded = {(r.get("venue_id") or "").strip() for r in _read_rows(args.awards)}
+        sig.awarded.discard("")
+    if args.featured:
+        for r in _read_rows(args.featured):
+            vid = (r.get("venue_id") or "").strip()
+            if vid:
+                sig.featured[vid] = max(sig.featured.get(vid, 0.0), _num(r.get("priority")))
+    if args.ratings:
+        for r in _read_rows(args.ratings):
+            vid = (r.get("venue_id") or "").strip()
+            if vid:
+                sig.ratings[vid] = _num(r.get("ratings_count"))
+    return sig
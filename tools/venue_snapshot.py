@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import struct
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from coord_store import CoordStore
+from coords_qa import Interner
+
+# Snapshot binario columnar de venues para que la app pinte listas y "cerca de mí"
+# desde un único fichero, sin las consultas de arranque a Supabase.
+#
+# Formato (little-endian):
+#   cabecera  "ADVS" | u16 formato | u16 flags | u32 versión | u32 versión base | u32 filas
+#             | u32 secciones, y por sección: 4 bytes nombre | u32 offset | u32 longitud
+#   ID    16 bytes por fila (uuid; ids no-uuid van como md5 de su texto)
+#   LAT   int32  grados * 1e7 (LAT_NULL = sin coords)
+#   LON   int32  grados * 1e7
+#   NAME  u32    índice en STRS
+#   CITY  u32    índice en STRS
+#   COVR  u32    índice en STRS (cover_photo_path; 0 = "")
+#   SCOR  f32    bayes_score (NaN = sin valoraciones)
+#   CNT   u32    ratings_count
+#   FLAG  u8     bit 0: tiene coords, bit 1: borrado (solo en deltas)
+#   STRS  u32 n | u32 offsets[n+1] | utf-8 concatenado; la cadena 0 es ""
+#
+# Con --base se escribe un delta: solo filas nuevas/cambiadas y borrados, con
+# "versión base" = versión del snapshot de partida. El cliente lo aplica si su
+# versión coincide con la base; si no, baja el completo.
+
+MAGIC = b"ADVS"
+FORMAT_VERSION = 1
+FLAG_DELTA = 1
+
+ROW_HAS_COORDS = 1
+ROW_DELETED = 2
+
+COORD_SCALE = 1e7
+LAT_NULL = np.iinfo(np.int32).min
+
+HEADER = struct.Struct("<4sHHIIII")
+SECTION = struct.Struct("<4sII")
+
+
+@dataclass
+class Snapshot:
+    version: int
+    base_version: int
+    ids: np.ndarray  # (n, 16) uint8
+    lat: np.ndarray  # int32
+    lon: np.ndarray  # int32
+    name: np.ndarray  # uint32
+    city: np.ndarray  # uint32
+    cover: np.ndarray  # uint32
+    score: np.ndarray  # float32
+    count: np.ndarray  # uint32
+    flags: np.ndarray  # uint8
+    strings: list[str]
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def id_keys(self) -> np.ndarray:
+        return np.ascontiguousarray(self.ids).view("V16").ravel()
+
+    def row_keys(self) -> np.ndarray:
+        """Contenido de cada fila como un único valor comparable (textos por hash), para calcular deltas."""
+        sh = np.array(
+            [int.from_bytes(hashlib.md5(t.encode("utf-8")).digest()[:8], "little") for t in self.strings],
+            dtype=np.uint64,
+        )
+        rec = np.empty(
+            len(self),
+            dtype=[("lat", "<i4"), ("lon", "<i4"), ("score", "<f4"), ("count", "<u4"), ("name", "<u8"), ("city", "<u8"), ("cover", "<u8")],
+        )
+        rec["lat"], rec["lon"], rec["score"], rec["count"] = self.lat, self.lon, self.score, self.count
+        rec["name"], rec["city"], rec["cover"] = sh[self.name], sh[self.city], sh[self.cover]
+        return rec.view(f"V{rec.dtype.itemsize}")
+
+
+def id_bytes(vid: str) -> bytes:
+    try:
+        return uuid.UUID(vid).bytes
+    except ValueError:
+        return hashlib.md5(vid.encode("utf-8")).digest()
+
+
+def _read_csv(path: Path) -> list[dict]:
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _float(v) -> Optional[float]:
+    try:
+        return float(str(v).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def build_snapshot(
+    venues: list[dict],
+    stats: dict[str, tuple[float, int]],
+    coords: dict[str, tuple[float, float]],
+    version: int,
+) -> Snapshot:
+    strings = Interner()
+    strings("")
+    ids = bytearray()
+    lat, lon, name, city, cover, score, count, flags = [], [], [], [], [], [], [], []
+    nan = float("nan")
+
+    for row in venues:
+        vid = (row.get("venue_id") or row.get("id") or "").strip()
+        ids += id_bytes(vid)
+        name.append(strings((row.get("name") or "").strip()))
+        city.append(strings((row.get("city") or "").strip()))
+        cover.append(strings((row.get("cover_photo_path") or "").strip()))
+        la, lo = _float(row.get("lat")), _float(row.get("lon"))
+        if la is None or lo is None:
+            la, lo = coords.get(vid, (None, None))
+        if la is not None and lo is not None:
+            lat.append(round(la * COORD_SCALE))
+            lon.append(round(lo * COORD_SCALE))
+            flags.append(ROW_HAS_COORDS)
+        else:
+            lat.append(LAT_NULL)
+            lon.append(LAT_NULL)
+            flags.append(0)
+        sc, n = stats.get(vid, (nan, 0))
+        score.append(sc)
+        count.append(n)
+
+    return Snapshot(
+        version=version,
+        base_version=0,
+        ids=np.frombuffer(bytes(ids), dtype=np.uint8).reshape(len(venues), 16),
+        lat=np.array(lat, dtype=np.int32),
+        lon=np.array(lon, dtype=np.int32),
+        name=np.array(name, dtype=np.uint32),
+        city=np.array(city, dtype=np.uint32),
+        cover=np.array(cover, dtype=np.uint32),
+        score=np.array(score, dtype=np.float32),
+        count=np.array(count, dtype=np.uint32),
+        flags=np.array(flags, dtype=np.uint8),
+        strings=strings.values,
+    )
+
+
+def make_delta(new: Snapshot, base: Snapshot) -> Snapshot:
+    # Emparejamos filas por id con arrays ordenados, sin diccionarios de un millón de entradas
+    base_ids, new_ids = base.id_keys(), new.id_keys()
+    order = np.argsort(base_ids)
+    sorted_ids = base_ids[order]
+    pos = np.minimum(np.searchsorted(sorted_ids, new_ids), max(len(base) - 1, 0))
+    found = (sorted_ids[pos] == new_ids) if len(base) else np.zeros(len(new), dtype=bool)
+    changed = ~found
+    if len(base):
+        changed[found] = base.row_keys()[order[pos[found]]] != new.row_keys()[found]
+    keep = np.flatnonzero(changed)
+
+    gone_ids = np.setdiff1d(base_ids, new_ids)
+    gone = np.frombuffer(gone_ids.tobytes(), dtype=np.uint8).reshape(len(gone_ids), 16)
+    m = len(gone)
+    strings = Interner()
+    strings("")
+
+    def remap(col: np.ndarray) -> np.ndarray:
+        return np.array([strings(new.strings[j]) for j in col[keep]], dtype=np.uint32)
+
+    return Snapshot(
+        version=new.version,
+        base_version=base.version,
+        ids=np.concatenate([new.ids[keep], gone]),
+        lat=np.concatenate([new.lat[keep], np.full(m, LAT_NULL, dtype=np.int32)]),
+        lon=np.concatenate([new.lon[keep], np.full(m, LAT_NULL, dtype=np.int32)]),
+        name=np.concatenate([remap(new.name), np.zeros(m, dtype=np.uint32)]),
+        city=np.concatenate([remap(new.city), np.zeros(m, dtype=np.uint32)]),
+        cover=np.concatenate([remap(new.cover), np.zeros(m, dtype=np.uint32)]),
+        score=np.concatenate([new.score[keep], np.full(m, np.nan, dtype=np.float32)]),
+        count=np.concatenate([new.count[keep], np.zeros(m, dtype=np.uint32)]),
+        flags=np.concatenate([new.flags[keep], np.full(m, ROW_DELETED, dtype=np.uint8)]),
+        strings=strings.values,
+    )
+
+
+def _strings_blob(strings: list[str]) -> bytes:
+    enc = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(enc) + 1, dtype=np.uint32)
+    np.cumsum([len(b) for b in enc], out=offsets[1:])
+    return struct.pack("<I", len(enc)) + offsets.tobytes() + b"".join(enc)
+
+
+def write_snapshot(snap: Snapshot, path: Path) -> int:
+    sections = [
+        (b"ID\0\0", snap.ids.tobytes()),
+        (b"LAT\0", snap.lat.astype("<i4").tobytes()),
+        (b"LON\0", snap.lon.astype("<i4").tobytes()),
+        (b"NAME", snap.name.astype("<u4").tobytes()),
+        (b"CITY", snap.city.astype("<u4").tobytes()),
+        (b"COVR", snap.cover.astype("<u4").tobytes()),
+        (b"SCOR", snap.score.astype("<f4").tobytes()),
+        (b"CNT\0", snap.count.astype("<u4").tobytes()),
+        (b"FLAG", snap.flags.tobytes()),
+        (b"STRS", _strings_blob(snap.strings)),
+    ]
+    flags = FLAG_DELTA if snap.base_version else 0
+    head = HEADER.pack(MAGIC, FORMAT_VERSION, flags, snap.version, snap.base_version, len(snap), len(sections))
+    offset = len(head) + SECTION.size * len(sections)
+    table = b""
+    body = []
+    for tag, data in sections:
+        # Alineado a 4 bytes: el cliente puede mapear las columnas como Int32Array/Float32Array
+        pad = (-offset) % 4
+        body.append(b"\0" * pad)
+        offset += pad
+        table += SECTION.pack(tag, offset, len(data))
+        body.append(data)
+        offset += len(data)
+
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(head)
+        f.write(table)
+        for b in body:
+            f.write(b)
+    tmp.replace(path)
+    return offset
+
+
+def read_snapshot(path: Path) -> Snapshot:
+    buf = path.read_bytes()
+    magic, fmt, _flags, version, base_version, n, n_sec = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError(f"No es un snapshot de venues: {path}")
+    if fmt != FORMAT_VERSION:
+        raise ValueError(f"Formato {fmt} no soportado (esperado {FORMAT_VERSION})")
+    sec = {}
+    for i in range(n_sec):
+        tag, off, length = SECTION.unpack_from(buf, HEADER.size + i * SECTION.size)
+        sec[tag.rstrip(b"\0").decode("ascii")] = buf[off : off + length]
+
+    strs = sec["STRS"]
+    (n_str,) = struct.unpack_from("<I", strs, 0)
+    offsets = np.frombuffer(strs, dtype="<u4", count=n_str + 1, offset=4)
+    blob = strs[4 + 4 * (n_str + 1) :]
+    strings = [blob[offsets[i] : offsets[i + 1]].decode("utf-8") for i in range(n_str)]
+
+    return Snapshot(
+        version=version,
+        base_version=base_version,
+        ids=np.frombuffer(sec["ID"], dtype=np.uint8).reshape(n, 16),
+        lat=np.frombuffer(sec["LAT"], dtype="<i4"),
+        lon=np.frombuffer(sec["LON"], dtype="<i4"),
+        name=np.frombuffer(sec["NAME"], dtype="<u4"),
+        city=np.frombuffer(sec["CITY"], dtype="<u4"),
+        cover=np.frombuffer(sec["COVR"], dtype="<u4"),
+        score=np.frombuffer(sec["SCOR"], dtype="<f4"),
+        count=np.frombuffer(sec["CNT"], dtype="<u4"),
+        flags=np.frombuffer(sec["FLAG"], dtype=np.uint8),
+        strings=strings,
+    )
+
+
+def load_stats(path: Path) -> dict[str, tuple[float, int]]:
+    out = {}
+    for r in _read_csv(path):
+        vid = (r.get("venue_id") or "").strip()
+        sc = _float(r.get("bayes_score"))
+        if vid and sc is not None:
+            out[vid] = (sc, int(_float(r.get("ratings_count")) or 0))
+    return out
+
+
+def load_coords(paths: list[Path], store_path: str) -> dict[str, tuple[float, float]]:
+    """Coordenadas de respaldo para venues exportados sin lat/lon: salidas de geocoder y --store."""
+    out: dict[str, tuple[float, float]] = {}
+    if store_path:
+        with CoordStore(store_path) as store:
+            for b in store.iter_best():
+                if b.settled:
+                    out[b.venue_id] = (b.lat, b.lon)
+    for p in paths:
+        for r in _read_csv(p):
+            la, lo = _float(r.get("lat")), _float(r.get("lon"))
+            vid = (r.get("venue_id") or "").strip()
+            if vid and la is not None and lo is not None:
+                out[vid] = (la, lo)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Exporta un snapshot binario columnar de venues (completo o delta)")
+    ap.add_argument("--venues", required=True, help="Export de venues (id/venue_id, name, city, cover_photo_path, lat, lon)")
+    ap.add_argument("--stats", default="", help="Export de vw_venue_stats_all_time_current (venue_id, bayes_score, ratings_count)")
+    ap.add_argument("--coords", nargs="*", default=[], help="Salidas de geocoder para venues sin lat/lon")
+    ap.add_argument("--store", default="", help="SQLite de coord_store.py para venues sin lat/lon")
+    ap.add_argument("--version", type=int, default=0, help="Versión del snapshot (por defecto, epoch actual)")
+    ap.add_argument("--base", default="", help="Snapshot anterior: escribe solo el delta respecto a él")
+    ap.add_argument("--out", default="venues_snapshot.bin")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    venues = _read_csv(Path(args.venues))
+    stats = load_stats(Path(args.stats)) if args.stats else {}
+    coords = load_coords([Path(p) for p in args.coords], args.store)
+    t1 = time.perf_counter()
+
+    snap = build_snapshot(venues, stats, coords, args.version or int(time.time()))
+    kind = "completo"
+    if args.base:
+        base = read_snapshot(Path(args.base))
+        if base.base_version:
+            ap.error("--base debe ser un snapshot completo, no un delta")
+        snap = make_delta(snap, base)
+        kind = f"delta {base.version} -> {snap.version}"
+    size = write_snapshot(snap, Path(args.out))
+    t2 = time.perf_counter()
+
+    with_coords = int((snap.flags & ROW_HAS_COORDS).astype(bool).sum())
+    deleted = int((snap.flags & ROW_DELETED).astype(bool).sum())
+    print(f"Venues: {len(venues)} (carga {t1 - t0:.2f}s, snapshot {t2 - t1:.2f}s)")
+    print(f"Snapshot {kind}: filas={len(snap)} con_coords={with_coords} borrados={deleted} strings={len(snap.strings)}")
+    print(f"Generado: {args.out} ({size / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()